@@ -0,0 +1,100 @@
+"""Load benchmark for the bot's /start path and balance writes.
+
+Drives AirdropBot.start with synthetic Telegram updates against a throwaway
+database and reports sustained updates per second plus latency percentiles,
+then hammers update_user_balance to measure durable write throughput and how
+many writes the group commit packs into each transaction. Outbound messages go
+to a no-op bot, so the numbers measure the handler and database layer only.
+
+    python benchmark.py --updates 5000 --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+
+class NullBot:
+    async def send_message(self, **kwargs):
+        pass
+
+    async def send_document(self, **kwargs):
+        pass
+
+
+def make_update(user_id: int):
+    user = SimpleNamespace(id=user_id, first_name=f"user{user_id}")
+    return SimpleNamespace(message=SimpleNamespace(from_user=user, chat_id=user_id, text="/start"))
+
+
+async def run_start(bot, updates: int, concurrency: int):
+    airdrop_bot = bot.AirdropBot()
+    context = bot.BotContext("telegram")
+    context.bot = NullBot()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(user_id):
+        async with semaphore:
+            started = time.perf_counter()
+            await airdrop_bot.start(make_update(user_id), context)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(100000 + i) for i in range(updates)))
+    return time.perf_counter() - started, latencies
+
+
+async def run_balance_writes(bot, updates: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(user_id):
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.update_user_balance(str(user_id), 10)
+            latencies.append(time.perf_counter() - started)
+
+    await bot.db.flush()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(100000 + i % 1000) for i in range(updates)))
+    return time.perf_counter() - started, latencies
+
+
+def report(name: str, elapsed: float, latencies: list):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{name}: {len(latencies)} updates in {elapsed:.2f}s -> {len(latencies) / elapsed:.0f} updates/s "
+          f"(p50 {p50:.1f} ms, p99 {p99:.1f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    # The database location must be set before bot.py is imported.
+    workdir = tempfile.mkdtemp(prefix="airdrop-bench-")
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.db")
+    import bot
+
+    elapsed, latencies = asyncio.run(run_start(bot, args.updates, args.concurrency))
+    report("/start", elapsed, latencies)
+    cache = bot.profile_cache.stats()
+    print(f"profile cache: {cache['hits']} hits, {cache['misses']} misses "
+          f"({cache['hits'] / args.updates:.1f} user-row SELECTs saved per update)")
+    commits, ops = bot.db.stats["commits"], bot.db.stats["ops"]
+    elapsed, latencies = asyncio.run(run_balance_writes(bot, args.updates, args.concurrency))
+    report("update_user_balance", elapsed, latencies)
+    commits, ops = bot.db.stats["commits"] - commits, bot.db.stats["ops"] - ops
+    print(f"group commit: {ops} writes in {commits} transactions ({ops / max(commits, 1):.1f} writes/commit)")
+    bot.db.close()
+
+
+if __name__ == "__main__":
+    main()
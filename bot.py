@@ -3,29 +3,51 @@ import random
 import asyncio
 import sqlite3
 import logging
+import threading
+import queue
+import time
 import re
+import csv
+import gzip
+import tempfile
+import heapq
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
 from datetime import datetime, timedelta
+from contextlib import contextmanager
+from functools import lru_cache, partial, wraps
 from typing import Optional, Union
+from urllib.parse import urlparse
+from aiohttp import web
 import discord
 from discord.ext import commands as discord_commands
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, RetryAfter
 from web3 import Web3, Account
 import requests
 from solders.keypair import Keypair
 from solders.pubkey import Pubkey
 from solders.transaction import Transaction
-from solders.system_program import TransferParams, transfer
 from solders.message import Message
+from solders.instruction import Instruction, AccountMeta
+from solders.hash import Hash
+from solders.compute_budget import set_compute_unit_limit
 from openpyxl import Workbook
 from dotenv import load_dotenv
-from ratelimit import limits, sleep_and_retry
 import json
+import base64
 import hashlib
 import pytz
 from xrpl.clients import JsonRpcClient
+from xrpl.asyncio.clients.utils import json_to_response, request_to_json_rpc
 from xrpl.wallet import Wallet
-from xrpl.models.transactions import Payment
+from xrpl.models.transactions import Payment, AccountSet
+from xrpl.models.requests import AccountInfo, SubmitOnly, Tx
+from xrpl.transaction import sign as xrpl_sign
+from xrpl.ledger import get_fee, get_latest_validated_ledger_sequence
+from xrpl.core.binarycodec import encode as xrpl_encode, decode as xrpl_decode
 from xrpl.utils import xrp_to_drops
 
 # Load environment variables
@@ -43,34 +65,747 @@ SOL_SENDER_PRIVATE_KEY = os.getenv('SOL_SENDER_PRIVATE_KEY')
 XRP_SENDER_ADDRESS = os.getenv('XRP_SENDER_ADDRESS')
 XRP_SENDER_SEED = os.getenv('XRP_SENDER_SEED')
 TOKEN_CONTRACT_ADDRESS = os.getenv('TOKEN_CONTRACT_ADDRESS')
+SOL_TOKEN_MINT = os.getenv('SOL_TOKEN_MINT')
+DISPERSE_CONTRACT_ADDRESS = os.getenv('DISPERSE_CONTRACT_ADDRESS')
+NFT_CONTRACT_ADDRESS = os.getenv('NFT_CONTRACT_ADDRESS')
+MULTICALL3_ADDRESS = os.getenv('MULTICALL3_ADDRESS', '0xcA11bde05977b3631167028862bE2a173976CA11')
 BOT_USERNAME = os.getenv('BOT_USERNAME', 'tigerr_airdrop_bot')
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', '10'))
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '10000'))
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', '300'))
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '10000'))
+SESSION_TTL = float(os.getenv('SESSION_TTL', '3600'))
+SESSION_PERSIST = os.getenv('SESSION_PERSIST', '1') == '1'
+DISTRIBUTION_CONCURRENCY = int(os.getenv('DISTRIBUTION_CONCURRENCY', '32'))
+DISTRIBUTION_GAS_BATCH = int(os.getenv('DISTRIBUTION_GAS_BATCH', '500'))
+EVM_TRANSFER_GAS = int(os.getenv('EVM_TRANSFER_GAS', '100000'))
+RECEIPT_TIMEOUT = float(os.getenv('RECEIPT_TIMEOUT', '600'))
+DISPERSE_GAS_LIMIT = int(os.getenv('DISPERSE_GAS_LIMIT', '6000000'))
+DISPERSE_MAX_BATCH = int(os.getenv('DISPERSE_MAX_BATCH', '500'))
+XRP_LEDGER_BATCH = int(os.getenv('XRP_LEDGER_BATCH', '100'))
+XRP_LAST_LEDGER_OFFSET = int(os.getenv('XRP_LAST_LEDGER_OFFSET', '20'))
+SOL_BLOCKHASH_BATCH = int(os.getenv('SOL_BLOCKHASH_BATCH', '50'))
+ELIGIBILITY_BATCH = int(os.getenv('ELIGIBILITY_BATCH', '500'))
+ELIGIBILITY_CONCURRENCY = int(os.getenv('ELIGIBILITY_CONCURRENCY', '16'))
+ELIGIBILITY_CACHE_SIZE = int(os.getenv('ELIGIBILITY_CACHE_SIZE', '50000'))
+ELIGIBILITY_CACHE_TTL = float(os.getenv('ELIGIBILITY_CACHE_TTL', '300'))
+SNAPSHOT_BATCH = int(os.getenv('SNAPSHOT_BATCH', '1000'))
+SNAPSHOT_CONCURRENCY = int(os.getenv('SNAPSHOT_CONCURRENCY', '4'))
+RPC_TIMEOUT = float(os.getenv('RPC_TIMEOUT', '30'))
+RPC_POOL_SIZE = int(os.getenv('RPC_POOL_SIZE', '32'))
+RPC_COOLDOWN = float(os.getenv('RPC_COOLDOWN', '30'))
+RPC_HEDGE_AFTER = float(os.getenv('RPC_HEDGE_AFTER', '1.0'))
+# key=rate/burst per second, keys being a platform, a chain, chain:method or an RPC host
+RATE_LIMITS = os.getenv('RATE_LIMITS', 'telegram=30/30,discord=50/50')
+CHAT_RATE = float(os.getenv('CHAT_RATE', '1'))
+CHAT_BURST = float(os.getenv('CHAT_BURST', '3'))
+GROUP_CHAT_RATE = float(os.getenv('GROUP_CHAT_RATE', str(20 / 60)))
+SEND_CONCURRENCY = int(os.getenv('SEND_CONCURRENCY', '64'))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+BROADCAST_CHUNK = int(os.getenv('BROADCAST_CHUNK', '500'))
+EXPORT_CHUNK = int(os.getenv('EXPORT_CHUNK', '1000'))
+AUTO_APPROVE_INTERVAL = float(os.getenv('AUTO_APPROVE_INTERVAL', '60'))
+REVIEW_PAGE_SIZE = int(os.getenv('REVIEW_PAGE_SIZE', '10'))
+REVIEW_COUNT_TTL = float(os.getenv('REVIEW_COUNT_TTL', '30'))
+REFERRAL_GRAPH_SIZE = int(os.getenv('REFERRAL_GRAPH_SIZE', '10'))
+REFERRAL_FANOUT_ALERT = int(os.getenv('REFERRAL_FANOUT_ALERT', '20'))
+# The web dyno must answer on $PORT on all interfaces; elsewhere the endpoint stays local. Port 0 disables it.
+# Only the web process serves metrics by default, so a worker on the same host does not fight it for
+# the port; give a worker its own METRICS_PORT to scrape it too.
+PROCESS_TYPE = os.getenv('PROCESS_TYPE', 'web')
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0' if os.getenv('PORT') else '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', os.getenv('PORT', '9100') if PROCESS_TYPE == 'web' else '0'))
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))
+
+# Metrics
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _sample_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+class Counter:
+    """A value per label set, exported in the Prometheus text format. Safe to update from
+    any thread. set() is for totals mirrored from another component's stats()."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, _labels(self.labelnames, labels), value
+
+class Gauge(Counter):
+    kind = "gauge"
+
+class Histogram:
+    """Observations per label set in fixed cumulative buckets, plus their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # One slot per bucket, one for +Inf, then the sum.
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, values in series:
+            count = 0
+            for bound, hits in zip(bounds, values):
+                count += hits
+                yield f"{self.name}_bucket", _labels(self.labelnames, labels, f'le="{bound}"'), count
+            yield f"{self.name}_sum", _labels(self.labelnames, labels), values[-1]
+            yield f"{self.name}_count", _labels(self.labelnames, labels), count
+
+class MetricsRegistry:
+    """The metrics served on /metrics. Collectors are coroutines run before each scrape to
+    refresh gauges that are cheaper to read on demand than to keep current."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    async def render(self) -> str:
+        for collect in self.collectors:
+            try:
+                await collect()
+            except Exception as e:
+                logger.warning(f"Metrics collector {collect.__name__} failed: {str(e)}")
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_sample_value(value)}" for name, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+HANDLER_SECONDS = metrics.histogram("airdrop_handler_seconds", "Time spent handling one command, message or callback.", ("kind", "handler"))
+HANDLER_ERRORS = metrics.counter("airdrop_handler_errors_total", "Handlers that raised.", ("kind", "handler"))
+DB_SECONDS = metrics.histogram("airdrop_db_statement_seconds", "SQLite execution time per statement.", ("mode", "statement"))
+DB_COMMIT_SECONDS = metrics.histogram("airdrop_db_commit_seconds", "Time to apply and commit one group-commit batch.")
+DB_WRITES = metrics.counter("airdrop_db_writes_total", "Write operations committed.")
+DB_COMMITS = metrics.counter("airdrop_db_commits_total", "Write transactions committed.")
+RPC_SECONDS = metrics.histogram("airdrop_rpc_seconds", "JSON-RPC request latency per chain, method and outcome.", ("chain", "method", "outcome"))
+RPC_HEDGED = metrics.counter("airdrop_rpc_hedged_total", "Slow reads hedged to a second endpoint.", ("chain",))
+RPC_ENDPOINT_UP = metrics.gauge("airdrop_rpc_endpoint_up", "0 while an RPC endpoint is cooling down after a failure.", ("chain", "host"))
+SEND_QUEUE = metrics.gauge("airdrop_send_queue", "Outbound messages queued or being sent.", ("platform", "state"))
+MESSAGES = metrics.counter("airdrop_messages_total", "Outbound messages by outcome.", ("platform", "outcome"))
+RATE_LIMIT_WAITING = metrics.gauge("airdrop_rate_limit_waiting", "Calls currently waiting on a rate-limit bucket.", ("bucket",))
+RATE_LIMIT_CALLS = metrics.counter("airdrop_rate_limit_calls_total", "Calls that took a token from a rate-limit bucket.", ("bucket",))
+RATE_LIMIT_DELAYED = metrics.counter("airdrop_rate_limit_delayed_total", "Calls a rate-limit bucket made wait.", ("bucket",))
+RATE_LIMIT_WAIT_SECONDS = metrics.counter("airdrop_rate_limit_wait_seconds_total", "Time calls spent waiting on a rate-limit bucket.", ("bucket",))
+DISTRIBUTION_ROWS = metrics.gauge("airdrop_distribution_rows", "Rows of the running distribution job by status.", ("status",))
+LOOP_LAG = metrics.histogram("airdrop_event_loop_lag_seconds", "How late the event loop wakes a sleeping task.",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+@lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    # One label per statement: whitespace collapsed and IN (?, ?, ...) lists folded, so
+    # chunked queries do not get a label per chunk size.
+    return re.sub(r"\?(\s*,\s*\?)+", "?, ...", " ".join(sql.split()))
+
+def instrumented(kind: str, name: str):
+    """Record a handler coroutine's latency and failures in HANDLER_SECONDS/HANDLER_ERRORS."""
+    def decorate(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(kind, name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, kind, name)
+        return wrapper
+    return decorate
 
 # Blockchain Setup
-web3_eth = Web3(Web3.HTTPProvider(ETH_RPC_URL))
-web3_bsc = Web3(Web3.HTTPProvider(BSC_RPC_URL))
-solana_client = requests.Session()
-solana_client.headers.update({"Content-Type": "application/json"})
-xrp_client = JsonRpcClient(XRP_RPC_URL)
+class RpcEndpoint:
+    """One JSON-RPC URL with its own keep-alive connection pool and a rolling window of
+    request latencies and outcomes. An endpoint that fails at the transport level (timeout,
+    connection error, HTTP error, rate limited) is cooled down and ranked last until the
+    cooldown ends.
+    """
+
+    WINDOW = 512
+
+    def __init__(self, url: str, session):
+        self.url = url
+        self.session = session
+        self.host = urlparse(url).netloc
+        self.requests = 0
+        self.errors = 0
+        self.down_until = 0.0
+        self._latencies = deque(maxlen=self.WINDOW)
+        self._outcomes = deque(maxlen=self.WINDOW)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool, cooldown: float = 0.0):
+        with self._lock:
+            self.requests += 1
+            self._outcomes.append(ok)
+            if ok:
+                self._latencies.append(latency)
+            else:
+                self.errors += 1
+                self.down_until = time.monotonic() + cooldown
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))] if latencies else 0.0
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+    def rank(self, now: float) -> tuple:
+        # Healthy endpoints by error-weighted median latency (unmeasured ones first, so they
+        # get measured); cooled-down endpoints after them, soonest to recover first.
+        if self.down_until > now:
+            return 1, self.down_until
+        return 0, self.percentile(0.5) * (1 + 10 * self.error_rate())
+
+    def hedge_delay(self, limit: float) -> float:
+        # Hedge once the primary is slower than its own p95, but never wait longer than limit.
+        return min(limit, self.percentile(0.95)) if len(self._latencies) >= 20 else limit
+
+    def stats(self) -> dict:
+        return {"url": self.url, "requests": self.requests, "errors": self.errors, "error_rate": self.error_rate(),
+                "p50": self.percentile(0.5), "p99": self.percentile(0.99), "down": self.down_until > time.monotonic()}
+
+class RpcPool:
+    """JSON-RPC client over several endpoints for one chain. Each request goes to the
+    healthiest endpoint and fails over to the next on a transport error; JSON-RPC error
+    responses are the node's answer and are returned as they are. Reads that the primary
+    has not answered within its hedge delay are also sent to the runner-up and the first
+    answer wins; writes (WRITE_METHODS) are never hedged, only failed over, which is safe
+    because a signed transaction has the same hash wherever it is submitted.
+
+    session_factory(pool_size) builds each endpoint's HTTP session, so tests can point the
+    pool at local mock JSON-RPC servers or hand in fake sessions. The threads that race a
+    hedged read are only created for a pool that hedges, and no more than one per pooled
+    connection of an endpoint.
+    """
+
+    WRITE_METHODS = frozenset({"eth_sendRawTransaction", "eth_sendTransaction", "sendTransaction", "submit", "submit_multisigned"})
+    BUSY_CODES = frozenset({-32005, 429})  # rate limited, reported in a 200 response by some providers
+
+    def __init__(self, name: str, urls, session_factory=None, timeout: float = RPC_TIMEOUT, pool_size: int = RPC_POOL_SIZE,
+                 cooldown: float = RPC_COOLDOWN, hedge_after: float = RPC_HEDGE_AFTER):
+        if isinstance(urls, str):
+            urls = [url.strip() for url in urls.split(",") if url.strip()]
+        self.name = name
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.hedge_after = hedge_after
+        self.hedged = 0
+        self.pool_size = pool_size
+        self.endpoints = [RpcEndpoint(url, (session_factory or self._session)(pool_size)) for url in urls]
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @staticmethod
+    def _session(pool_size: int) -> requests.Session:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Content-Type": "application/json"})
+        return session
+
+    @property
+    def url(self) -> str:
+        return self.endpoints[0].url
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix=f"rpc-{self.name.lower()}")
+        return self._executor
+
+    def ranked(self) -> list:
+        now = time.monotonic()
+        return sorted(self.endpoints, key=lambda endpoint: endpoint.rank(now))
+
+    def _post(self, endpoint: RpcEndpoint, method: str, body) -> dict:
+        rate_limiter.acquire_blocking(self.name, f"{self.name}:{method}", endpoint.host)
+        started = time.perf_counter()
+        try:
+            response = endpoint.session.post(endpoint.url, data=body, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+            error = result.get("error") if isinstance(result, dict) else None
+            if isinstance(error, dict) and error.get("code") in self.BUSY_CODES:
+                raise ConnectionError(f"{endpoint.url} is rate limiting: {error.get('message')}")
+        except Exception:
+            elapsed = time.perf_counter() - started
+            endpoint.record(elapsed, False, self.cooldown)
+            RPC_SECONDS.observe(elapsed, self.name, method, "error")
+            raise
+        elapsed = time.perf_counter() - started
+        endpoint.record(elapsed, True)
+        RPC_SECONDS.observe(elapsed, self.name, method, "ok")
+        return result
+
+    def _failover(self, endpoints: list, method: str, body, error: Optional[Exception] = None) -> dict:
+        for endpoint in endpoints:
+            try:
+                return self._post(endpoint, method, body)
+            except Exception as e:
+                logger.warning(f"{self.name} RPC {endpoint.url} failed: {str(e)}")
+                error = e
+        raise error
+
+    def _hedged(self, endpoints: list, method: str, body) -> dict:
+        primary = self.executor.submit(self._post, endpoints[0], method, body)
+        done, _ = wait_futures([primary], timeout=endpoints[0].hedge_delay(self.hedge_after))
+        if done and primary.exception() is None:
+            return primary.result()
+        error = primary.exception() if done else None
+        pending = set() if done else {primary}
+        if not done:
+            self.hedged += 1
+            RPC_HEDGED.inc(self.name)
+        pending.add(self.executor.submit(self._post, endpoints[1], method, body))
+        while pending:
+            done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        return self._failover(endpoints[2:], method, body, error)
+
+    def request(self, method: str, body) -> dict:
+        """POST one JSON-RPC request (a dict, or an already encoded body) and return the decoded response."""
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        endpoints = self.ranked()
+        if (self.hedge_after > 0 and len(endpoints) > 1 and method not in self.WRITE_METHODS
+                and endpoints[1].down_until <= time.monotonic()):
+            return self._hedged(endpoints, method, body)
+        return self._failover(endpoints, method, body)
+
+    def stats(self) -> dict:
+        return {"hedged": self.hedged, "endpoints": [endpoint.stats() for endpoint in self.endpoints]}
+
+class PooledHTTPProvider(Web3.HTTPProvider):
+    """web3 provider that sends every request through an RpcPool."""
+
+    def __init__(self, pool: RpcPool):
+        super().__init__(pool.url)
+        self.pool = pool
+
+    def make_request(self, method, params):
+        return self.pool.request(method, self.encode_rpc_request(method, params))
+
+class PooledJsonRpcClient(JsonRpcClient):
+    """xrpl-py client that sends every request through an RpcPool instead of opening a new
+    HTTP connection per request."""
+
+    def __init__(self, pool: RpcPool):
+        super().__init__(pool.url)
+        self.pool = pool
+
+    async def _request_impl(self, request, **kwargs):
+        # pool.request blocks for the whole round trip (and any failover), so keep it off the event loop.
+        body = request_to_json_rpc(request)
+        return json_to_response(await asyncio.to_thread(self.pool.request, body["method"], body))
+
+eth_rpc = RpcPool("ETH", ETH_RPC_URL)
+bsc_rpc = RpcPool("BSC", BSC_RPC_URL)
+sol_rpc = RpcPool("SOL", SOL_RPC_URL)
+xrp_rpc = RpcPool("XRP", XRP_RPC_URL)
+rpc_pools = {"ETH": eth_rpc, "BSC": bsc_rpc, "SOL": sol_rpc, "XRP": xrp_rpc}
+web3_eth = Web3(PooledHTTPProvider(eth_rpc))
+web3_bsc = Web3(PooledHTTPProvider(bsc_rpc))
+xrp_client = PooledJsonRpcClient(xrp_rpc)
+
+def log_rpc_stats():
+    for name, pool in rpc_pools.items():
+        stats = pool.stats()
+        for endpoint in stats["endpoints"]:
+            if endpoint["requests"]:
+                logger.info(f"{name} RPC {endpoint['url']}: {endpoint['requests']} requests, p50 {endpoint['p50'] * 1000:.0f} ms, "
+                            f"p99 {endpoint['p99'] * 1000:.0f} ms, {endpoint['error_rate']:.1%} errors{' (cooling down)' if endpoint['down'] else ''}")
+        if stats["hedged"]:
+            logger.info(f"{name} RPC: {stats['hedged']} slow reads hedged to a second endpoint")
+    for key, bucket in rate_limiter.stats().items():
+        if bucket["delayed"]:
+            logger.info(f"Rate limit {key}: {bucket['delayed']} of {bucket['acquired']} calls delayed, "
+                        f"{bucket['waited']:.1f}s total wait, {bucket['max_wait']:.2f}s max, {bucket['waiting']} waiting")
 
 # ERC-20 Token ABI
 TOKEN_ABI = [
     {"constant": False, "inputs": [{"name": "_to", "type": "address"}, {"name": "_value", "type": "uint256"}],
      "name": "transfer", "outputs": [{"name": "", "type": "bool"}], "type": "function"},
     {"constant": True, "inputs": [{"name": "_owner", "type": "address"}], "name": "balanceOf",
-     "outputs": [{"name": "balance", "type": "uint256"}], "type": "function"}
+     "outputs": [{"name": "balance", "type": "uint256"}], "type": "function"},
+    {"constant": False, "inputs": [{"name": "_spender", "type": "address"}, {"name": "_value", "type": "uint256"}],
+     "name": "approve", "outputs": [{"name": "", "type": "bool"}], "type": "function"},
+    {"constant": True, "inputs": [{"name": "_owner", "type": "address"}, {"name": "_spender", "type": "address"}],
+     "name": "allowance", "outputs": [{"name": "", "type": "uint256"}], "type": "function"}
 ]
 token_contract_eth = web3_eth.eth.contract(address=TOKEN_CONTRACT_ADDRESS, abi=TOKEN_ABI)
 token_contract_bsc = web3_bsc.eth.contract(address=TOKEN_CONTRACT_ADDRESS, abi=TOKEN_ABI)
 
+# Disperse contract ABI (disperse.app): one transferFrom per recipient inside a single transaction
+DISPERSE_ABI = [
+    {"constant": False, "inputs": [{"name": "token", "type": "address"}, {"name": "recipients", "type": "address[]"},
+                                   {"name": "values", "type": "uint256[]"}],
+     "name": "disperseToken", "outputs": [], "type": "function"}
+]
+disperse_contract_eth = web3_eth.eth.contract(address=DISPERSE_CONTRACT_ADDRESS, abi=DISPERSE_ABI) if DISPERSE_CONTRACT_ADDRESS else None
+disperse_contract_bsc = web3_bsc.eth.contract(address=DISPERSE_CONTRACT_ADDRESS, abi=DISPERSE_ABI) if DISPERSE_CONTRACT_ADDRESS else None
+
+# ERC-721 NFT ABI (tiers are derived from the holder's NFT count)
+NFT_ABI = [
+    {"constant": True, "inputs": [{"name": "owner", "type": "address"}], "name": "balanceOf",
+     "outputs": [{"name": "", "type": "uint256"}], "type": "function"}
+]
+nft_contract_eth = web3_eth.eth.contract(address=NFT_CONTRACT_ADDRESS, abi=NFT_ABI) if NFT_CONTRACT_ADDRESS else None
+nft_contract_bsc = web3_bsc.eth.contract(address=NFT_CONTRACT_ADDRESS, abi=NFT_ABI) if NFT_CONTRACT_ADDRESS else None
+
+# Multicall3 ABI (same address on Ethereum and BSC): many read calls in one eth_call
+MULTICALL3_ABI = [
+    {"inputs": [{"components": [{"name": "target", "type": "address"}, {"name": "callData", "type": "bytes"}],
+                 "name": "calls", "type": "tuple[]"}],
+     "name": "aggregate", "outputs": [{"name": "blockNumber", "type": "uint256"}, {"name": "returnData", "type": "bytes[]"}],
+     "stateMutability": "payable", "type": "function"}
+]
+multicall_eth = web3_eth.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+multicall_bsc = web3_bsc.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+
+# Solana programs and JSON-RPC
+SYSTEM_PROGRAM_ID = Pubkey.from_string("11111111111111111111111111111111")
+TOKEN_PROGRAM_ID = Pubkey.from_string("TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA")
+ASSOCIATED_TOKEN_PROGRAM_ID = Pubkey.from_string("ATokenGPvbdGVxr1b2hvZbsiqW5xWH25efTNsLJA8knL")
+
+def get_associated_token_address(owner: Pubkey, mint: Pubkey) -> Pubkey:
+    return Pubkey.find_program_address([bytes(owner), bytes(TOKEN_PROGRAM_ID), bytes(mint)], ASSOCIATED_TOKEN_PROGRAM_ID)[0]
+
+class SolanaRpcError(Exception):
+    """A JSON-RPC error response: the node answered and rejected the request."""
+
+    def __init__(self, method: str, error: dict):
+        super().__init__(f"{method}: {error.get('message', error)}")
+        self.code = error.get("code")
+
+def solana_rpc(method: str, params: list, pool: RpcPool = sol_rpc):
+    body = pool.request(method, {"jsonrpc": "2.0", "id": 1, "method": method, "params": params})
+    if "error" in body:
+        raise SolanaRpcError(method, body["error"])
+    return body["result"]
+
 # Logging Setup
 logging.basicConfig(filename='airdrop_bot.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# SQLite Setup with Schema Migration
-conn = sqlite3.connect('airdrop.db', check_same_thread=False)
-cursor = conn.cursor()
+# Background Tasks
+# The event loop only keeps weak references to tasks, so fire-and-forget work is held here
+# until it finishes; a task that fails is logged instead of disappearing with its exception.
+background_tasks = set()
+
+def _background_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task {task.get_name()} failed: {task.exception()!r}")
+
+def spawn(coro, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+# SQLite Setup
+DB_PATH = os.getenv('DB_PATH', 'airdrop.db')
+DB_READERS = int(os.getenv('DB_READERS', '4'))
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', '256'))
+DB_BATCH_DELAY_MS = float(os.getenv('DB_BATCH_DELAY_MS', '2'))
+
+def connect_db(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA busy_timeout=30000")
+    return connection
+
+class Database:
+    """Awaitable SQLite access that keeps blocking I/O off the event loop.
+
+    Reads run on a small thread pool, each thread holding its own WAL connection, so
+    readers never wait on the writer. All writes are serialized through one writer
+    thread and one connection. The writer group-commits: it drains whatever is queued
+    (up to batch_size ops, waiting at most batch_delay seconds for stragglers) and
+    applies it in a single transaction, each op inside its own savepoint so one
+    failing op does not roll back its neighbours. Awaiting a write therefore means
+    awaiting the commit that contains it.
+    """
+
+    def __init__(self, path: str, readers: int = 4, batch_size: int = 256, batch_delay: float = 0.002):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.stats = {"commits": 0, "ops": 0}
+        self._local = threading.local()
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self._writer.start()
+
+    def _reader_connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = connect_db(self.path)
+            connection.execute("PRAGMA query_only=1")
+            self._local.connection = connection
+        return connection
+
+    async def read(self, fn, label: Optional[str] = None):
+        label = label or fn.__qualname__
+
+        def run():
+            started = time.perf_counter()
+            try:
+                return fn(self._reader_connection())
+            finally:
+                DB_SECONDS.observe(time.perf_counter() - started, "read", label)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, run)
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.read(lambda c: c.execute(sql, params).fetchone(), statement_label(sql))
+
+    async def fetchall(self, sql: str, params=()) -> list:
+        return await self.read(lambda c: c.execute(sql, params).fetchall(), statement_label(sql))
+
+    async def fetchval(self, sql: str, params=(), default=None):
+        row = await self.fetchone(sql, params)
+        return row[0] if row else default
+
+    def submit(self, fn, label: Optional[str] = None) -> Future:
+        future = Future()
+        self._writes.put((fn, future, label or fn.__qualname__))
+        return future
+
+    async def write(self, fn, label: Optional[str] = None):
+        return await asyncio.wrap_future(self.submit(fn, label))
+
+    async def execute(self, sql: str, params=()) -> int:
+        return await self.write(lambda c: c.execute(sql, params).rowcount, statement_label(sql))
+
+    async def executemany(self, sql: str, seq_of_params) -> int:
+        return await self.write(lambda c: c.executemany(sql, seq_of_params).rowcount, statement_label(sql))
+
+    def defer(self, sql: str, params=()) -> Future:
+        # Write-behind: queue the statement without waiting for its commit. Only for
+        # writes nobody reads back immediately; balance changes must be awaited.
+        future = self.submit(lambda c: c.execute(sql, params).rowcount, statement_label(sql))
+        future.add_done_callback(_log_deferred_failure)
+        return future
+
+    async def flush(self):
+        await self.write(lambda c: None, "flush")
+
+    async def execute_batch(self, statements) -> None:
+        statements = list(statements)
+
+        def run(c):
+            for sql, params in statements:
+                c.execute(sql, params)
+        await self.write(run, f"batch: {statement_label(statements[0][0])}" if statements else None)
+
+    def _next_batch(self) -> list:
+        batch = [self._writes.get()]
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            try:
+                batch.append(self._writes.get_nowait())
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._writes.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def _commit_batch(self, connection: sqlite3.Connection, batch: list):
+        live = [(fn, future, label) for fn, future, label in batch if future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        outcomes = []
+        started = time.perf_counter()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for fn, future, label in live:
+                connection.execute("SAVEPOINT op")
+                op_started = time.perf_counter()
+                try:
+                    result = fn(connection)
+                except Exception as e:
+                    connection.execute("ROLLBACK TO op")
+                    outcomes.append((future, None, e))
+                else:
+                    outcomes.append((future, result, None))
+                DB_SECONDS.observe(time.perf_counter() - op_started, "write", label)
+                connection.execute("RELEASE op")
+            connection.execute("COMMIT")
+        except Exception as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            logger.error(f"Database batch of {len(live)} writes failed: {str(e)}")
+            for fn, future, label in live:
+                future.set_exception(e)
+            return
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+        self.stats["commits"] += 1
+        self.stats["ops"] += len(live)
+        DB_COMMITS.inc()
+        DB_WRITES.inc(amount=len(live))
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _writer_loop(self):
+        connection = connect_db(self.path)
+        connection.execute("PRAGMA synchronous=FULL")
+        while True:
+            batch = self._next_batch()
+            stopping = batch[-1] is None
+            self._commit_batch(connection, [item for item in batch if item is not None])
+            if stopping:
+                break
+        connection.close()
+
+    def close(self):
+        self._writes.put(None)
+        self._writer.join()
+        self._readers.shutdown(wait=True)
+
+def _log_deferred_failure(future: Future):
+    if future.exception() is not None:
+        logger.error(f"Deferred database write failed: {str(future.exception())}")
 
-cursor.executescript('''
+# Schema Migrations
+# Each migration is (version, description, SQL script or callable taking the connection).
+# Applied versions are recorded in schema_version; append new entries, never edit old ones.
+def _add_users_kyc_x_link(connection: sqlite3.Connection):
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(users)")}
+    if "kyc_x_link" not in columns:
+        connection.execute("ALTER TABLE users ADD COLUMN kyc_x_link TEXT")
+
+def _add_referral_graph(connection: sqlite3.Connection):
+    # Per-referrer referral counts kept current by triggers; a callable because the
+    # trigger bodies contain semicolons.
+    connection.execute("CREATE TABLE IF NOT EXISTS referral_graph (referrer_id TEXT PRIMARY KEY, total INTEGER NOT NULL DEFAULT 0, "
+                       "pending INTEGER NOT NULL DEFAULT 0, approved INTEGER NOT NULL DEFAULT 0, rejected INTEGER NOT NULL DEFAULT 0, "
+                       "first_at TEXT, last_at TEXT)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_referral_graph_total ON referral_graph (total DESC)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_referrals_referrer_time ON referrals (referrer_id, timestamp)")
+    connection.execute("INSERT OR REPLACE INTO referral_graph (referrer_id, total, pending, approved, rejected, first_at, last_at) "
+                       "SELECT referrer_id, COUNT(*), SUM(status = 'pending'), SUM(status = 'approved'), SUM(status = 'rejected'), "
+                       "MIN(timestamp), MAX(timestamp) FROM referrals GROUP BY referrer_id")
+    connection.execute('''
+        CREATE TRIGGER IF NOT EXISTS referral_graph_insert AFTER INSERT ON referrals BEGIN
+            INSERT INTO referral_graph (referrer_id, total, pending, approved, rejected, first_at, last_at)
+            VALUES (NEW.referrer_id, 1, NEW.status = 'pending', NEW.status = 'approved', NEW.status = 'rejected', NEW.timestamp, NEW.timestamp)
+            ON CONFLICT(referrer_id) DO UPDATE SET total = total + 1, pending = pending + excluded.pending,
+                approved = approved + excluded.approved, rejected = rejected + excluded.rejected,
+                first_at = MIN(COALESCE(first_at, excluded.first_at), excluded.first_at),
+                last_at = MAX(COALESCE(last_at, excluded.last_at), excluded.last_at);
+        END''')
+    connection.execute('''
+        CREATE TRIGGER IF NOT EXISTS referral_graph_status AFTER UPDATE OF status ON referrals WHEN OLD.status IS NOT NEW.status BEGIN
+            UPDATE referral_graph SET pending = pending + (NEW.status = 'pending') - (OLD.status = 'pending'),
+                approved = approved + (NEW.status = 'approved') - (OLD.status = 'approved'),
+                rejected = rejected + (NEW.status = 'rejected') - (OLD.status = 'rejected')
+            WHERE referrer_id = NEW.referrer_id;
+        END''')
+    connection.execute('''
+        CREATE TRIGGER IF NOT EXISTS referral_graph_delete AFTER DELETE ON referrals BEGIN
+            UPDATE referral_graph SET total = total - 1, pending = pending - (OLD.status = 'pending'),
+                approved = approved - (OLD.status = 'approved'), rejected = rejected - (OLD.status = 'rejected')
+            WHERE referrer_id = OLD.referrer_id;
+        END''')
+
+MIGRATIONS = [
+    (1, "baseline schema", '''
     CREATE TABLE IF NOT EXISTS users (
         user_id TEXT PRIMARY KEY, username TEXT, language TEXT, referral_code TEXT, referred_by TEXT,
         kyc_status TEXT DEFAULT 'pending', agreed_terms INTEGER, momo_balance REAL DEFAULT 0,
@@ -94,44 +829,115 @@ cursor.executescript('''
         task_id TEXT,
         timestamp TEXT
     );
-''')
-
-try:
-    cursor.execute("ALTER TABLE users ADD COLUMN kyc_x_link TEXT")
-except sqlite3.OperationalError:
-    pass
-conn.commit()
-
-# Config Initialization
-cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("total_supply", "1000000"))
-cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("tier_1_amount", "1000"))
-cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("tier_2_amount", "2000"))
-cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("tier_3_amount", "5000"))
-cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("referral_bonus", "15"))
-cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("min_token_balance", "100"))
-cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("vesting_period_days", "30"))
-conn.commit()
-
-# Sample Campaign and Daily Tasks
-cursor.execute("INSERT OR IGNORE INTO campaigns (name, start_date, end_date, total_tokens, active) VALUES (?, ?, ?, ?, ?)",
-               ("Launch Airdrop", datetime.utcnow().isoformat(), (datetime.utcnow() + timedelta(days=7)).isoformat(), 1000000, 1))
-conn.commit()
-
-cursor.executescript("DELETE FROM daily_tasks")  # Reset for consistency
-daily_tasks = [
-    ("Watch YouTube Video", 10, 0, "https://youtube.com/example"),
-    ("Watch Facebook Video", 10, 0, "https://facebook.com/example"),
-    ("Visit Website", 10, 0, "https://example.com"),
-    ("Join Telegram", 10, 1, "https://t.me/examplegroup"),
-    ("Subscribe Telegram Channel", 10, 1, "https://t.me/examplechannel"),
-    ("Subscribe YouTube Channel", 10, 0, "https://youtube.com/channel/example"),
-    ("Follow Twitter", 10, 0, "https://twitter.com/example"),
-    ("Follow Facebook", 10, 0, "https://facebook.com/examplepage")
+    '''),
+    (2, "users.kyc_x_link for databases created before X links", _add_users_kyc_x_link),
+    (3, "secondary indexes for hot query predicates", '''
+        CREATE INDEX IF NOT EXISTS idx_users_balance ON users (momo_balance DESC);
+        CREATE INDEX IF NOT EXISTS idx_users_kyc_submitted ON users (kyc_submission_time, user_id) WHERE kyc_status = 'submitted';
+        CREATE INDEX IF NOT EXISTS idx_task_completions_status ON task_completions (status, completion_date, user_id, task_id);
+        CREATE INDEX IF NOT EXISTS idx_task_completions_approved ON task_completions (user_id, task_id) WHERE status = 'approved';
+        CREATE INDEX IF NOT EXISTS idx_referrals_status ON referrals (status, timestamp, referee_id);
+        CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals (referrer_id, status);
+        CREATE INDEX IF NOT EXISTS idx_eligible_verified ON eligible (user_id, tier) WHERE verified = 1;
+        CREATE INDEX IF NOT EXISTS idx_daily_tasks_active ON daily_tasks (active, mandatory);
+        CREATE INDEX IF NOT EXISTS idx_distributions_status ON distributions (status);
+        CREATE INDEX IF NOT EXISTS idx_campaigns_active ON campaigns (active);
+    '''),
+    (4, "resumable distribution jobs", '''
+        CREATE TABLE IF NOT EXISTS distribution_jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, campaign_id INTEGER, status TEXT, created_at TEXT, updated_at TEXT);
+        CREATE TABLE IF NOT EXISTS distribution_txs (tx_hash TEXT PRIMARY KEY, job_id INTEGER, chain TEXT, nonce INTEGER, raw_tx BLOB, created_at TEXT);
+        ALTER TABLE distributions ADD COLUMN job_id INTEGER;
+        ALTER TABLE distributions ADD COLUMN idempotency_key TEXT;
+        ALTER TABLE distributions ADD COLUMN error TEXT;
+        ALTER TABLE distributions ADD COLUMN updated_at TEXT;
+        UPDATE distributions SET status = 'confirmed' WHERE status = 'claimable';
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_distributions_idempotency ON distributions (idempotency_key);
+        CREATE INDEX IF NOT EXISTS idx_distributions_job ON distributions (job_id, chain, status);
+        CREATE INDEX IF NOT EXISTS idx_distribution_jobs_status ON distribution_jobs (status);
+    '''),
+    (5, "point-in-time balance snapshots", '''
+        CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY AUTOINCREMENT, campaign_id INTEGER, status TEXT, heights TEXT, total INTEGER, done INTEGER DEFAULT 0, created_at TEXT, updated_at TEXT);
+        CREATE TABLE IF NOT EXISTS snapshot_balances (snapshot_id INTEGER, user_id TEXT, wallet TEXT, chain TEXT, tier INTEGER, token_balance REAL, height INTEGER, PRIMARY KEY (snapshot_id, user_id));
+        CREATE INDEX IF NOT EXISTS idx_snapshots_campaign ON snapshots (campaign_id, status);
+    '''),
+    (6, "broadcasts", '''
+        CREATE TABLE IF NOT EXISTS broadcasts (id INTEGER PRIMARY KEY AUTOINCREMENT, audience TEXT, template TEXT, status TEXT, cursor TEXT DEFAULT '', delivered INTEGER DEFAULT 0, blocked INTEGER DEFAULT 0, failed INTEGER DEFAULT 0, created_at TEXT, updated_at TEXT);
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (broadcast_id INTEGER, user_id TEXT, status TEXT, error TEXT, PRIMARY KEY (broadcast_id, user_id));
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status);
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_audience ON broadcasts (audience);
+    '''),
+    (7, "per-user conversation sessions", '''
+        CREATE TABLE IF NOT EXISTS sessions (platform TEXT, user_id TEXT, data TEXT, updated_at TEXT, PRIMARY KEY (platform, user_id));
+        CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at);
+    '''),
+    (8, "referral graph: per-referrer counts maintained by triggers", _add_referral_graph),
+    (9, "running distribution jobs are looked up per campaign", '''
+        DROP INDEX IF EXISTS idx_distribution_jobs_status;
+        CREATE INDEX IF NOT EXISTS idx_distribution_jobs_status ON distribution_jobs (status, campaign_id);
+    '''),
 ]
-for description, reward, mandatory, task_link in daily_tasks:
-    cursor.execute("INSERT OR IGNORE INTO daily_tasks (description, reward, mandatory, task_link, active) VALUES (?, ?, ?, ?, 1)",
-                   (description, reward, mandatory, task_link))
-conn.commit()
+
+def run_migrations(connection: sqlite3.Connection):
+    connection.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT, applied_at TEXT)")
+    current = connection.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if callable(migration):
+                migration(connection)
+            else:
+                for statement in migration.split(";"):
+                    if statement.strip():
+                        connection.execute(statement)
+            connection.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                               (version, description, datetime.utcnow().isoformat()))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            logger.error(f"Schema migration {version} ({description}) failed")
+            raise
+        logger.info(f"Applied schema migration {version}: {description}")
+
+def init_db(path: str):
+    connection = connect_db(path)
+    run_migrations(connection)
+    cursor = connection.cursor()
+
+    # Config Initialization
+    cursor.execute("BEGIN")
+    cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("total_supply", "1000000"))
+    cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("tier_1_amount", "1000"))
+    cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("tier_2_amount", "2000"))
+    cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("tier_3_amount", "5000"))
+    cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("referral_bonus", "15"))
+    cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("min_token_balance", "100"))
+    cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("vesting_period_days", "30"))
+
+    # Sample Campaign and Daily Tasks
+    cursor.execute("INSERT OR IGNORE INTO campaigns (name, start_date, end_date, total_tokens, active) VALUES (?, ?, ?, ?, ?)",
+                   ("Launch Airdrop", datetime.utcnow().isoformat(), (datetime.utcnow() + timedelta(days=7)).isoformat(), 1000000, 1))
+
+    cursor.execute("DELETE FROM daily_tasks")  # Reset for consistency
+    daily_tasks = [
+        ("Watch YouTube Video", 10, 0, "https://youtube.com/example"),
+        ("Watch Facebook Video", 10, 0, "https://facebook.com/example"),
+        ("Visit Website", 10, 0, "https://example.com"),
+        ("Join Telegram", 10, 1, "https://t.me/examplegroup"),
+        ("Subscribe Telegram Channel", 10, 1, "https://t.me/examplechannel"),
+        ("Subscribe YouTube Channel", 10, 0, "https://youtube.com/channel/example"),
+        ("Follow Twitter", 10, 0, "https://twitter.com/example"),
+        ("Follow Facebook", 10, 0, "https://facebook.com/examplepage")
+    ]
+    for description, reward, mandatory, task_link in daily_tasks:
+        cursor.execute("INSERT OR IGNORE INTO daily_tasks (description, reward, mandatory, task_link, active) VALUES (?, ?, ?, ?, 1)",
+                       (description, reward, mandatory, task_link))
+    cursor.execute("COMMIT")
+    connection.close()
+
+init_db(DB_PATH)
+db = Database(DB_PATH, readers=DB_READERS, batch_size=DB_BATCH_SIZE, batch_delay=DB_BATCH_DELAY_MS / 1000)
 
 # Multi-Language Support
 LANGUAGES = {
@@ -168,6 +974,7 @@ LANGUAGES = {
         "join_airdrop": "Join the airdrop below (mandatory: Join Telegram, Subscribe Telegram Channel, KYC):",
         "eligibility": "Eligibility: {status}",
         "leaderboard": "Leaderboard (Top Momo Coin Earners):\n{leaders}",
+        "leaderboard_rank": "You are #{rank:,} of {total:,}.",
         "mandatory_missing": "Complete mandatory tasks (Join Telegram, Subscribe Telegram Channel) and KYC to join airdrop.",
         "campaign_set": "Campaign '{name}' set! Start: {start}, End: {end}, Tokens: {tokens}",
         "campaign_edit": "Campaign '{name}' updated! Start: {start}, End: {end}, Tokens: {tokens}",
@@ -187,26 +994,288 @@ LANGUAGES = {
 }
 
 # Rate Limiting
-CALLS_PER_MINUTE = 10
-PERIOD = 60
+class TokenBucket:
+    """rate tokens per second up to burst. reserve() takes tokens immediately and returns how
+    long the caller must wait for them, so waiters are served in arrival order without a
+    queue and the bucket works from coroutines and worker threads alike.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.acquired = 0
+        self.delayed = 0
+        self.waiting = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - tokens
+            self._updated = now
+            self.acquired += 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if delay:
+                self.delayed += 1
+                self.waited += delay
+                self.max_wait = max(self.max_wait, delay)
+            return delay
+
+    def refund(self, tokens: float = 1.0):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + tokens)
+
+    def hold(self, seconds: float):
+        # Nothing more is granted for seconds, e.g. after the remote side asked us to back off.
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        with self._lock:
+            available = min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate)
+            return (tokens - available) / self.rate if available < tokens else 0.0
+
+    def track(self, waiting: int):
+        with self._lock:
+            self.waiting += waiting
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "acquired": self.acquired, "delayed": self.delayed,
+                "waiting": self.waiting, "waited": self.waited, "max_wait": self.max_wait}
+
+class RateLimiter:
+    """Named token buckets shared by RPC calls and outbound chat sends. A call names every
+    key that applies to it (e.g. chain, chain:method and RPC host) and waits for the slowest
+    of the configured ones; keys without a bucket are unlimited. Only the calling coroutine
+    or worker thread waits, never the event loop.
+    """
+
+    def __init__(self, spec: str = ""):
+        self.buckets = {}
+        for item in filter(None, (item.strip() for item in spec.split(","))):
+            key, limit = item.rsplit("=", 1)
+            rate, _, burst = limit.partition("/")
+            self.configure(key.strip(), float(rate), float(burst or rate))
+
+    def configure(self, key: str, rate: float, burst: Optional[float] = None):
+        self.buckets[key] = TokenBucket(rate, burst or rate)
+
+    def _reserve(self, keys, tokens: float) -> tuple:
+        buckets = [self.buckets[key] for key in keys if key in self.buckets]
+        delays = [bucket.reserve(tokens) for bucket in buckets]
+        return [bucket for bucket, delay in zip(buckets, delays) if delay], max(delays, default=0.0)
+
+    async def acquire(self, *keys, tokens: float = 1.0) -> float:
+        waiting, delay = self._reserve(keys, tokens)
+        if delay:
+            for bucket in waiting:
+                bucket.track(1)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                for bucket in waiting:
+                    bucket.refund(tokens)
+                raise
+            finally:
+                for bucket in waiting:
+                    bucket.track(-1)
+        return delay
+
+    def acquire_blocking(self, *keys, tokens: float = 1.0) -> float:
+        waiting, delay = self._reserve(keys, tokens)
+        if delay:
+            for bucket in waiting:
+                bucket.track(1)
+            try:
+                time.sleep(delay)
+            finally:
+                for bucket in waiting:
+                    bucket.track(-1)
+        return delay
+
+    def stats(self) -> dict:
+        return {key: bucket.stats() for key, bucket in self.buckets.items()}
+
+rate_limiter = RateLimiter(RATE_LIMITS)
+
+class MessageDispatcher:
+    """Outbound messages for one platform under a global budget (the platform's
+    rate_limiter bucket) and a per-chat budget (chat_rate per second with chat_burst;
+    group chats, which have negative Telegram ids, get group_rate).
+
+    Interactive sends go out immediately when both budgets have a token, and otherwise wait
+    only for their own tokens. Bulk sends are queued per chat and drained round-robin by a
+    worker that only takes tokens that are free right now, so interactive replies always get
+    the next token ahead of any bulk backlog while bulk still runs at the allowed maximum.
+    A RetryAfter/429 holds the chat back and pauses bulk sending for the requested time
+    before the message is retried.
+    """
+
+    MAX_CHATS = 100000
+    SCAN = 256
+
+    def __init__(self, platform: str, chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST,
+                 group_rate: float = GROUP_CHAT_RATE, concurrency: int = SEND_CONCURRENCY, max_retries: int = SEND_MAX_RETRIES):
+        self.platform = platform
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.queued = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._chats = OrderedDict()  # chat_id -> TokenBucket, least recently used first
+        self._bulk = OrderedDict()  # chat_id -> deque of (deliver, future), in round-robin order
+        self._bulk_paused_until = 0.0
+        self._worker = None
+        self._slots = None
+
+    @property
+    def budget(self) -> Optional[TokenBucket]:
+        return rate_limiter.buckets.get(self.platform)
+
+    def _chat(self, chat_id: str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if chat_id.startswith("-") else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+            if len(self._chats) > self.MAX_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        if isinstance(error, RetryAfter):
+            retry_after = error.retry_after
+            return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+        if isinstance(error, discord.HTTPException) and error.status == 429:
+            return float(getattr(error, "retry_after", None) or 1.0)
+        return None
 
-@sleep_and_retry
-@limits(calls=CALLS_PER_MINUTE, period=PERIOD)
-def rate_limited_request(url, payload):
-    return requests.post(url, json=payload).json()
+    async def _deliver(self, chat_id: str, deliver):
+        self.in_flight += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = await deliver()
+                    self.sent += 1
+                    return result
+                except Exception as e:
+                    delay = self._retry_after(e)
+                    if delay is None or attempt == self.max_retries:
+                        self.failed += 1
+                        raise
+                    self.retried += 1
+                    logger.warning(f"{self.platform} asked to retry chat {chat_id} after {delay}s")
+                    self._chat(chat_id).hold(delay)
+                    self._bulk_paused_until = max(self._bulk_paused_until, time.monotonic() + delay)
+                    await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+
+    async def send(self, chat_id: str, deliver, bulk: bool = False):
+        """Run deliver() under the chat and platform budgets and return its result."""
+        if bulk:
+            future = asyncio.get_running_loop().create_future()
+            self._bulk.setdefault(chat_id, deque()).append((deliver, future))
+            self.queued += 1
+            if self._worker is None:
+                self._worker = spawn(self._drain(), f"{self.platform} bulk sender")
+            return await future
+        budget = self.budget
+        delay = max(self._chat(chat_id).reserve(), budget.reserve() if budget else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        return await self._deliver(chat_id, deliver)
+
+    def _next_chat(self) -> tuple:
+        soonest = 1.0
+        for i, chat_id in enumerate(self._bulk):
+            if i == self.SCAN:
+                break
+            wait = self._chat(chat_id).wait_time()
+            if not wait:
+                return chat_id, 0.0
+            soonest = min(soonest, wait)
+        return None, soonest
+
+    async def _send_bulk(self, chat_id: str, deliver, future: asyncio.Future):
+        try:
+            result = await self._deliver(chat_id, deliver)
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    async def _drain(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        try:
+            while self._bulk:
+                budget = self.budget
+                wait = max(self._bulk_paused_until - time.monotonic(), budget.wait_time() if budget else 0.0)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                chat_id, wait = self._next_chat()
+                if chat_id is None:
+                    await asyncio.sleep(wait)
+                    continue
+                messages = self._bulk[chat_id]
+                deliver, future = messages.popleft()
+                if messages:
+                    self._bulk.move_to_end(chat_id)
+                else:
+                    del self._bulk[chat_id]
+                self.queued -= 1
+                if future.done():  # the sender gave up waiting, e.g. its broadcast was stopped
+                    continue
+                self._chat(chat_id).reserve()
+                if budget:
+                    budget.reserve()
+                await self._slots.acquire()
+                spawn(self._send_bulk(chat_id, deliver, future), f"{self.platform} bulk send to {chat_id}")
+        finally:
+            self._worker = None
+
+    def stats(self) -> dict:
+        return {"queued": self.queued, "in_flight": self.in_flight, "sent": self.sent, "failed": self.failed,
+                "retried": self.retried, "chats": len(self._chats)}
+
+dispatchers = {platform: MessageDispatcher(platform) for platform in ("telegram", "discord")}
 
 # Unified Context Class
 class BotContext:
     def __init__(self, platform: str, user_data: dict = None):
         self.platform = platform
-        self.user_data = user_data or {}
+        self.user_data = user_data if user_data is not None else {}
         self.bot = None
 
-    async def send_message(self, chat_id: str, text: str, reply_markup=None):
+    async def for_user(self, user_id: str) -> "BotContext":
+        """A context for one user's update whose user_data is that user's session."""
+        context = BotContext(self.platform, await sessions.get(self.platform, user_id))
+        context.bot = self.bot
+        return context
+
+    async def send_message(self, chat_id: str, text: str, reply_markup=None, bulk: bool = False):
+        """Send through the platform's dispatcher; bulk messages queue behind interactive ones."""
+        return await dispatchers[self.platform].send(str(chat_id), partial(self._send_message, chat_id, text, reply_markup), bulk)
+
+    async def _send_message(self, chat_id: str, text: str, reply_markup=None):
         try:
             if self.platform == "telegram":
-                # Add rate limiting for Telegram
-                await asyncio.sleep(0.1)  # Small delay to avoid rate limits
                 await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode='Markdown')
             elif self.platform == "discord":
                 channel = self.bot.get_channel(int(chat_id)) if chat_id.isdigit() else await self.bot.fetch_user(int(chat_id))
@@ -215,20 +1284,21 @@ class BotContext:
                     raise Exception(f"Invalid chat_id: {chat_id}")
                 if reply_markup:
                     text += "\n\nOptions:\n" + "\n".join([f"- {btn[0].text} (!Birdz {btn[0].callback_data})" for btn in reply_markup.inline_keyboard])
-                # Add rate limiting for Discord
-                await asyncio.sleep(0.1)  # Small delay to avoid rate limits
                 await (channel.send(text) if isinstance(channel, discord.abc.Messageable) else channel.send(text))
         except Exception as e:
             logger.error(f"Error in send_message (platform: {self.platform}, chat_id: {chat_id}): {str(e)}")
             raise
 
-    async def send_document(self, chat_id: str, document):
+    async def send_document(self, chat_id: str, document, filename: Optional[str] = None):
+        return await dispatchers[self.platform].send(str(chat_id), partial(self._send_document, chat_id, document, filename))
+
+    async def _send_document(self, chat_id: str, document, filename: Optional[str] = None):
         if self.platform == "telegram":
-            await self.bot.send_document(chat_id=chat_id, document=document)
+            await self.bot.send_document(chat_id=chat_id, document=document, filename=filename)
         elif self.platform == "discord":
             channel = self.bot.get_channel(int(chat_id)) if chat_id.isdigit() else await self.bot.fetch_user(int(chat_id))
             if channel or isinstance(channel, discord.User):
-                await (channel.send(file=discord.File(document)) if isinstance(channel, discord.abc.Messageable) else channel.send(file=discord.File(document)))
+                await (channel.send(file=discord.File(document, filename=filename)) if isinstance(channel, discord.abc.Messageable) else channel.send(file=discord.File(document, filename=filename)))
 
 # Helper Functions
 def is_admin(user_id):
@@ -237,19 +1307,241 @@ def is_admin(user_id):
 def generate_referral_code(user_id):
     return f"https://t.me/{BOT_USERNAME}?start={user_id}" if BOT_USERNAME else f"!start {user_id}"
 
-def get_user_language(user_id: str) -> str:
-    cursor.execute("SELECT language FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    return result[0] if result and result[0] in LANGUAGES else "en"
+PROFILE_COLUMNS = ("username", "language", "kyc_status", "agreed_terms", "momo_balance", "has_seen_menu", "joined_groups")
+
+class ProfileCache:
+    """Bounded LRU of users rows with a TTL, so the per-update helpers (language,
+    menu/group flags, balance, KYC status) share one SELECT instead of one each.
+
+    Writers keep it coherent: update() patches a cached row after a write, invalidate()
+    drops it. Concurrent misses for one user share a single load, and a load that races
+    an invalidate() is returned to its waiters but not cached.
+    """
+
+    def __init__(self, maxsize: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._profiles = OrderedDict()  # user_id -> (expires_at, profile)
+        self._pending = {}
+        self._stale = set()
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        entry = self._profiles.get(user_id)
+        if entry and entry[0] > time.monotonic():
+            self._profiles.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        pending = self._pending.get(user_id)
+        if pending is None:
+            pending = self._pending[user_id] = asyncio.ensure_future(self._load(user_id))
+        return await asyncio.shield(pending)
+
+    async def _load(self, user_id: str) -> Optional[dict]:
+        try:
+            row = await db.fetchone("SELECT username, language, kyc_status, agreed_terms, momo_balance, has_seen_menu, joined_groups FROM users WHERE user_id = ?", (user_id,))
+        finally:
+            del self._pending[user_id]
+            stale = user_id in self._stale
+            self._stale.discard(user_id)
+        profile = dict(zip(PROFILE_COLUMNS, row)) if row else None
+        if profile is not None and not stale:
+            self._store(user_id, profile)
+        return profile
+
+    def _store(self, user_id: str, profile: dict):
+        self._profiles[user_id] = (time.monotonic() + self.ttl, profile)
+        self._profiles.move_to_end(user_id)
+        while len(self._profiles) > self.maxsize:
+            self._profiles.popitem(last=False)
+
+    def prime(self, user_id: str, profile: dict):
+        if user_id not in self._profiles and user_id not in self._pending:
+            self._store(user_id, profile)
+
+    def update(self, user_id: str, **fields):
+        entry = self._profiles.get(user_id)
+        if entry:
+            entry[1].update(fields)
+        elif user_id in self._pending:
+            self._stale.add(user_id)
+
+    def invalidate(self, user_id: str):
+        self._profiles.pop(user_id, None)
+        if user_id in self._pending:
+            self._stale.add(user_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._profiles),
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+profile_cache = ProfileCache()
+
+class Session(dict):
+    """One user's conversation state; every change is reported to its store."""
+
+    __slots__ = ("store", "key", "touched_at")
+
+    def __init__(self, store: "SessionStore", key: tuple, data: Optional[dict] = None):
+        super().__init__(data or {})
+        self.store = store
+        self.key = key
+        self.touched_at = 0.0  # monotonic time its sessions row was last written
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        self.store.changed(self)
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self.store.changed(self)
+
+    def clear(self):
+        super().clear()
+        self.store.changed(self)
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self.store.changed(self)
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self.store.changed(self)
+        return item
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.store.changed(self)
+
+    def setdefault(self, name, default=None):
+        value = super().setdefault(name, default)
+        self.store.changed(self)
+        return value
+
+    def __ior__(self, other):
+        super().__ior__(other)
+        self.store.changed(self)
+        return self
+
+class SessionStore:
+    """Per-user conversation state (BotContext.user_data) keyed by (platform, user_id), so
+    concurrent users never share a flow. Sessions live in a bounded LRU and expire after
+    ttl seconds without use. With persist, changed sessions are written behind to the
+    sessions table (empty ones are deleted), so a flow survives restarts and LRU eviction
+    and a miss reloads it; rows idle for longer than ttl are purged. Reading a session
+    counts as use: its row's updated_at is refreshed at most once per ttl/2.
+    """
+
+    def __init__(self, maxsize: int = SESSION_CACHE_SIZE, ttl: float = SESSION_TTL, persist: bool = SESSION_PERSIST):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.persist = persist
+        self.hits = 0
+        self.misses = 0
+        self._sessions = OrderedDict()  # (platform, user_id) -> (expires_at, Session)
+        self._pending = {}
+        self._dirty = {}
+        self._flush_scheduled = False
+        self._purged_at = 0.0
+
+    async def get(self, platform: str, user_id: str) -> Session:
+        key = (platform, str(user_id))
+        entry = self._sessions.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            self._store(entry[1])
+            self._touch(entry[1])
+            return entry[1]
+        if entry:
+            del self._sessions[key]
+            entry[1].clear()  # expired: drop the persisted copy too
+        self.misses += 1
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(self._load(key))
+        return await asyncio.shield(pending)
 
-def get_user_balance(user_id: str) -> float:
-    cursor.execute("SELECT momo_balance FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    return result[0] if result else 0.0
+    async def _load(self, key: tuple) -> Session:
+        try:
+            row = None
+            if self.persist:
+                cutoff = (datetime.utcnow() - timedelta(seconds=self.ttl)).isoformat()
+                row = await db.fetchone("SELECT data FROM sessions WHERE platform = ? AND user_id = ? AND updated_at > ?", (*key, cutoff))
+        finally:
+            del self._pending[key]
+        session = Session(self, key, json.loads(row[0]) if row else None)
+        self._store(session)
+        self._touch(session)
+        return session
+
+    def _store(self, session: Session):
+        self._sessions[session.key] = (time.monotonic() + self.ttl, session)
+        self._sessions.move_to_end(session.key)
+        while len(self._sessions) > self.maxsize:
+            self._sessions.popitem(last=False)
+
+    def _touch(self, session: Session):
+        # Keep the row of a session that is read but not changed from being purged while it is still live here.
+        now = time.monotonic()
+        if self.persist and session and now - session.touched_at > self.ttl / 2:
+            session.touched_at = now
+            db.defer("UPDATE sessions SET updated_at = ? WHERE platform = ? AND user_id = ?",
+                     (datetime.utcnow().isoformat(), *session.key))
+
+    def changed(self, session: Session):
+        if session.key in self._sessions:
+            self._store(session)
+        if not self.persist:
+            return
+        self._dirty[session.key] = session
+        if not self._flush_scheduled:
+            # Coalesce every change made during this turn of the loop into one write per session.
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        dirty, self._dirty = self._dirty, {}
+        now = datetime.utcnow()
+        for (platform, user_id), session in dirty.items():
+            if session:
+                session.touched_at = time.monotonic()
+                db.defer("REPLACE INTO sessions (platform, user_id, data, updated_at) VALUES (?, ?, ?, ?)",
+                         (platform, user_id, json.dumps(session, default=str), now.isoformat()))
+            else:
+                db.defer("DELETE FROM sessions WHERE platform = ? AND user_id = ?", (platform, user_id))
+        if time.monotonic() - self._purged_at > self.ttl:
+            self._purged_at = time.monotonic()
+            db.defer("DELETE FROM sessions WHERE updated_at < ?", ((now - timedelta(seconds=self.ttl)).isoformat(),))
 
-def update_user_balance(user_id: str, amount: float):
-    cursor.execute("UPDATE users SET momo_balance = momo_balance + ? WHERE user_id = ?", (amount, user_id))
-    conn.commit()
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._sessions)}
+
+sessions = SessionStore()
+
+async def get_user_profile(user_id: str) -> Optional[dict]:
+    return await profile_cache.get(user_id)
+
+async def get_user_language(user_id: str) -> str:
+    profile = await get_user_profile(user_id)
+    return profile["language"] if profile and profile["language"] in LANGUAGES else "en"
+
+async def get_user_balance(user_id: str) -> float:
+    profile = await get_user_profile(user_id)
+    return profile["momo_balance"] if profile else 0.0
+
+def note_balance_change(user_id: str, amount: float):
+    # Call after a committed momo_balance change so the in-memory views follow the row.
+    leaderboard.credit(user_id, amount)
+    profile_cache.invalidate(user_id)
+
+async def update_user_balance(user_id: str, amount: float):
+    if await db.execute("UPDATE users SET momo_balance = momo_balance + ? WHERE user_id = ?", (amount, user_id)):
+        note_balance_change(user_id, amount)
 
 def is_valid_telegram_link(link: str) -> bool:
     return bool(re.match(r"^(@[a-zA-Z0-9_]{5,32}|https://t\.me/[a-zA-Z0-9_]{5,32})$", link))
@@ -274,68 +1566,1667 @@ def is_valid_address(wallet: str, chain: str) -> bool:
             return False
     return False
 
-def check_mandatory_tasks(user_id: str) -> bool:
-    cursor.execute("SELECT id FROM daily_tasks WHERE mandatory = 1")
-    mandatory_tasks = [row[0] for row in cursor.fetchall()]
-    for task_id in mandatory_tasks:
-        cursor.execute("SELECT status FROM task_completions WHERE user_id = ? AND task_id = ? AND status = 'approved'", (user_id, task_id))
-        if not cursor.fetchone():
-            return False
-    return True
+# Mandatory task ids change only when an admin edits tasks, so they are cached here
+# and every eligibility check becomes one aggregate query over task_completions.
+SQL_IN_CHUNK = 500
+_mandatory_task_ids: Optional[frozenset] = None
+
+async def get_mandatory_task_ids() -> frozenset:
+    global _mandatory_task_ids
+    if _mandatory_task_ids is None:
+        rows = await db.fetchall("SELECT id FROM daily_tasks WHERE mandatory = 1")
+        _mandatory_task_ids = frozenset(row[0] for row in rows)
+    return _mandatory_task_ids
+
+def invalidate_mandatory_tasks():
+    global _mandatory_task_ids
+    _mandatory_task_ids = None
+
+async def users_with_mandatory_tasks(user_ids) -> set:
+    user_ids = list(dict.fromkeys(user_ids))
+    task_ids = sorted(await get_mandatory_task_ids())
+    if not task_ids:
+        return set(user_ids)
+    task_marks = ", ".join("?" * len(task_ids))
+    completed = set()
+    for start in range(0, len(user_ids), SQL_IN_CHUNK):
+        chunk = user_ids[start:start + SQL_IN_CHUNK]
+        rows = await db.fetchall(
+            f"SELECT user_id FROM task_completions WHERE status = 'approved' AND task_id IN ({task_marks}) "
+            f"AND user_id IN ({', '.join('?' * len(chunk))}) GROUP BY user_id HAVING COUNT(DISTINCT task_id) = ?",
+            (*task_ids, *chunk, len(task_ids)))
+        completed.update(row[0] for row in rows)
+    return completed
+
+async def check_mandatory_tasks(user_id: str) -> bool:
+    return user_id in await users_with_mandatory_tasks([user_id])
+
+async def get_airdrop_ready_users() -> list:
+    # Verified wallet, verified KYC and every mandatory task approved, in one pass.
+    task_ids = sorted(await get_mandatory_task_ids())
+    rows = await db.fetchall(
+        f"SELECT e.user_id FROM eligible e JOIN users u ON u.user_id = e.user_id "
+        f"LEFT JOIN task_completions tc ON tc.user_id = e.user_id AND tc.status = 'approved' "
+        f"AND tc.task_id IN ({', '.join('?' * len(task_ids)) or 'NULL'}) "
+        f"WHERE e.verified = 1 AND u.kyc_status = 'verified' "
+        f"GROUP BY e.user_id HAVING COUNT(DISTINCT tc.task_id) = ?",
+        (*task_ids, len(task_ids)))
+    return [row[0] for row in rows]
+
+async def check_kyc_status(user_id: str) -> str:
+    profile = await get_user_profile(user_id)
+    return profile["kyc_status"] if profile else "pending"
+
+async def has_seen_menu(user_id: str) -> bool:
+    profile = await get_user_profile(user_id)
+    return profile["has_seen_menu"] == 1 if profile else False
+
+async def has_joined_groups(user_id: str) -> bool:
+    profile = await get_user_profile(user_id)
+    return profile["joined_groups"] == 1 if profile else False
+
+class Leaderboard:
+    """All user balances kept in one sorted list, so the top-K and any user's rank are
+    answered without touching SQLite. Seeded once from the users table, then kept in step
+    by every path that changes momo_balance (credit) or creates a user (track).
+    """
+
+    def __init__(self, size: int = LEADERBOARD_SIZE):
+        self.size = size
+        self.loaded = False
+        self._entries = []  # (-balance, user_id), ascending == highest balance first
+        self._balances = {}
+        self._names = {}
+        self._rendered = {}
+        self._load_lock = asyncio.Lock()
+
+    async def load(self):
+        async with self._load_lock:
+            if self.loaded:
+                return
+            rows = await db.fetchall("SELECT user_id, username, momo_balance FROM users")
+            self._balances = {user_id: balance or 0.0 for user_id, _, balance in rows}
+            self._names = {user_id: username for user_id, username, _ in rows}
+            self._entries = sorted((-balance, user_id) for user_id, balance in self._balances.items())
+            self._rendered.clear()
+            self.loaded = True
+            logger.info(f"Leaderboard seeded with {len(self._entries)} users")
+
+    def track(self, user_id: str, username: str):
+        if not self.loaded or user_id in self._balances:
+            return
+        self._balances[user_id] = 0.0
+        self._names[user_id] = username
+        self._place(user_id, None)
 
-def check_kyc_status(user_id: str) -> str:
-    cursor.execute("SELECT kyc_status FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    return result[0] if result else "pending"
+    def credit(self, user_id: str, amount: float):
+        if not self.loaded or user_id not in self._balances:
+            return
+        old_index = bisect_left(self._entries, (-self._balances[user_id], user_id))
+        del self._entries[old_index]
+        self._balances[user_id] += amount
+        self._place(user_id, old_index)
+
+    def _place(self, user_id: str, old_index: Optional[int]):
+        entry = (-self._balances[user_id], user_id)
+        new_index = bisect_left(self._entries, entry)
+        self._entries.insert(new_index, entry)
+        if new_index < self.size or (old_index is not None and old_index < self.size):
+            self._rendered.clear()
+
+    def rank(self, user_id: str) -> Optional[int]:
+        if user_id not in self._balances:
+            return None
+        return bisect_left(self._entries, (-self._balances[user_id], user_id)) + 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def render(self, lang: str) -> str:
+        text = self._rendered.get(lang)
+        if text is None:
+            leaders = [f"{i+1}. {self._names[user_id]} - {self._balances[user_id]} Momo Coins"
+                       for i, (_, user_id) in enumerate(self._entries[:self.size])]
+            text = LANGUAGES[lang]["leaderboard"].format(leaders="\n".join(leaders) if leaders else "No leaders yet.")
+            self._rendered[lang] = text
+        return text
+
+leaderboard = Leaderboard()
+
+async def get_leaderboard(lang: str, user_id: Optional[str] = None) -> str:
+    if not leaderboard.loaded:
+        await leaderboard.load()
+    text = leaderboard.render(lang)
+    rank = leaderboard.rank(user_id) if user_id else None
+    if rank:
+        text += "\n\n" + LANGUAGES[lang]["leaderboard_rank"].format(rank=rank, total=len(leaderboard))
+    return text
+
+class EligibilityService:
+    """Wallet eligibility without blocking the event loop. All RPC work runs on a private
+    thread pool and contract objects are built once. ETH/BSC token and NFT balances for a
+    whole batch of wallets come back from one Multicall3 aggregate call (falling back to
+    per-wallet calls if the aggregate fails), SOL balances from getMultipleAccounts, and
+    XRP account_info lookups run concurrently. Fetchers return wallet -> (tier,
+    token_balance, height), height being the block, ledger or slot the value was read at.
+
+    Results are cached per (wallet, chain) with that height for cache_ttl seconds, shared
+    by every caller; concurrent misses for one wallet share a single fetch and failed
+    reads are not cached. Snapshots pass fresh=True to read the chain regardless.
+
+    fetch() also takes a height to read ETH/BSC at a past block (historical eth_call, which
+    needs an archive node for anything older than the node's pruning window) and XRP at a
+    past validated ledger. Solana RPC has no historical account reads, so SOL is always
+    read at the current slot and the slot actually used is reported.
+    """
+
+    def __init__(self, concurrency: int = ELIGIBILITY_CONCURRENCY, batch_size: int = ELIGIBILITY_BATCH,
+                 cache_size: int = ELIGIBILITY_CACHE_SIZE, cache_ttl: float = ELIGIBILITY_CACHE_TTL):
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()  # (wallet, chain) -> (expires_at, (tier, token_balance, height))
+        self._pending = {}
+        self.evm = {"ETH": (web3_eth, token_contract_eth, nft_contract_eth, multicall_eth),
+                    "BSC": (web3_bsc, token_contract_bsc, nft_contract_bsc, multicall_bsc)}
+        self._sol_decimals = None
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="eligibility")
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
+
+    @staticmethod
+    def _evm_tier(nft_balance: int) -> int:
+        return min(3, max(1, nft_balance // 2))
+
+    @staticmethod
+    def eligible_tier(tier: int, token_balance: float, min_balance: float) -> int:
+        return tier if tier > 0 or token_balance >= min_balance else 0
+
+    def _fetch_evm_batch(self, chain: str, wallets: list, block: Optional[int] = None) -> dict:
+        web3, token, nft, multicall = self.evm[chain]
+        results, addresses = {}, {}
+        for wallet in wallets:
+            try:
+                addresses[wallet] = Web3.to_checksum_address(wallet)
+            except Exception:
+                results[wallet] = (0, 0.0, None)
+        calls = []
+        for address in addresses.values():
+            calls.append((token.address, token.encodeABI(fn_name="balanceOf", args=[address])))
+            if nft is not None:
+                calls.append((nft.address, nft.encodeABI(fn_name="balanceOf", args=[address])))
+        per_wallet = 2 if nft is not None else 1
+        try:
+            block, data = multicall.functions.aggregate(calls).call(block_identifier=block) if calls else (block, [])
+            for i, wallet in enumerate(addresses):
+                token_balance = web3.codec.decode(["uint256"], data[i * per_wallet])[0] / 10**18
+                nft_balance = web3.codec.decode(["uint256"], data[i * per_wallet + 1])[0] if nft is not None else 0
+                results[wallet] = (self._evm_tier(nft_balance), token_balance, block)
+        except Exception as e:
+            logger.error(f"Multicall balance read on {chain} failed, reading {len(addresses)} wallets one by one: {str(e)}")
+            block = block or web3.eth.block_number
+            for wallet, address in addresses.items():
+                try:
+                    token_balance = token.functions.balanceOf(address).call(block_identifier=block) / 10**18
+                    nft_balance = nft.functions.balanceOf(address).call(block_identifier=block) if nft is not None else 0
+                    results[wallet] = (self._evm_tier(nft_balance), token_balance, block)
+                except Exception as e:
+                    logger.error(f"Eligibility check failed for {wallet} on {chain}: {str(e)}")
+                    results[wallet] = (0, 0.0, None)
+        return results
+
+    def _fetch_xrp(self, wallet: str, ledger_index: Optional[int] = None) -> tuple:
+        try:
+            response = xrp_client.request(AccountInfo(account=wallet, ledger_index=ledger_index or "validated"))
+            if not response.is_successful():
+                return 0, 0.0, response.result.get("ledger_index")
+            xrp_balance = float(response.result["account_data"]["Balance"]) / 10**6
+            return min(3, max(1, int(xrp_balance // 10))), xrp_balance, response.result.get("ledger_index")
+        except Exception as e:
+            logger.error(f"Eligibility check failed for {wallet} on XRP: {str(e)}")
+            return 0, 0.0, None
+
+    def _fetch_sol_batch(self, wallets: list) -> dict:
+        results, keys = {}, {}
+        mint = Pubkey.from_string(SOL_TOKEN_MINT) if SOL_TOKEN_MINT else None
+        for wallet in wallets:
+            try:
+                owner = Pubkey.from_string(wallet)
+                keys[wallet] = str(get_associated_token_address(owner, mint) if mint else owner)
+            except Exception:
+                results[wallet] = (0, 0.0, None)
+        if mint is not None and self._sol_decimals is None:
+            self._sol_decimals = solana_rpc("getTokenSupply", [str(mint)])["value"]["decimals"]
+        for start in range(0, len(keys), 100):
+            chunk = list(keys.items())[start:start + 100]
+            try:
+                response = solana_rpc("getMultipleAccounts", [[key for _, key in chunk], {"encoding": "base64", "commitment": "confirmed"}])
+            except Exception as e:
+                logger.error(f"Eligibility check failed for {len(chunk)} SOL wallets: {str(e)}")
+                results.update((wallet, (0, 0.0, None)) for wallet, _ in chunk)
+                continue
+            slot = response["context"]["slot"]
+            for (wallet, _), account in zip(chunk, response["value"]):
+                if account is None:
+                    balance = 0.0
+                elif mint is not None:
+                    # SPL token account layout: mint (32) | owner (32) | amount (u64 LE) | ...
+                    balance = int.from_bytes(base64.b64decode(account["data"][0])[64:72], "little") / 10**self._sol_decimals
+                else:
+                    balance = account["lamports"] / 10**9
+                results[wallet] = (1, balance, slot)
+        return results
 
-def has_seen_menu(user_id: str) -> bool:
-    cursor.execute("SELECT has_seen_menu FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    return result[0] == 1 if result else False
+    async def fetch(self, chain: str, wallets: list, height: Optional[int] = None) -> dict:
+        wallets = list(dict.fromkeys(wallets))
+        if chain in self.evm:
+            batches = [wallets[i:i + self.batch_size] for i in range(0, len(wallets), self.batch_size)]
+            results = {}
+            for batch in await asyncio.gather(*(self._call(self._fetch_evm_batch, chain, batch, height) for batch in batches)):
+                results.update(batch)
+            return results
+        if chain == "SOL":
+            return await self._call(self._fetch_sol_batch, wallets)
+        if chain == "XRP":
+            return dict(zip(wallets, await asyncio.gather(*(self._call(self._fetch_xrp, wallet, height) for wallet in wallets))))
+        return {wallet: (0, 0.0, None) for wallet in wallets}
 
-def has_joined_groups(user_id: str) -> bool:
-    cursor.execute("SELECT joined_groups FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    return result[0] == 1 if result else False
+    async def _fetch_many(self, keys: list) -> dict:
+        by_chain = {}
+        for wallet, chain in keys:
+            by_chain.setdefault(chain, []).append(wallet)
+        fetched = await asyncio.gather(*(self.fetch(chain, chain_wallets) for chain, chain_wallets in by_chain.items()))
+        expires_at = time.monotonic() + self.cache_ttl
+        balances = {}
+        for chain, chain_balances in zip(by_chain, fetched):
+            for wallet, balance in chain_balances.items():
+                balances[(wallet, chain)] = balance
+                if balance[2] is not None:
+                    self._cache[(wallet, chain)] = (expires_at, balance)
+                    self._cache.move_to_end((wallet, chain))
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return balances
 
-def get_leaderboard(lang: str) -> str:
-    cursor.execute("SELECT username, momo_balance FROM users ORDER BY momo_balance DESC LIMIT 10")
-    leaders = [f"{i+1}. {row[0]} - {row[1]} Momo Coins" for i, row in enumerate(cursor.fetchall())]
-    return LANGUAGES[lang]["leaderboard"].format(leaders="\n".join(leaders) if leaders else "No leaders yet.")
+    async def balances(self, wallets, fresh: bool = False) -> dict:
+        """(wallet, chain) pairs -> (tier, token_balance, height) before the minimum balance rule."""
+        now = time.monotonic()
+        balances, missing, waiting = {}, [], {}
+        for key in dict.fromkeys(wallets):
+            entry = None if fresh else self._cache.get(key)
+            if entry and entry[0] > now:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                balances[key] = entry[1]
+            elif not fresh and key in self._pending:
+                self.hits += 1
+                waiting[key] = self._pending[key]
+            else:
+                self.misses += 1
+                missing.append(key)
+        if missing:
+            future = asyncio.ensure_future(self._fetch_many(missing))
+            for key in missing:
+                self._pending[key] = future
+
+            def release(done, keys=missing):
+                for key in keys:
+                    if self._pending.get(key) is done:
+                        del self._pending[key]
+            future.add_done_callback(release)
+            waiting.update((key, future) for key in missing)
+        for key, future in waiting.items():
+            balances[key] = (await asyncio.shield(future))[key]
+        return balances
+
+    async def check_many(self, wallets, fresh: bool = False) -> dict:
+        """(wallet, chain) pairs -> (tier, token_balance); tier 0 means not eligible."""
+        balances = await self.balances(wallets, fresh)
+        min_balance = float(await db.fetchval("SELECT value FROM config WHERE key = 'min_token_balance'", default=0))
+        return {key: (self.eligible_tier(tier, token_balance, min_balance), token_balance)
+                for key, (tier, token_balance, _) in balances.items()}
+
+    async def check(self, wallet: str, chain: str, fresh: bool = False) -> tuple[int, float]:
+        return (await self.check_many([(wallet, chain)], fresh))[(wallet, chain)]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache),
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+eligibility = EligibilityService()
 
 async def check_eligibility(wallet: str, chain: str) -> tuple[int, float]:
-    try:
-        token_balance = 0.0
-        tier = 0
-        if chain == "ETH":
-            nft_contract_address = "your-nft-contract-address"  # Replace
-            nft_abi = []  # Replace with NFT ABI
-            nft_contract = web3_eth.eth.contract(address=nft_contract_address, abi=nft_abi)
-            nft_balance = nft_contract.functions.balanceOf(wallet).call()
-            token_balance = token_contract_eth.functions.balanceOf(wallet).call() / 10**18
-            tier = min(3, max(1, nft_balance // 2))
-        elif chain == "BSC":
-            nft_contract_address = "your-nft-contract-address"  # Replace
-            nft_abi = []  # Replace with NFT ABI
-            nft_contract = web3_bsc.eth.contract(address=nft_contract_address, abi=nft_abi)
-            nft_balance = nft_contract.functions.balanceOf(wallet).call()
-            token_balance = token_contract_bsc.functions.balanceOf(wallet).call() / 10**18
-            tier = min(3, max(1, nft_balance // 2))
-        elif chain == "SOL":
-            tier, token_balance = 1, 0.0  # Placeholder
-        elif chain == "XRP":
-            response = xrp_client.request({"method": "account_info", "params": [{"account": wallet}]})
-            if "error" in response.result:
-                tier, token_balance = 0, 0.0
+    return await eligibility.check(wallet, chain)
+
+async def reverify_eligible(fresh: bool = False):
+    # Re-read balances for every verified wallet in bulk so tiers reflect current holdings.
+    rows = await db.fetchall("SELECT e.user_id, s.wallet, s.chain FROM eligible e JOIN submissions s ON s.user_id = e.user_id WHERE e.verified = 1")
+    results = await eligibility.check_many(((wallet, chain) for _, wallet, chain in rows), fresh)
+    await db.executemany("UPDATE eligible SET tier = ?, token_balance = ? WHERE user_id = ?",
+                         [(*results[(wallet, chain)], user_id) for user_id, wallet, chain in rows])
+    cache = eligibility.stats()
+    logger.info(f"Re-verified {len(rows)} eligible wallets; eligibility cache {cache['hits']} hits, "
+                f"{cache['misses']} misses ({cache['hit_rate']:.0%} of lookups served without RPC)")
+
+class Snapshot:
+    """Point-in-time balances of every submitted wallet for one campaign, pinned to a block
+    per chain (ETH/BSC block number, XRP ledger index; chains not given are pinned to their
+    latest height when the snapshot is created). Wallets are read in keyset pages of
+    batch_size with up to concurrency pages in flight, bypassing the eligibility cache, and
+    each page is written to snapshot_balances together with the progress counter. A wallet
+    is only skipped once its row exists, so an interrupted or partly failed snapshot is
+    resumed by running it again and only re-reads what is missing. calculate_airdrop uses
+    the campaign's latest completed snapshot.
+    """
+
+    PINNED_CHAINS = ("ETH", "BSC", "XRP")
+
+    def __init__(self, snapshot_id: int, campaign_id: int, heights: dict, total: int, resumed: bool = False):
+        self.id = snapshot_id
+        self.campaign_id = campaign_id
+        self.heights = heights
+        self.total = total
+        self.resumed = resumed
+
+    @staticmethod
+    async def latest_heights() -> dict:
+        loop = asyncio.get_running_loop()
+        eth, bsc, xrp = await asyncio.gather(loop.run_in_executor(None, lambda: web3_eth.eth.block_number),
+                                             loop.run_in_executor(None, lambda: web3_bsc.eth.block_number),
+                                             loop.run_in_executor(None, get_latest_validated_ledger_sequence, xrp_client))
+        return {"ETH": eth, "BSC": bsc, "XRP": xrp}
+
+    @classmethod
+    async def open(cls, campaign_id: int, heights: Optional[dict] = None) -> "Snapshot":
+        row = await db.fetchone("SELECT id, heights, total FROM snapshots WHERE campaign_id = ? AND status = 'running' ORDER BY id DESC LIMIT 1",
+                                (campaign_id,))
+        if row:
+            return cls(row[0], campaign_id, json.loads(row[1]), row[2], resumed=True)
+        pinned = {chain: height for chain, height in (heights or {}).items() if chain in cls.PINNED_CHAINS}
+        if len(pinned) < len(cls.PINNED_CHAINS):
+            pinned = {**await cls.latest_heights(), **pinned}
+        total = await db.fetchval("SELECT COUNT(*) FROM submissions", default=0)
+        now = datetime.utcnow().isoformat()
+
+        def create(c):
+            return c.execute("INSERT INTO snapshots (campaign_id, status, heights, total, done, created_at, updated_at) VALUES (?, 'running', ?, ?, 0, ?, ?)",
+                             (campaign_id, json.dumps(pinned), total, now, now)).lastrowid
+        return cls(await db.write(create), campaign_id, pinned, total)
+
+    async def done(self) -> int:
+        return await db.fetchval("SELECT COUNT(*) FROM snapshot_balances WHERE snapshot_id = ?", (self.id,), default=0)
+
+    async def _read_page(self, page: list, min_balance: float) -> int:
+        by_chain = {}
+        for user_id, wallet, chain in page:
+            by_chain.setdefault(chain, []).append(wallet)
+        fetched = await asyncio.gather(*(eligibility.fetch(chain, wallets, self.heights.get(chain))
+                                         for chain, wallets in by_chain.items()))
+        balances = {(wallet, chain): balance for chain, chain_balances in zip(by_chain, fetched)
+                    for wallet, balance in chain_balances.items()}
+        rows = []
+        for user_id, wallet, chain in page:
+            tier, token_balance, height = balances[(wallet, chain)]
+            if height is not None:  # failed reads stay missing and are retried on resume
+                rows.append((self.id, user_id, wallet, chain, EligibilityService.eligible_tier(tier, token_balance, min_balance), token_balance, height))
+
+        def store(c):
+            c.executemany("INSERT OR REPLACE INTO snapshot_balances (snapshot_id, user_id, wallet, chain, tier, token_balance, height) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            c.execute("UPDATE snapshots SET done = done + ?, updated_at = ? WHERE id = ?", (len(rows), datetime.utcnow().isoformat(), self.id))
+        await db.write(store)
+        return len(rows)
+
+    async def run(self, progress=None, batch_size: int = SNAPSHOT_BATCH, concurrency: int = SNAPSHOT_CONCURRENCY) -> dict:
+        """Read every wallet not yet in the snapshot. progress(done, total) is awaited each time
+        another tenth of the wallets is stored. Returns done/total/failed; the snapshot is
+        marked completed only when nothing failed."""
+        min_balance = float(await db.fetchval("SELECT value FROM config WHERE key = 'min_token_balance'", default=0))
+        done = started = await self.done()
+        step = max(1, self.total // 10)
+        reported = done // step
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks, attempted, last_user = [], 0, ""
+
+        async def read(page):
+            nonlocal done, reported
+            try:
+                stored = await self._read_page(page, min_balance)
+                done += stored
+            finally:
+                semaphore.release()
+            if progress and done // step > reported:
+                reported = done // step
+                await progress(done, self.total)
+
+        while True:
+            page = await db.fetchall(
+                "SELECT s.user_id, s.wallet, s.chain FROM submissions s "
+                "LEFT JOIN snapshot_balances b ON b.snapshot_id = ? AND b.user_id = s.user_id "
+                "WHERE s.user_id > ? AND b.user_id IS NULL ORDER BY s.user_id LIMIT ?",
+                (self.id, last_user, batch_size))
+            if not page:
+                break
+            last_user = page[-1][0]
+            attempted += len(page)
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(read(page)))
+        await asyncio.gather(*tasks)
+        failed = attempted - (done - started)
+        # Wallets submitted after the snapshot was opened are included, so the total can grow.
+        total = max(self.total, done)
+        status = "running" if failed else "completed"
+        await db.execute("UPDATE snapshots SET status = ?, done = ?, total = ?, updated_at = ? WHERE id = ?",
+                         (status, done, total, datetime.utcnow().isoformat(), self.id))
+        self.total = total
+        logger.info(f"Snapshot {self.id} for campaign {self.campaign_id} at {self.heights}: {done}/{total} wallets read, {failed} failed")
+        return {"done": done, "total": total, "failed": failed}
+
+# EVM Distribution
+class NonceAllocator:
+    """Hands out sender nonces locally after a single pending-count lookup. A nonce whose
+    transaction never reached the mempool is released and handed out again first, so the
+    sequence stays gap-free; anything still released at the end is filled by the caller.
+    """
+
+    def __init__(self, start: int):
+        self._next = start
+        self._released = []
+
+    def allocate(self) -> int:
+        if self._released:
+            return heapq.heappop(self._released)
+        nonce = self._next
+        self._next += 1
+        return nonce
+
+    def release(self, nonce: int):
+        heapq.heappush(self._released, nonce)
+
+    def drain_gaps(self) -> list:
+        gaps, self._released = sorted(self._released), []
+        return gaps
+
+class EvmDistributor:
+    """Concurrent ERC-20 payouts for one chain. The nonce is fetched once and then assigned
+    locally, the gas price is fetched once per batch of gas_batch transfers, and signing
+    plus broadcasting run on a private thread pool with up to `concurrency` transfers in
+    flight. Receipts are polled in the background while later transfers are still going
+    out. The web3 instance and token contract are passed in so the engine can be pointed
+    at a local node (anvil, eth-tester) as easily as at mainnet.
+
+    Progress is reported to a journal (see DistributionJob): signed() is awaited with the
+    raw transaction before it is broadcast, sent() once it is broadcast or has failed, and
+    settled() once its receipt is in.
+
+    Given a disperse contract, recipients are instead packed into disperseToken calls.
+    Batch size follows the gas limit: each batch is sized from the per-recipient gas
+    measured on the previous one and checked with estimate_gas before it is signed. A
+    batch that cannot be estimated falls back to plain transfers.
+    """
+
+    DISPERSE_BASE_GAS = 60000
+    DISPERSE_RECIPIENT_GAS = 35000
+
+    def __init__(self, web3: Web3, token_contract, chain: str, sender: Optional[str], private_key: Optional[str],
+                 concurrency: int = DISTRIBUTION_CONCURRENCY, gas_batch: int = DISTRIBUTION_GAS_BATCH,
+                 gas_limit: int = EVM_TRANSFER_GAS, receipt_timeout: float = RECEIPT_TIMEOUT,
+                 poll_interval: float = 2.0, broadcast_retries: int = 3, disperse_contract=None,
+                 disperse_gas_limit: int = DISPERSE_GAS_LIMIT, disperse_max_batch: int = DISPERSE_MAX_BATCH):
+        self.web3 = web3
+        self.token_contract = token_contract
+        self.chain = chain
+        self.sender = sender
+        self.private_key = private_key
+        self.concurrency = concurrency
+        self.gas_batch = gas_batch
+        self.gas_limit = gas_limit
+        self.receipt_timeout = receipt_timeout
+        self.poll_interval = poll_interval
+        self.broadcast_retries = broadcast_retries
+        self.disperse_contract = disperse_contract
+        self.disperse_gas_limit = disperse_gas_limit
+        self.disperse_max_batch = disperse_max_batch
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"{chain.lower()}-payout")
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
+
+    def _sign(self, tx: dict):
+        return self.web3.eth.account.sign_transaction(tx, self.private_key)
+
+    def _sign_transfer(self, wallet: str, amount: float, nonce: int, gas_price: int, chain_id: int):
+        # Every field is supplied up front, so build_transaction makes no RPC calls.
+        tx = self.token_contract.functions.transfer(Web3.to_checksum_address(wallet), int(amount * 10**18)).build_transaction({
+            "from": self.sender, "nonce": nonce, "gas": self.gas_limit, "gasPrice": gas_price, "chainId": chain_id
+        })
+        return self._sign(tx)
+
+    def _disperse_call(self, batch: list):
+        recipients = [Web3.to_checksum_address(wallet) for _, wallet, _ in batch]
+        values = [int(amount * 10**18) for _, _, amount in batch]
+        return self.disperse_contract.functions.disperseToken(self.token_contract.address, recipients, values)
+
+    def _estimate_disperse(self, batch: list) -> int:
+        return self._disperse_call(batch).estimate_gas({"from": self.sender})
+
+    def _sign_disperse(self, batch: list, gas: int, nonce: int, gas_price: int, chain_id: int):
+        tx = self._disperse_call(batch).build_transaction({
+            "from": self.sender, "nonce": nonce, "gas": gas, "gasPrice": gas_price, "chainId": chain_id
+        })
+        return self._sign(tx)
+
+    async def _ensure_allowance(self, total: int, nonces: NonceAllocator, chain_id: int):
+        spender = self.disperse_contract.address
+        allowance = await self._call(self.token_contract.functions.allowance(self.sender, spender).call)
+        if allowance >= total:
+            return
+        gas_price = await self._call(lambda: self.web3.eth.gas_price)
+        nonce = nonces.allocate()
+        try:
+            tx = self.token_contract.functions.approve(spender, total).build_transaction({
+                "from": self.sender, "nonce": nonce, "gas": self.gas_limit, "gasPrice": gas_price, "chainId": chain_id
+            })
+            signed = await self._call(self._sign, tx)
+            tx_hash = await self._broadcast(signed.rawTransaction, signed.hash.hex())
+        except Exception:
+            nonces.release(nonce)
+            raise
+        if not await self._confirm(tx_hash):
+            raise RuntimeError(f"disperse approval {tx_hash} was not confirmed")
+
+    async def _send_units(self, transfers: list, chain_id: int, nonces: NonceAllocator):
+        """Yield (covered transfers, build(nonce, gas_price)) for each transaction to send."""
+        if self.disperse_contract is not None and len(transfers) > 1:
+            try:
+                await self._ensure_allowance(sum(int(amount * 10**18) for _, _, amount in transfers), nonces, chain_id)
+            except Exception as e:
+                logger.error(f"{self.chain} payout: disperse approval failed, sending plain transfers: {e}")
+            else:
+                per_recipient = self.DISPERSE_RECIPIENT_GAS
+                start = 0
+                while start < len(transfers):
+                    size = min(self.disperse_max_batch, max(1, (self.disperse_gas_limit - self.DISPERSE_BASE_GAS) // per_recipient))
+                    batch = transfers[start:start + size]
+                    try:
+                        gas = await self._call(self._estimate_disperse, batch)
+                    except Exception as e:
+                        logger.error(f"{self.chain} payout: cannot estimate disperse batch of {len(batch)}, sending plain transfers: {e}")
+                        for item in batch:
+                            yield [item], partial(self._sign_transfer, item[1], item[2], chain_id=chain_id)
+                        start += len(batch)
+                        continue
+                    if gas > self.disperse_gas_limit and len(batch) > 1:
+                        per_recipient = max(1, -(-(gas - self.DISPERSE_BASE_GAS) // len(batch)) + 1)
+                        continue
+                    if gas > self.disperse_gas_limit:
+                        # Capped at the limit this would run out of gas and revert, so pay the recipient directly.
+                        logger.warning(f"{self.chain} payout: disperse to {batch[0][1]} needs {gas} gas, sending a plain transfer")
+                        yield batch, partial(self._sign_transfer, batch[0][1], batch[0][2], chain_id=chain_id)
+                        start += 1
+                        continue
+                    per_recipient = max(1, (gas - self.DISPERSE_BASE_GAS) // len(batch))
+                    yield batch, partial(self._sign_disperse, batch, min(self.disperse_gas_limit, gas * 6 // 5), chain_id=chain_id)
+                    start += len(batch)
+                return
+        for item in transfers:
+            yield [item], partial(self._sign_transfer, item[1], item[2], chain_id=chain_id)
+
+    async def _broadcast(self, raw_tx: bytes, tx_hash: str) -> str:
+        for attempt in range(self.broadcast_retries):
+            try:
+                await self._call(self.web3.eth.send_raw_transaction, raw_tx)
+                return tx_hash
+            except Exception as e:
+                message = str(e).lower()
+                # A retry after a timed-out send finds the first attempt already in the mempool.
+                if "already known" in message or "known transaction" in message:
+                    return tx_hash
+                if attempt == self.broadcast_retries - 1:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def _confirm(self, tx_hash: str) -> Optional[bool]:
+        deadline = time.monotonic() + self.receipt_timeout
+        while time.monotonic() < deadline:
+            try:
+                receipt = await self._call(self.web3.eth.get_transaction_receipt, tx_hash)
+                return receipt["status"] == 1
+            except Exception:
+                await asyncio.sleep(self.poll_interval)
+        return None
+
+    async def _fill_gap(self, nonce: int, gas_price: int, chain_id: int):
+        # A released nonce nobody reused would stall every later transaction from the sender.
+        signed = await self._call(self._sign, {"from": self.sender, "to": self.sender, "value": 0, "nonce": nonce,
+                                               "gas": 21000, "gasPrice": gas_price, "chainId": chain_id})
+        await self._broadcast(signed.rawTransaction, signed.hash.hex())
+        logger.warning(f"{self.chain} payout: filled nonce gap {nonce} with a self-transfer")
+
+    async def recover(self, in_flight: list, journal) -> dict:
+        """Re-broadcast (tx_hash, raw_tx, transfers) that an interrupted run signed, lowest nonce
+        first, and settle them. The same bytes can land at most once; if their nonce has since
+        been used by another transaction they never landed and the transfers are queued again."""
+        summary = {"recovered": 0, "confirmed": 0, "failed": 0, "requeued": 0, "unconfirmed": 0}
+        for tx_hash, raw_tx, unit in in_flight:
+            summary["recovered"] += len(unit)
+            try:
+                await self._broadcast(raw_tx, tx_hash)
+            except Exception as e:
+                if "nonce too low" not in str(e).lower():
+                    logger.error(f"{self.chain} payout: cannot re-broadcast {tx_hash}, leaving it for the next resume: {e}")
+                    summary["unconfirmed"] += len(unit)
+                    continue
+                try:
+                    receipt = await self._call(self.web3.eth.get_transaction_receipt, tx_hash)
+                    status = receipt["status"] == 1
+                except Exception:
+                    logger.warning(f"{self.chain} payout: {tx_hash} was replaced before it landed, queueing it again")
+                    summary["requeued"] += len(unit)
+                    await journal.requeue(unit, tx_hash)
+                    continue
+            else:
+                status = await self._confirm(tx_hash)
+            summary["confirmed" if status else "failed" if status is not None else "unconfirmed"] += len(unit)
+            await journal.settled(unit, tx_hash, status)
+        return summary
+
+    async def distribute(self, transfers: list, journal) -> dict:
+        """Send (user_id, wallet, amount) transfers; with a disperse contract several transfers
+        share one transaction and so one tx_hash."""
+        summary = {"sent": 0, "failed": 0, "transactions": 0, "confirmed": 0, "reverted": 0, "unconfirmed": 0}
+        if not transfers:
+            return summary
+        chain_id = await self._call(lambda: self.web3.eth.chain_id)
+        nonces = NonceAllocator(await self._call(self.web3.eth.get_transaction_count, self.sender, "pending"))
+        semaphore = asyncio.Semaphore(self.concurrency)
+        confirmations = []
+
+        async def send_unit(unit, build, gas_price):
+            nonce, tx_hash = nonces.allocate(), None
+            try:
+                signed = await self._call(build, nonce, gas_price)
+                tx_hash = signed.hash.hex()
+                await journal.signed(self.chain, unit, tx_hash, nonce, bytes(signed.rawTransaction))
+                await self._broadcast(signed.rawTransaction, tx_hash)
+            except Exception as e:
+                # "nonce too low" means the nonce is already used on chain; handing it out
+                # again would only fail every later transfer the same way.
+                if "nonce too low" not in str(e).lower():
+                    nonces.release(nonce)
+                summary["failed"] += len(unit)
+                await journal.sent(unit, tx_hash, e)
+                return
+            finally:
+                semaphore.release()
+            summary["sent"] += len(unit)
+            summary["transactions"] += 1
+            confirmations.append((unit, tx_hash, asyncio.create_task(self._confirm(tx_hash))))
+            await journal.sent(unit, tx_hash, None)
+
+        sends = []
+        gas_price, priced = None, self.gas_batch
+        async for unit, build in self._send_units(transfers, chain_id, nonces):
+            if priced >= self.gas_batch:
+                gas_price, priced = await self._call(lambda: self.web3.eth.gas_price), 0
+                logger.info(f"{self.chain} payout: {summary['sent']} sent, {summary['failed']} failed of {len(transfers)}")
+            priced += len(unit)
+            await semaphore.acquire()
+            sends.append(asyncio.create_task(send_unit(unit, build, gas_price)))
+        await asyncio.gather(*sends)
+
+        for nonce in nonces.drain_gaps():
+            try:
+                await self._fill_gap(nonce, gas_price, chain_id)
+            except Exception as e:
+                logger.error(f"{self.chain} payout: could not fill nonce gap {nonce}: {e}")
+
+        for unit, tx_hash, task in confirmations:
+            status = await task
+            if status is None:
+                summary["unconfirmed"] += len(unit)
+                logger.warning(f"{self.chain} payout: no receipt for {tx_hash} after {self.receipt_timeout:.0f}s")
+            elif status:
+                summary["confirmed"] += len(unit)
+            else:
+                summary["reverted"] += len(unit)
+                logger.error(f"{self.chain} payout: {tx_hash} covering {len(unit)} transfers reverted")
+            await journal.settled(unit, tx_hash, status)
+        return summary
+
+eth_distributor = EvmDistributor(web3_eth, token_contract_eth, "ETH", ETH_SENDER_ADDRESS, ETH_PRIVATE_KEY,
+                                 disperse_contract=disperse_contract_eth)
+bsc_distributor = EvmDistributor(web3_bsc, token_contract_bsc, "BSC", ETH_SENDER_ADDRESS, ETH_PRIVATE_KEY,
+                                 disperse_contract=disperse_contract_bsc)
+
+class XrpDistributor:
+    """Pipelined XRP payouts. The sender wallet is derived once and Sequence numbers are
+    assigned locally from one account_info lookup, so payments are signed offline and
+    submitted back to back instead of each one waiting for validation. Every payment
+    carries a LastLedgerSequence, which gives it a hard expiry: a hash that is not in a
+    validated ledger once that ledger has closed can never apply, and its rows are queued
+    again. Outstanding hashes are polled with `tx` together once per ledger close. The
+    client is passed in so the engine can run against a standalone rippled.
+
+    Only a payment the server rejected for good (tem/tef) gives its Sequence back for the
+    next payment. Anything else that went wrong on submit, including tefPAST_SEQ (the
+    Sequence is already used, possibly by this very payment on an earlier attempt), keeps
+    the Sequence held and is settled from the ledger like a submitted payment.
+    """
+
+    APPLIED_OR_PENDING = ("tes", "tec", "ter")
+    NEVER_APPLIES = ("tem", "tef")
+
+    def __init__(self, client, seed: Optional[str], concurrency: int = DISTRIBUTION_CONCURRENCY,
+                 ledger_batch: int = XRP_LEDGER_BATCH, last_ledger_offset: int = XRP_LAST_LEDGER_OFFSET,
+                 poll_interval: float = 3.5, receipt_timeout: float = RECEIPT_TIMEOUT):
+        self.chain = "XRP"
+        self.client = client
+        self.seed = seed
+        self.concurrency = concurrency
+        self.ledger_batch = ledger_batch
+        self.last_ledger_offset = last_ledger_offset
+        self.poll_interval = poll_interval
+        self.receipt_timeout = receipt_timeout
+        self._wallet = None
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="xrp-payout")
+
+    @property
+    def wallet(self) -> Wallet:
+        if self._wallet is None:
+            self._wallet = Wallet.from_seed(self.seed)
+        return self._wallet
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
+
+    def _sign(self, transaction):
+        signed = xrpl_sign(transaction, self.wallet)
+        return signed.get_hash(), bytes.fromhex(xrpl_encode(signed.to_xrpl()))
+
+    def _submit(self, blob: bytes) -> str:
+        response = self.client.request(SubmitOnly(tx_blob=blob.hex().upper()))
+        return response.result.get("engine_result", response.result.get("error", "unknown"))
+
+    def _lookup(self, tx_hash: str) -> Optional[dict]:
+        response = self.client.request(Tx(transaction=tx_hash))
+        return response.result if response.is_successful() and response.result.get("validated") else None
+
+    async def _settle(self, pending: dict, journal, summary: dict):
+        # pending: tx_hash -> (transfers, last_ledger_sequence)
+        deadline = time.monotonic() + self.receipt_timeout
+        while pending and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            validated = await self._call(get_latest_validated_ledger_sequence, self.client)
+            hashes = list(pending)
+            results = await asyncio.gather(*(self._call(self._lookup, tx_hash) for tx_hash in hashes), return_exceptions=True)
+            for tx_hash, result in zip(hashes, results):
+                unit, last_ledger = pending[tx_hash]
+                if isinstance(result, dict):
+                    ok = result["meta"]["TransactionResult"] == "tesSUCCESS"
+                    summary["confirmed" if ok else "reverted"] += len(unit)
+                    if not ok:
+                        logger.error(f"XRP payout: {tx_hash} failed with {result['meta']['TransactionResult']}")
+                    await journal.settled(unit, tx_hash, ok)
+                elif validated > last_ledger:
+                    summary["requeued"] += len(unit)
+                    logger.warning(f"XRP payout: {tx_hash} expired at ledger {last_ledger}, queueing it again")
+                    await journal.requeue(unit, tx_hash)
+                else:
+                    continue
+                del pending[tx_hash]
+        summary["unconfirmed"] += sum(len(unit) for unit, _ in pending.values())
+
+    async def recover(self, in_flight: list, journal) -> dict:
+        """Resubmit (tx_hash, raw_tx, transfers) signed by an interrupted run and settle them;
+        LastLedgerSequence decides between landed and expired."""
+        summary = {"recovered": 0, "confirmed": 0, "reverted": 0, "requeued": 0, "unconfirmed": 0}
+        pending = {}
+        for tx_hash, raw_tx, unit in in_flight:
+            summary["recovered"] += len(unit)
+            try:
+                await self._call(self._submit, raw_tx)
+            except Exception as e:
+                logger.warning(f"XRP payout: resubmitting {tx_hash} failed, settling it from the ledger: {e}")
+            pending[tx_hash] = (unit, xrpl_decode(raw_tx.hex().upper())["LastLedgerSequence"])
+        await self._settle(pending, journal, summary)
+        return summary
+
+    async def distribute(self, transfers: list, journal) -> dict:
+        summary = {"sent": 0, "failed": 0, "transactions": 0, "confirmed": 0, "reverted": 0, "requeued": 0, "unconfirmed": 0}
+        if not transfers:
+            return summary
+        account = self.wallet.classic_address
+        info = await self._call(self.client.request, AccountInfo(account=account, ledger_index="current"))
+        sequences = NonceAllocator(info.result["account_data"]["Sequence"])
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = {}
+
+        async def send_one(transfer, fee, last_ledger):
+            user_id, wallet, amount = transfer
+            unit, sequence, tx_hash, result = [transfer], sequences.allocate(), None, None
+            async with semaphore:
+                try:
+                    payment = Payment(account=account, destination=wallet, amount=xrp_to_drops(amount),
+                                      sequence=sequence, fee=fee, last_ledger_sequence=last_ledger)
+                    tx_hash, blob = await self._call(self._sign, payment)
+                    await journal.signed(self.chain, unit, tx_hash, sequence, blob)
+                    result = await self._call(self._submit, blob)
+                    if not result.startswith(self.APPLIED_OR_PENDING):
+                        raise RuntimeError(f"submit returned {result}")
+                except Exception as e:
+                    summary["failed"] += 1
+                    if tx_hash is not None and (result is None or result == "tefPAST_SEQ" or not result.startswith(self.NEVER_APPLIES)):
+                        # It may have applied or still apply until LastLedgerSequence passes: the
+                        # Sequence stays held and the ledger decides whether the rows were paid.
+                        pending[tx_hash] = (unit, last_ledger)
+                        await journal.sent(unit, tx_hash, e)
+                    else:
+                        sequences.release(sequence)
+                        await journal.sent(unit, None, e)
+                    return
+            summary["sent"] += 1
+            summary["transactions"] += 1
+            pending[tx_hash] = (unit, last_ledger)
+            await journal.sent(unit, tx_hash, None)
+
+        fee, last_ledger = None, None
+        for start in range(0, len(transfers), self.ledger_batch):
+            fee = await self._call(get_fee, self.client)
+            last_ledger = await self._call(get_latest_validated_ledger_sequence, self.client) + self.last_ledger_offset
+            await asyncio.gather(*(send_one(transfer, fee, last_ledger) for transfer in transfers[start:start + self.ledger_batch]))
+            logger.info(f"XRP payout: {summary['sent']} submitted, {summary['failed']} rejected of {len(transfers)}")
+
+        for sequence in sequences.drain_gaps():
+            # An unused Sequence blocks every later payment from the account until it is consumed.
+            try:
+                tx_hash, blob = await self._call(self._sign, AccountSet(account=account, sequence=sequence, fee=fee,
+                                                                       last_ledger_sequence=last_ledger))
+                await self._call(self._submit, blob)
+                logger.warning(f"XRP payout: filled sequence gap {sequence} with a no-op AccountSet")
+            except Exception as e:
+                logger.error(f"XRP payout: could not fill sequence gap {sequence}: {e}")
+
+        await self._settle(pending, journal, summary)
+        return summary
+
+xrp_distributor = XrpDistributor(xrp_client, XRP_SENDER_SEED)
+
+class SolDistributor:
+    """Batched Solana payouts of the SPL token named by mint: transferChecked, creating the
+    recipient's associated token account when missing. Without a mint distribute refuses
+    to run and leaves the rows queued, since an allocation is a token amount, not SOL.
+    Recipients are packed into each transaction until the next one would push it past the
+    1232-byte packet limit, every wave of blockhash_batch transactions is signed against
+    one recent blockhash, and waves go out concurrently over the JSON-RPC session.
+    Signatures are confirmed together with getSignatureStatuses; one still unseen once its
+    blockhash has expired can never land, so its rows are queued again. The RPC pool is
+    passed in so the engine can run against solana-test-validator.
+    """
+
+    PACKET_SIZE = 1232
+    BASE_COMPUTE_UNITS = 5000
+    SPL_COMPUTE_UNITS = 35000
+    MAX_COMPUTE_UNITS = 1400000
+
+    def __init__(self, rpc: RpcPool, private_key: Optional[str], mint: Optional[str] = None,
+                 concurrency: int = DISTRIBUTION_CONCURRENCY, blockhash_batch: int = SOL_BLOCKHASH_BATCH,
+                 poll_interval: float = 2.0, receipt_timeout: float = RECEIPT_TIMEOUT):
+        self.chain = "SOL"
+        self.rpc = rpc
+        self.private_key = private_key
+        self.mint = Pubkey.from_string(mint) if mint else None
+        self.concurrency = concurrency
+        self.blockhash_batch = blockhash_batch
+        self.poll_interval = poll_interval
+        self.receipt_timeout = receipt_timeout
+        self._keypair = None
+        self._decimals = None
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="sol-payout")
+
+    @property
+    def keypair(self) -> Keypair:
+        if self._keypair is None:
+            key = self.private_key.strip()
+            self._keypair = Keypair.from_bytes(bytes(json.loads(key))) if key.startswith("[") else Keypair.from_base58_string(key)
+        return self._keypair
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
+
+    def _rpc(self, method: str, params: list):
+        return solana_rpc(method, params, self.rpc)
+
+    def _transfer_instructions(self, wallet: str, amount: float) -> list:
+        owner = Pubkey.from_string(wallet)
+        payer = self.keypair.pubkey()
+        destination = get_associated_token_address(owner, self.mint)
+        create = Instruction(ASSOCIATED_TOKEN_PROGRAM_ID, bytes([1]), [  # CreateIdempotent
+            AccountMeta(payer, True, True), AccountMeta(destination, False, True), AccountMeta(owner, False, False),
+            AccountMeta(self.mint, False, False), AccountMeta(SYSTEM_PROGRAM_ID, False, False),
+            AccountMeta(TOKEN_PROGRAM_ID, False, False)])
+        units = int(round(amount * 10**self._decimals))
+        transfer_checked = Instruction(TOKEN_PROGRAM_ID, bytes([12]) + units.to_bytes(8, "little") + bytes([self._decimals]), [
+            AccountMeta(get_associated_token_address(payer, self.mint), False, True), AccountMeta(self.mint, False, False),
+            AccountMeta(destination, False, True), AccountMeta(payer, True, False)])
+        return [create, transfer_checked]
+
+    def _message(self, instructions: list, recipients: int, blockhash: Hash) -> Message:
+        units = min(self.MAX_COMPUTE_UNITS, self.BASE_COMPUTE_UNITS + self.SPL_COMPUTE_UNITS * recipients)
+        return Message.new_with_blockhash([set_compute_unit_limit(units), *instructions], self.keypair.pubkey(), blockhash)
+
+    def _pack(self, transfers: list):
+        """Split transfers into (transfers, instructions) that each fit one transaction, plus
+        the transfers whose instructions could not be built at all."""
+        packed, rejected = [], []
+        unit, instructions = [], []
+        for item in transfers:
+            try:
+                extra = self._transfer_instructions(item[1], item[2])
+            except Exception as e:
+                rejected.append((item, e))
+                continue
+            # One signature (1 + 64 bytes) plus the serialized message; the blockhash does not change the size.
+            if unit and 65 + len(bytes(self._message(instructions + extra, len(unit) + 1, Hash.default()))) > self.PACKET_SIZE:
+                packed.append((unit, instructions))
+                unit, instructions = [], []
+            unit.append(item)
+            instructions = instructions + extra
+        if unit:
+            packed.append((unit, instructions))
+        return packed, rejected
+
+    def _sign(self, unit: list, instructions: list, blockhash: Hash):
+        tx = Transaction([self.keypair], self._message(instructions, len(unit), blockhash), blockhash)
+        return str(tx.signatures[0]), bytes(tx)
+
+    def _send(self, raw_tx: bytes, preflight: bool = True) -> str:
+        return self._rpc("sendTransaction", [base64.b64encode(raw_tx).decode(), {
+            "encoding": "base64", "skipPreflight": not preflight, "preflightCommitment": "confirmed", "maxRetries": 0}])
+
+    async def _settle(self, pending: dict, journal, summary: dict, search_history: bool = False):
+        # pending: signature -> (transfers, raw_tx)
+        deadline = time.monotonic() + self.receipt_timeout
+        while pending and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            signatures = list(pending)
+            statuses = []
+            for start in range(0, len(signatures), 256):
+                result = await self._call(self._rpc, "getSignatureStatuses",
+                                          [signatures[start:start + 256], {"searchTransactionHistory": search_history}])
+                statuses.extend(result["value"])
+            blockhashes = {Transaction.from_bytes(raw_tx).message.recent_blockhash for _, raw_tx in pending.values()}
+            valid = {}
+            for blockhash in blockhashes:
+                valid[blockhash] = (await self._call(self._rpc, "isBlockhashValid", [str(blockhash), {"commitment": "confirmed"}]))["value"]
+            for signature, status in zip(signatures, statuses):
+                unit, raw_tx = pending[signature]
+                if status and status.get("confirmationStatus") in ("confirmed", "finalized"):
+                    ok = status.get("err") is None
+                    summary["confirmed" if ok else "reverted"] += len(unit)
+                    if not ok:
+                        logger.error(f"SOL payout: {signature} failed with {status['err']}")
+                    await journal.settled(unit, signature, ok)
+                elif status is None and not valid[Transaction.from_bytes(raw_tx).message.recent_blockhash]:
+                    summary["requeued"] += len(unit)
+                    logger.warning(f"SOL payout: {signature} expired unseen, queueing it again")
+                    await journal.requeue(unit, signature)
+                else:
+                    if status is None:
+                        # Leaders drop transactions freely; resend until it lands or its blockhash expires.
+                        try:
+                            await self._call(self._send, raw_tx, False)
+                        except Exception as e:
+                            logger.warning(f"SOL payout: resending {signature} failed: {e}")
+                    continue
+                del pending[signature]
+        summary["unconfirmed"] += sum(len(unit) for unit, _ in pending.values())
+
+    async def recover(self, in_flight: list, journal) -> dict:
+        """Resend (signature, raw_tx, transfers) signed by an interrupted run and settle them;
+        blockhash expiry decides between landed and never landing."""
+        summary = {"recovered": 0, "confirmed": 0, "reverted": 0, "requeued": 0, "unconfirmed": 0}
+        pending = {}
+        for signature, raw_tx, unit in in_flight:
+            summary["recovered"] += len(unit)
+            pending[signature] = (unit, raw_tx)
+        await self._settle(pending, journal, summary, search_history=True)
+        return summary
+
+    async def distribute(self, transfers: list, journal) -> dict:
+        summary = {"sent": 0, "failed": 0, "transactions": 0, "confirmed": 0, "reverted": 0, "requeued": 0, "unconfirmed": 0}
+        if not transfers:
+            return summary
+        if self.mint is None:
+            logger.error(f"SOL payout: SOL_TOKEN_MINT is not set, leaving {len(transfers)} transfers queued")
+            return summary
+        if self._decimals is None:
+            supply = await self._call(self._rpc, "getTokenSupply", [str(self.mint)])
+            self._decimals = supply["value"]["decimals"]
+        packed, rejected = await self._call(self._pack, transfers)
+        for item, error in rejected:
+            summary["failed"] += 1
+            await journal.sent([item], None, error)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = {}
+
+        async def send_batch(unit, instructions, blockhash):
+            signature, rejected = None, None
+            async with semaphore:
+                try:
+                    signature, raw_tx = await self._call(self._sign, unit, instructions, blockhash)
+                    await journal.signed(self.chain, unit, signature, None, raw_tx)
+                    await self._call(self._send, raw_tx)
+                except SolanaRpcError as e:
+                    rejected = e
+                except Exception as e:
+                    summary["failed"] += len(unit)
+                    if signature is None:
+                        await journal.sent(unit, None, e)
+                    else:
+                        # The send may have reached a leader; settle it by blockhash expiry before paying again.
+                        pending[signature] = (unit, raw_tx)
+                        await journal.sent(unit, signature, e)
+                    return
+            if rejected is not None:
+                # Preflight refused the whole transaction; split it so one bad recipient fails alone.
+                if len(unit) == 1:
+                    summary["failed"] += 1
+                    await journal.sent(unit, None, rejected)
+                    return
+                half = len(unit) // 2
+                per_transfer = len(instructions) // len(unit)
+                await asyncio.gather(send_batch(unit[:half], instructions[:half * per_transfer], blockhash),
+                                     send_batch(unit[half:], instructions[half * per_transfer:], blockhash))
+                return
+            summary["sent"] += len(unit)
+            summary["transactions"] += 1
+            pending[signature] = (unit, raw_tx)
+            await journal.sent(unit, signature, None)
+
+        for start in range(0, len(packed), self.blockhash_batch):
+            latest = await self._call(self._rpc, "getLatestBlockhash", [{"commitment": "confirmed"}])
+            blockhash = Hash.from_string(latest["value"]["blockhash"])
+            await asyncio.gather(*(send_batch(unit, instructions, blockhash) for unit, instructions in packed[start:start + self.blockhash_batch]))
+            logger.info(f"SOL payout: {summary['sent']} sent in {summary['transactions']} transactions, {summary['failed']} failed of {len(transfers)}")
+
+        await self._settle(pending, journal, summary)
+        return summary
+
+sol_distributor = SolDistributor(sol_rpc, SOL_SENDER_PRIVATE_KEY, SOL_TOKEN_MINT)
+
+class DistributionJob:
+    """A persistent payout run over the distributions table. Rows move queued -> signed ->
+    broadcast -> confirmed/failed, and a signed transaction is written to distribution_txs
+    before it is broadcast. An interrupted job therefore resumes from the database: queued
+    rows are sent, signed and broadcast ones are re-broadcast byte for byte, and nothing
+    that may already be on chain is signed a second time. idempotency_key names the payout (campaign, user) so a
+    user is paid at most once per campaign.
+    """
+
+    def __init__(self, job_id: int, campaign_id: int, resumed: bool = False):
+        self.id = job_id
+        self.campaign_id = campaign_id
+        self.resumed = resumed
+        self.completed = False
+
+    @classmethod
+    async def open(cls, campaign_id: int) -> "DistributionJob":
+        # Only this campaign's unfinished job is resumed; another campaign's is left for its own run.
+        job_id = await db.fetchval("SELECT id FROM distribution_jobs WHERE status = 'running' AND campaign_id = ? ORDER BY id LIMIT 1",
+                                   (campaign_id,))
+        if job_id:
+            return cls(job_id, campaign_id, resumed=True)
+        await calculate_airdrop(campaign_id)
+        now = datetime.utcnow().isoformat()
+
+        def create(c):
+            job_id = c.execute("INSERT INTO distribution_jobs (campaign_id, status, created_at, updated_at) VALUES (?, 'running', ?, ?)",
+                               (campaign_id, now, now)).lastrowid
+            c.execute("UPDATE distributions SET status = 'queued', job_id = ?, idempotency_key = ? || user_id, error = NULL, updated_at = ? WHERE status = 'pending'",
+                      (job_id, f"airdrop-{campaign_id}-", now))
+            return job_id
+        return cls(await db.write(create), campaign_id)
+
+    async def queued(self, chain: str) -> list:
+        return await db.fetchall("SELECT user_id, wallet, amount FROM distributions WHERE job_id = ? AND chain = ? AND status = 'queued'",
+                                 (self.id, chain))
+
+    async def in_flight(self, chain: str) -> list:
+        rows = await db.fetchall(
+            "SELECT d.tx_hash, t.raw_tx, d.user_id, d.wallet, d.amount FROM distributions d "
+            "JOIN distribution_txs t ON t.tx_hash = d.tx_hash "
+            "WHERE d.job_id = ? AND d.chain = ? AND d.status IN ('signed', 'broadcast') ORDER BY t.nonce",
+            (self.id, chain))
+        transactions = OrderedDict()
+        for tx_hash, raw_tx, user_id, wallet, amount in rows:
+            transactions.setdefault(tx_hash, (tx_hash, raw_tx, []))[2].append((user_id, wallet, amount))
+        return list(transactions.values())
+
+    async def signed(self, chain: str, unit: list, tx_hash: Optional[str], nonce: Optional[int], raw_tx: Optional[bytes]):
+        now = datetime.utcnow().isoformat()
+        statements = [("UPDATE distributions SET status = 'signed', tx_hash = ?, updated_at = ? WHERE user_id = ? AND job_id = ?",
+                       (tx_hash, now, user_id, self.id)) for user_id, _, _ in unit]
+        if raw_tx is not None:
+            statements.insert(0, ("INSERT OR IGNORE INTO distribution_txs (tx_hash, job_id, chain, nonce, raw_tx, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                                  (tx_hash, self.id, chain, nonce, raw_tx, now)))
+        await db.execute_batch(statements)
+
+    async def sent(self, unit: list, tx_hash: Optional[str], error: Optional[Exception]):
+        now = datetime.utcnow().isoformat()
+        if error is None:
+            await db.executemany("UPDATE distributions SET status = 'broadcast', tx_hash = ?, updated_at = ? WHERE user_id = ? AND status = 'signed'",
+                                 [(tx_hash, now, user_id) for user_id, _, _ in unit])
+        elif tx_hash is None:
+            # Never signed, so nothing can land: the row may be paid in a later run.
+            await db.executemany("UPDATE distributions SET status = 'failed', error = ?, updated_at = ? WHERE user_id = ? AND job_id = ?",
+                                 [(str(error), now, user_id, self.id) for user_id, _, _ in unit])
+        else:
+            # Signed but the broadcast failed: it may still land, so it stays signed for resume to settle.
+            await db.executemany("UPDATE distributions SET error = ?, updated_at = ? WHERE user_id = ? AND job_id = ?",
+                                 [(str(error), now, user_id, self.id) for user_id, _, _ in unit])
+
+    async def settled(self, unit: list, tx_hash: str, ok: Optional[bool]):
+        if ok is None:
+            return
+        await db.executemany("UPDATE distributions SET status = ?, error = ?, updated_at = ? WHERE user_id = ? AND tx_hash = ?",
+                             [("confirmed" if ok else "failed", None if ok else "transaction reverted or dropped",
+                               datetime.utcnow().isoformat(), user_id, tx_hash) for user_id, _, _ in unit])
+
+    async def requeue(self, unit: list, tx_hash: str):
+        await db.executemany("UPDATE distributions SET status = 'queued', tx_hash = NULL, error = NULL, updated_at = ? WHERE user_id = ? AND tx_hash = ?",
+                             [(datetime.utcnow().isoformat(), user_id, tx_hash) for user_id, _, _ in unit])
+
+    async def finish(self) -> dict:
+        counts = dict(await db.fetchall("SELECT status, COUNT(*) FROM distributions WHERE job_id = ? GROUP BY status", (self.id,)))
+        if not any(counts.get(status) for status in ("queued", "signed", "broadcast")):
+            await db.execute("UPDATE distribution_jobs SET status = 'completed', updated_at = ? WHERE id = ?",
+                             (datetime.utcnow().isoformat(), self.id))
+            self.completed = True
+        return counts
+
+class TemplateFields(dict):
+    """Template values that leave placeholders the audience has no column for as they are."""
+
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+class Broadcast:
+    """One message sent to every user of an audience, streamed from the database in
+    keyset chunks and delivered as bulk sends through the platform dispatcher. Each
+    recipient's outcome (delivered, blocked, failed) is written to broadcast_deliveries as
+    it happens and the chunk cursor and counts to broadcasts after each chunk, so a
+    broadcast interrupted by a restart resumes where it stopped without messaging anyone
+    twice.
+
+    template is either a LANGUAGES key, rendered in each recipient's language, or literal
+    text; both may use the audience's columns as {fields}. "payout_receipt" picks
+    sent_tokens or failed_tokens by the payout's status.
+    """
+
+    AUDIENCES = {
+        "all": ("SELECT user_id, language, username, momo_balance FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                ("user_id", "language", "username", "balance")),
+        "verified": ("SELECT user_id, language, username, momo_balance FROM users WHERE kyc_status = 'verified' AND user_id > ? ORDER BY user_id LIMIT ?",
+                     ("user_id", "language", "username", "balance")),
+        "eligible": ("SELECT e.user_id, u.language, u.username, u.momo_balance, e.tier FROM eligible e JOIN users u ON u.user_id = e.user_id "
+                     "WHERE e.verified = 1 AND e.user_id > ? ORDER BY e.user_id LIMIT ?",
+                     ("user_id", "language", "username", "balance", "tier")),
+        "payouts": ("SELECT d.user_id, u.language, d.wallet, d.amount, d.tx_hash, d.status, d.error FROM distributions d "
+                    "JOIN users u ON u.user_id = d.user_id WHERE d.job_id = ? AND d.status IN ('confirmed', 'failed') "
+                    "AND d.user_id > ? ORDER BY d.user_id LIMIT ?",
+                    ("user_id", "language", "wallet", "amount", "tx_hash", "status", "error")),
+    }
+    RECEIPTS = {"confirmed": "sent_tokens", "failed": "failed_tokens"}
+
+    def __init__(self, broadcast_id: int, audience: str, template: str, cursor: str = "", counts: Optional[dict] = None):
+        self.id = broadcast_id
+        self.audience = audience
+        self.template = template
+        self.cursor = cursor
+        self.counts = counts or {"delivered": 0, "blocked": 0, "failed": 0}
+
+    @classmethod
+    async def create(cls, audience: str, template: str, unique: bool = False) -> "Broadcast":
+        """Start a broadcast; with unique=True an existing broadcast to the same audience is reused."""
+        if audience.split(":")[0] not in cls.AUDIENCES:
+            raise ValueError(f"Unknown audience: {audience}")
+        if unique:
+            row = await db.fetchone("SELECT id, template, cursor FROM broadcasts WHERE audience = ? ORDER BY id DESC LIMIT 1", (audience,))
+            if row:
+                return await cls._resume(row[0], audience, row[1], row[2])
+        now = datetime.utcnow().isoformat()
+
+        def insert(c):
+            return c.execute("INSERT INTO broadcasts (audience, template, status, created_at, updated_at) VALUES (?, ?, 'running', ?, ?)",
+                             (audience, template, now, now)).lastrowid
+        return cls(await db.write(insert), audience, template)
+
+    @classmethod
+    async def _resume(cls, broadcast_id: int, audience: str, template: str, cursor: str) -> "Broadcast":
+        # Outcomes written after the last chunk update are only in broadcast_deliveries, so recount.
+        counts = {"delivered": 0, "blocked": 0, "failed": 0}
+        counts.update(await db.fetchall("SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? GROUP BY status", (broadcast_id,)))
+        return cls(broadcast_id, audience, template, cursor, counts)
+
+    @classmethod
+    async def unfinished(cls) -> list:
+        rows = await db.fetchall("SELECT id, audience, template, cursor FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [await cls._resume(*row) for row in rows]
+
+    def render(self, fields: dict) -> str:
+        key = self.RECEIPTS.get(fields.get("status")) if self.template == "payout_receipt" else self.template
+        strings = LANGUAGES.get(fields.get("language"), LANGUAGES["en"])
+        text = strings.get(key, LANGUAGES["en"].get(key, key))
+        try:
+            return text.format_map(TemplateFields(fields))
+        except (IndexError, ValueError):
+            return text
+
+    async def _deliver(self, context: BotContext, fields: dict) -> str:
+        try:
+            await context.send_message(fields["user_id"], self.render(fields), bulk=True)
+            status, error = "delivered", None
+        except (Forbidden, discord.Forbidden) as e:
+            status, error = "blocked", str(e)
+        except Exception as e:
+            status, error = "failed", str(e)
+        # Awaited, not deferred: the outcome must be committed before the chunk's cursor moves
+        # past this user, or a restart in between would message them again. Concurrent
+        # deliveries still share commits through the writer's batching.
+        await db.execute("INSERT OR REPLACE INTO broadcast_deliveries (broadcast_id, user_id, status, error) VALUES (?, ?, ?, ?)",
+                         (self.id, fields["user_id"], status, error))
+        return status
+
+    async def run(self, context: BotContext, chunk_size: int = BROADCAST_CHUNK) -> dict:
+        name, _, param = self.audience.partition(":")
+        sql, columns = self.AUDIENCES[name]
+        params = (int(param),) if param else ()
+        while True:
+            rows = await db.fetchall(sql, (*params, self.cursor, chunk_size))
+            if not rows:
+                break
+            done = {user_id for (user_id,) in await db.fetchall(
+                "SELECT user_id FROM broadcast_deliveries WHERE broadcast_id = ? AND user_id > ? AND user_id <= ?",
+                (self.id, self.cursor, rows[-1][0]))}
+            outcomes = await asyncio.gather(*(self._deliver(context, dict(zip(columns, row))) for row in rows if row[0] not in done))
+            for status in outcomes:
+                self.counts[status] += 1
+            self.cursor = rows[-1][0]
+            await db.execute("UPDATE broadcasts SET cursor = ?, delivered = ?, blocked = ?, failed = ?, updated_at = ? WHERE id = ?",
+                             (self.cursor, self.counts["delivered"], self.counts["blocked"], self.counts["failed"],
+                              datetime.utcnow().isoformat(), self.id))
+            logger.info(f"Broadcast {self.id} ({self.audience}): {self.counts} after {self.cursor}")
+        await db.execute("UPDATE broadcasts SET status = 'completed', updated_at = ? WHERE id = ?", (datetime.utcnow().isoformat(), self.id))
+        return self.counts
+
+class Export:
+    """A table dump for admins, streamed in constant memory: rows come off one SQLite cursor
+    in EXPORT_CHUNK batches on a worker thread, with its own read connection, and go
+    straight into a write-only openpyxl sheet or a gzipped CSV in a temp file of their own.
+    The event loop only waits for the file to be finished.
+
+    Each table lists the filters it accepts, as name -> SQL predicate on the filter value.
+    """
+
+    TABLES = {
+        "distributions": ("SELECT user_id, wallet, chain, amount, status, tx_hash, vesting_end FROM distributions",
+                          ("User ID", "Wallet", "Chain", "Amount", "Status", "Tx Hash", "Vesting End"),
+                          {"status": "status = ?", "chain": "chain = ?", "job": "job_id = ?"}),
+        "users": ("SELECT user_id, username, language, kyc_status, momo_balance, referred_by, kyc_wallet, kyc_chain, kyc_submission_time FROM users",
+                  ("User ID", "Username", "Language", "KYC Status", "Balance", "Referred By", "Wallet", "Chain", "KYC Submitted"),
+                  {"kyc": "kyc_status = ?", "chain": "kyc_chain = ?", "since": "kyc_submission_time >= ?"}),
+        "referrals": ("SELECT referrer_id, referee_id, timestamp, status FROM referrals",
+                      ("Referrer ID", "Referee ID", "Timestamp", "Status"),
+                      {"status": "status = ?", "referrer": "referrer_id = ?", "since": "timestamp >= ?"}),
+        "task_completions": ("SELECT user_id, username, task_id, completion_date, status FROM task_completions",
+                             ("User ID", "Username", "Task ID", "Completion Date", "Status"),
+                             {"status": "status = ?", "task": "task_id = ?", "since": "completion_date >= ?"}),
+    }
+    FORMATS = {"xlsx": ".xlsx", "csv": ".csv.gz"}
+
+    def __init__(self, table: str, fmt: str = "xlsx", filters: Optional[dict] = None):
+        if table not in self.TABLES:
+            raise ValueError(f"unknown table {table} (tables: {', '.join(self.TABLES)})")
+        if fmt not in self.FORMATS:
+            raise ValueError(f"unknown format {fmt} (formats: {', '.join(self.FORMATS)})")
+        allowed = self.TABLES[table][2]
+        unknown = set(filters or {}) - set(allowed)
+        if unknown:
+            raise ValueError(f"{table} cannot be filtered by {', '.join(sorted(unknown))} (filters: {', '.join(allowed)})")
+        self.table = table
+        self.format = fmt
+        self.filters = filters or {}
+
+    @classmethod
+    def parse(cls, text: str) -> "Export":
+        """'table [format] [filter=value ...]', e.g. 'distributions csv status=confirmed chain=ETH'."""
+        words = text.split()
+        if not words:
+            raise ValueError("no table given")
+        table, *rest = words
+        fmt = rest.pop(0) if rest and "=" not in rest[0] else "xlsx"
+        filters = {}
+        for word in rest:
+            name, sep, value = word.partition("=")
+            if not sep or not value:
+                raise ValueError(f"filter {word} is not name=value")
+            filters[name] = value
+        return cls(table, fmt, filters)
+
+    @property
+    def filename(self) -> str:
+        return f"{self.table}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}{self.FORMATS[self.format]}"
+
+    def query(self) -> tuple:
+        sql, _, allowed = self.TABLES[self.table]
+        if not self.filters:
+            return sql, []
+        return f"{sql} WHERE {' AND '.join(allowed[name] for name in self.filters)}", list(self.filters.values())
+
+    def _rows(self):
+        connection = connect_db(db.path)
+        try:
+            connection.execute("PRAGMA query_only=1")
+            cursor = connection.execute(*self.query())
+            while True:
+                chunk = cursor.fetchmany(EXPORT_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            connection.close()
+
+    def _write(self, path: str) -> int:
+        headers = self.TABLES[self.table][1]
+        count = 0
+        if self.format == "csv":
+            with gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(headers)
+                for chunk in self._rows():
+                    writer.writerows(chunk)
+                    count += len(chunk)
+            return count
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(self.table)
+        sheet.append(headers)
+        for chunk in self._rows():
+            for row in chunk:
+                sheet.append(row)
+            count += len(chunk)
+        workbook.save(path)
+        return count
+
+    async def run(self) -> tuple:
+        """Write the export to a new temp file and return (path, rows). The caller deletes the file."""
+        fd, path = tempfile.mkstemp(prefix=f"airdrop-{self.table}-", suffix=self.FORMATS[self.format])
+        os.close(fd)
+        try:
+            rows = await asyncio.get_running_loop().run_in_executor(None, self._write, path)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, rows
+
+class ReviewQueue:
+    """Keyset pagination over the admin review queues. Pages are ordered by the columns of
+    each queue's pending index and a page starts strictly after (or before) the key of the
+    row it continues from, so page 500 costs the same index seek as page 1. The cursor
+    travels in the callback data: (completion_date, user_id, task_id) for tasks, and just
+    the user_id / referee_id primary key for KYC and referrals, whose sort timestamp is
+    looked up again by key so the callback data stays under Telegram's 64 bytes.
+
+    Pending counts are cached per queue for REVIEW_COUNT_TTL seconds and dropped whenever a
+    decision changes the queue, instead of counting the queue on every page view.
+    """
+
+    PAGES = {
+        "tasks": {
+            "first": "SELECT user_id, task_id, username, completion_date FROM task_completions WHERE status = 'pending' "
+                     "ORDER BY completion_date, user_id, task_id LIMIT ?",
+            "next": "SELECT user_id, task_id, username, completion_date FROM task_completions WHERE status = 'pending' "
+                    "AND (completion_date, user_id, task_id) > (?, ?, ?) ORDER BY completion_date, user_id, task_id LIMIT ?",
+            "prev": "SELECT user_id, task_id, username, completion_date FROM task_completions WHERE status = 'pending' "
+                    "AND (completion_date, user_id, task_id) < (?, ?, ?) ORDER BY completion_date DESC, user_id DESC, task_id DESC LIMIT ?",
+        },
+        "kyc": {
+            "first": "SELECT user_id, kyc_telegram_link, kyc_x_link, kyc_wallet, kyc_chain, kyc_submission_time FROM users "
+                     "WHERE kyc_status = 'submitted' ORDER BY kyc_submission_time, user_id LIMIT ?",
+            "next": "SELECT user_id, kyc_telegram_link, kyc_x_link, kyc_wallet, kyc_chain, kyc_submission_time FROM users "
+                    "WHERE kyc_status = 'submitted' AND (kyc_submission_time, user_id) > ((SELECT kyc_submission_time FROM users WHERE user_id = ?), ?) "
+                    "ORDER BY kyc_submission_time, user_id LIMIT ?",
+            "prev": "SELECT user_id, kyc_telegram_link, kyc_x_link, kyc_wallet, kyc_chain, kyc_submission_time FROM users "
+                    "WHERE kyc_status = 'submitted' AND (kyc_submission_time, user_id) < ((SELECT kyc_submission_time FROM users WHERE user_id = ?), ?) "
+                    "ORDER BY kyc_submission_time DESC, user_id DESC LIMIT ?",
+        },
+        "referrals": {
+            "first": "SELECT r.referrer_id, r.referee_id, r.timestamp, referrer.username, referee.username FROM referrals r "
+                     "LEFT JOIN users referrer ON referrer.user_id = r.referrer_id LEFT JOIN users referee ON referee.user_id = r.referee_id "
+                     "WHERE r.status = 'pending' ORDER BY r.timestamp, r.referee_id LIMIT ?",
+            "next": "SELECT r.referrer_id, r.referee_id, r.timestamp, referrer.username, referee.username FROM referrals r "
+                    "LEFT JOIN users referrer ON referrer.user_id = r.referrer_id LEFT JOIN users referee ON referee.user_id = r.referee_id "
+                    "WHERE r.status = 'pending' AND (r.timestamp, r.referee_id) > ((SELECT timestamp FROM referrals WHERE referee_id = ?), ?) "
+                    "ORDER BY r.timestamp, r.referee_id LIMIT ?",
+            "prev": "SELECT r.referrer_id, r.referee_id, r.timestamp, referrer.username, referee.username FROM referrals r "
+                    "LEFT JOIN users referrer ON referrer.user_id = r.referrer_id LEFT JOIN users referee ON referee.user_id = r.referee_id "
+                    "WHERE r.status = 'pending' AND (r.timestamp, r.referee_id) < ((SELECT timestamp FROM referrals WHERE referee_id = ?), ?) "
+                    "ORDER BY r.timestamp DESC, r.referee_id DESC LIMIT ?",
+        },
+    }
+    COUNTS = {
+        "tasks": "SELECT COUNT(*) FROM task_completions WHERE status = 'pending'",
+        "kyc": "SELECT COUNT(*) FROM users WHERE kyc_status = 'submitted'",
+        "referrals": "SELECT COUNT(*) FROM referrals WHERE status = 'pending'",
+    }
+    _counts = {}
+
+    @staticmethod
+    def cursor(queue: str, row) -> str:
+        if queue == "tasks":
+            user_id, task_id, _, completion_date = row
+            return f"{completion_date}_{user_id}_{task_id}"
+        return row[0] if queue == "kyc" else row[1]
+
+    @staticmethod
+    def _cursor_params(queue: str, cursor: list) -> list:
+        if queue == "tasks":
+            completion_date, user_id, task_id = cursor
+            return [completion_date, user_id, int(task_id)]
+        return [cursor[0], cursor[0]]
+
+    @classmethod
+    async def page(cls, queue: str, direction: str = "first", cursor: Optional[list] = None,
+                   size: int = REVIEW_PAGE_SIZE) -> tuple:
+        """One page of a queue as (rows, has_previous, has_next). direction is first, or next/prev
+        relative to the cursor args; a page that has emptied since falls back to the first."""
+        params = [] if direction == "first" else cls._cursor_params(queue, cursor)
+        rows = await db.fetchall(cls.PAGES[queue][direction], (*params, size + 1))
+        more = len(rows) > size
+        rows = rows[:size]
+        if direction == "prev":
+            rows.reverse()
+            return (rows, more, True) if rows else await cls.page(queue, "first", size=size)
+        if direction == "next" and not rows:
+            return await cls.page(queue, "first", size=size)
+        return rows, direction == "next", more
+
+    @classmethod
+    async def count(cls, queue: str) -> int:
+        cached = cls._counts.get(queue)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        total = await db.fetchval(cls.COUNTS[queue], default=0)
+        cls._counts[queue] = (total, time.monotonic() + REVIEW_COUNT_TTL)
+        return total
+
+    @classmethod
+    def invalidate(cls, queue: str):
+        cls._counts.pop(queue, None)
+
+    @staticmethod
+    def navigation(queue: str, list_route: str, rows: list, has_previous: bool, has_next: bool) -> list:
+        buttons = []
+        if has_previous:
+            buttons.append(InlineKeyboardButton("Previous", callback_data=f"{list_route}_prev_{ReviewQueue.cursor(queue, rows[0])}"))
+        if has_next:
+            buttons.append(InlineKeyboardButton("Next", callback_data=f"{list_route}_next_{ReviewQueue.cursor(queue, rows[-1])}"))
+        return [buttons] if buttons else []
+
+class Moderation:
+    """Bulk approve/reject for one review queue: pending task completions ("tasks"),
+    submitted KYC ("kyc") or pending referrals ("referrals"). Everything in the queue that
+    matches the filters (and, for a page, the given keys) is decided by one set-based
+    UPDATE in one write transaction, and approval rewards are credited in the same
+    transaction with one UPDATE ... FROM. A thousand approvals therefore cost one commit
+    instead of a thousand. apply() returns the decided rows so their users can be notified
+    afterwards through the dispatcher's bulk queue.
+
+    Filters are whitelisted per queue like Export's: name -> SQL predicate on the value.
+    Auto-approve rules are filter sets kept in config as auto_approve_<queue>.
+    """
+
+    TASK_REWARD = 10
+    REFERRAL_BONUS = 15
+    DECISIONS = {"approve": "approved", "reject": "rejected"}
+    QUEUES = {"tasks": ("approve_tasks", "task submissions"), "kyc": ("approve_kyc", "KYC submissions"),
+              "referrals": ("approve_referrals", "referrals")}
+    FILTERS = {
+        "tasks": {"task": "t.task_id = ?", "before": "t.completion_date < ?"},
+        "kyc": {"chain": "u.kyc_chain = ?", "before": "u.kyc_submission_time < ?"},
+        "referrals": {"referrer": "r.referrer_id = ?", "before": "r.timestamp < ?",
+                      "verified": "EXISTS (SELECT 1 FROM users v WHERE v.user_id = r.referee_id AND v.kyc_status = 'verified') = CAST(? AS INTEGER)"},
+    }
+    RULE_KEYS = tuple(f"auto_approve_{queue}" for queue in QUEUES)
+
+    def __init__(self, queue: str, filters: Optional[dict] = None, keys: Optional[list] = None):
+        if queue not in self.QUEUES:
+            raise ValueError(f"unknown queue {queue} (queues: {', '.join(self.QUEUES)})")
+        allowed = self.FILTERS[queue]
+        unknown = set(filters or {}) - set(allowed)
+        if unknown:
+            raise ValueError(f"{queue} cannot be filtered by {', '.join(sorted(unknown))} (filters: {', '.join(allowed)})")
+        self.queue = queue
+        self.filters = filters or {}
+        clauses = [allowed[name] for name in self.filters]
+        self.params = list(self.filters.values())
+        if keys is not None:
+            clauses.append(self._keys_clause(keys))
+            self.params.extend(value for key in keys for value in (key if queue == "tasks" else [key]))
+        self.where = " AND ".join(clauses) or "1"
+
+    def _keys_clause(self, keys: list) -> str:
+        if not keys:
+            return "0"
+        if self.queue == "tasks":
+            return f"(t.user_id, t.task_id, t.completion_date) IN (VALUES {', '.join(['(?, ?, ?)'] * len(keys))})"
+        column = "u.user_id" if self.queue == "kyc" else "r.referee_id"
+        return f"{column} IN ({', '.join('?' * len(keys))})"
+
+    @classmethod
+    def parse(cls, text: str) -> "Moderation":
+        """'queue [filter=value ...]', e.g. 'tasks task=3' or 'referrals verified=1'."""
+        words = text.split()
+        if not words:
+            raise ValueError("no queue given")
+        filters = {}
+        for word in words[1:]:
+            name, sep, value = word.partition("=")
+            if not sep or not value:
+                raise ValueError(f"filter {word} is not name=value")
+            filters[name] = value
+        return cls(words[0], filters)
+
+    @property
+    def rule(self) -> str:
+        return " ".join(f"{name}={value}" for name, value in self.filters.items())
+
+    @classmethod
+    async def rules(cls) -> dict:
+        rows = await db.fetchall("SELECT key, value FROM config WHERE key IN (?, ?, ?)", cls.RULE_KEYS)
+        return {key[len("auto_approve_"):]: value for key, value in rows}
+
+    def _decide_tasks(self, decision: str, c: sqlite3.Connection) -> list:
+        pending = f"FROM task_completions t WHERE t.status = 'pending' AND {self.where}"
+        rows = c.execute("SELECT t.user_id, t.task_id, u.language, d.description FROM task_completions t "
+                         "LEFT JOIN users u ON u.user_id = t.user_id LEFT JOIN daily_tasks d ON d.id = t.task_id "
+                         f"WHERE t.status = 'pending' AND {self.where}", self.params).fetchall()
+        if rows and decision == "approve":
+            c.execute(f"UPDATE users SET momo_balance = momo_balance + ? * p.completions FROM "
+                      f"(SELECT t.user_id, COUNT(*) AS completions {pending} GROUP BY t.user_id) p WHERE users.user_id = p.user_id",
+                      [self.TASK_REWARD, *self.params])
+        if rows:
+            c.execute(f"UPDATE task_completions SET status = ? WHERE rowid IN (SELECT t.rowid {pending})",
+                      [self.DECISIONS[decision], *self.params])
+        return rows
+
+    def _decide_kyc(self, decision: str, c: sqlite3.Connection) -> list:
+        pending = f"FROM users u WHERE u.kyc_status = 'submitted' AND {self.where}"
+        rows = c.execute(f"SELECT u.user_id, u.language {pending}", self.params).fetchall()
+        if rows:
+            c.execute(f"UPDATE users SET kyc_status = ? WHERE rowid IN (SELECT u.rowid {pending})",
+                      ["verified" if decision == "approve" else "rejected", *self.params])
+        return rows
+
+    def _decide_referrals(self, decision: str, c: sqlite3.Connection) -> list:
+        pending = f"FROM referrals r WHERE r.status = 'pending' AND {self.where}"
+        rows = c.execute("SELECT r.referrer_id, r.referee_id, referrer.language, referee.language, referee.username FROM referrals r "
+                         "LEFT JOIN users referrer ON referrer.user_id = r.referrer_id LEFT JOIN users referee ON referee.user_id = r.referee_id "
+                         f"WHERE r.status = 'pending' AND {self.where}", self.params).fetchall()
+        if rows and decision == "approve":
+            c.execute(f"UPDATE users SET momo_balance = momo_balance + ? * p.referrals FROM "
+                      f"(SELECT r.referrer_id, COUNT(*) AS referrals {pending} GROUP BY r.referrer_id) p WHERE users.user_id = p.referrer_id",
+                      [self.REFERRAL_BONUS, *self.params])
+        if rows:
+            c.execute(f"UPDATE referrals SET status = ? WHERE rowid IN (SELECT r.rowid {pending})",
+                      [self.DECISIONS[decision], *self.params])
+        return rows
+
+    async def apply(self, decision: str) -> list:
+        """Approve or reject everything in the queue that matches; returns the decided rows."""
+        rows = await db.write(partial(getattr(self, f"_decide_{self.queue}"), decision), f"moderation: {decision} {self.queue}")
+        ReviewQueue.invalidate(self.queue)
+        credits = {}
+        for row in rows:
+            if self.queue == "kyc":
+                profile_cache.update(row[0], kyc_status="verified" if decision == "approve" else "rejected")
+            elif decision == "approve":
+                reward = self.TASK_REWARD if self.queue == "tasks" else self.REFERRAL_BONUS
+                credits[row[0]] = credits.get(row[0], 0) + reward
+        for user_id, amount in credits.items():
+            note_balance_change(user_id, amount)
+        return rows
+
+    def notifications(self, decision: str, rows: list) -> list:
+        """(chat_id, text) for every user a decision concerns, in their own language."""
+        def strings(language):
+            return LANGUAGES[language if language in LANGUAGES else "en"]
+        messages = []
+        for row in rows:
+            if self.queue == "tasks":
+                user_id, task_id, language, description = row
+                messages.append((user_id, strings(language)[f"task_{self.DECISIONS[decision]}"].format(task_description=description)))
+            elif self.queue == "kyc":
+                user_id, language = row
+                messages.append((user_id, strings(language)[f"kyc_{self.DECISIONS[decision]}"]))
             else:
-                xrp_balance = float(response.result["account_data"]["Balance"]) / 10**6
-                tier = min(3, max(1, int(xrp_balance // 10)))
-                token_balance = xrp_balance
-        min_balance = float(cursor.execute("SELECT value FROM config WHERE key = 'min_token_balance'").fetchone()[0])
-        return tier if tier > 0 or token_balance >= min_balance else 0, token_balance
-    except Exception as e:
-        logger.error(f"Eligibility check failed for {wallet} on {chain}: {str(e)}")
-        return 0, 0.0
+                referrer_id, referee_id, referrer_language, referee_language, referee_name = row
+                referee_name = referee_name or "Unknown"
+                if decision == "approve":
+                    messages.append((referrer_id, strings(referrer_language)["referral_bonus"].format(bonus=self.REFERRAL_BONUS, referee=referee_name)))
+                messages.append((referee_id, strings(referee_language)[f"referral_{self.DECISIONS[decision]}"].format(referee=referee_name)))
+        return messages
+
+    @staticmethod
+    async def notify(context: BotContext, messages: list):
+        results = await asyncio.gather(*(context.send_message(chat_id, text, bulk=True) for chat_id, text in messages),
+                                       return_exceptions=True)
+        failed = sum(1 for result in results if isinstance(result, Exception))
+        if failed:
+            logger.warning(f"Moderation notifications: {failed} of {len(messages)} could not be sent")
 
 def get_main_menu(user_id, lang):
     keyboard = [
@@ -365,598 +3256,864 @@ def get_main_menu(user_id, lang):
              InlineKeyboardButton("Admin: Edit Campaign", callback_data="edit_campaign")],
             [InlineKeyboardButton("Admin: Add Task", callback_data="add_daily_task"),
              InlineKeyboardButton("Admin: Edit Task", callback_data="edit_daily_task")],
-            [InlineKeyboardButton("Admin: Delete Task", callback_data="delete_daily_task")],
-            [InlineKeyboardButton("Admin: Test Message", callback_data="test_message")]  # Added for debugging
+            [InlineKeyboardButton("Admin: Delete Task", callback_data="delete_daily_task"),
+             InlineKeyboardButton("Admin: Snapshot", callback_data="take_snapshot")],
+            [InlineKeyboardButton("Admin: Broadcast", callback_data="broadcast"),
+             InlineKeyboardButton("Admin: Auto-Approve", callback_data="auto_approve")],
+            [InlineKeyboardButton("Admin: Referral Graph", callback_data="referral_graph"),
+             InlineKeyboardButton("Admin: Test Message", callback_data="test_message")]  # Added for debugging
         ])
     return InlineKeyboardMarkup(keyboard)
 
+class CallbackRoute:
+    __slots__ = ("name", "handler", "admin", "calls", "errors", "total", "max")
+
+    def __init__(self, name: str, handler, admin: bool):
+        self.name = name
+        self.handler = handler
+        self.admin = admin
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+class CallbackRouter:
+    """Callback data -> handler. Exact keys live in a dict and prefixes in a character trie
+    where the longest matching prefix wins, so dispatch costs one dict lookup plus a walk
+    over the payload, however many routes there are. A prefix route gets the rest of the
+    payload split on "_" as args. admin=True routes do nothing for anyone but the admin,
+    as if the callback were unknown. Every dispatch is timed per route.
+
+    Handlers are AirdropBot methods taking (context, user_id, lang, chat_id, args),
+    registered with the route()/prefix() decorators.
+    """
+
+    def __init__(self):
+        self.exact = {}
+        self.trie = {}
+
+    def route(self, key: str, admin: bool = False):
+        def register(handler):
+            self.exact[key] = CallbackRoute(key, handler, admin)
+            return handler
+        return register
+
+    def prefix(self, prefix: str, admin: bool = False):
+        def register(handler):
+            node = self.trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[None] = CallbackRoute(prefix + "*", handler, admin)
+            return handler
+        return register
+
+    def resolve(self, data: str) -> tuple:
+        route = self.exact.get(data)
+        if route is not None:
+            return route, []
+        node, match, length = self.trie, None, 0
+        for i, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                match, length = node[None], i + 1
+        return (match, data[length:].split("_")) if match else (None, [])
+
+    async def dispatch(self, bot, data: str, context, user_id: str, lang: str, chat_id: str):
+        route, args = self.resolve(data)
+        if route is None or (route.admin and not is_admin(user_id)):
+            return
+        started = time.perf_counter()
+        try:
+            await route.handler(bot, context, user_id, lang, chat_id, args)
+        except Exception:
+            route.errors += 1
+            HANDLER_ERRORS.inc("callback", route.name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            route.calls += 1
+            route.total += elapsed
+            route.max = max(route.max, elapsed)
+            HANDLER_SECONDS.observe(elapsed, "callback", route.name)
+
+    def routes(self) -> list:
+        routes = list(self.exact.values())
+        nodes = [self.trie]
+        while nodes:
+            node = nodes.pop()
+            routes.extend(child for char, child in node.items() if char is None)
+            nodes.extend(child for char, child in node.items() if char is not None)
+        return routes
+
+    def stats(self) -> dict:
+        return {route.name: {"calls": route.calls, "errors": route.errors, "max": route.max,
+                             "avg": route.total / route.calls if route.calls else 0.0}
+                for route in self.routes()}
+
+callbacks = CallbackRouter()
+
 # Core Bot Logic
 class AirdropBot:
     def __init__(self):
         self.telegram_app = None
         self.discord_bot = None
+        self.distribution_task = None
+        self.snapshot_task = None
 
+    @instrumented("command", "start")
     async def start(self, update: Union[Update, discord.Message], context: BotContext):
         user_id = str(update.message.from_user.id if context.platform == "telegram" else update.author.id)
+        context = await context.for_user(user_id)
         user_name = update.message.from_user.first_name if context.platform == "telegram" else update.author.name
-        lang = get_user_language(user_id)
+        lang = await get_user_language(user_id)
         chat_id = str(update.message.chat_id if context.platform == "telegram" else update.channel.id)
 
         referral_code = generate_referral_code(user_id)
-        cursor.execute("INSERT OR IGNORE INTO users (user_id, username, language, referral_code, kyc_status, agreed_terms, has_seen_menu, joined_groups) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                       (user_id, user_name, lang, referral_code, "pending", 0, 0, 0))
-        conn.commit()
+        db.defer("INSERT OR IGNORE INTO users (user_id, username, language, referral_code, kyc_status, agreed_terms, has_seen_menu, joined_groups) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                 (user_id, user_name, lang, referral_code, "pending", 0, 0, 0))
+        profile_cache.prime(user_id, {"username": user_name, "language": lang, "kyc_status": "pending", "agreed_terms": 0,
+                                      "momo_balance": 0.0, "has_seen_menu": 0, "joined_groups": 0})
+        leaderboard.track(user_id, user_name)
 
         args = update.message.text.split() if context.platform == "telegram" else update.content.split()
         if len(args) > 1 and args[1].startswith("start="):
             referrer_id = args[1].split("=")[1]
-            cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (referrer_id,))
-            referrer = cursor.fetchone()
+            referrer = await db.fetchone("SELECT user_id FROM users WHERE user_id = ?", (referrer_id,))
             if referrer and referrer[0] != user_id:
-                cursor.execute("SELECT referee_id FROM referrals WHERE referee_id = ?", (user_id,))
-                if cursor.fetchone():
+                if await db.fetchone("SELECT referee_id FROM referrals WHERE referee_id = ?", (user_id,)):
                     await context.send_message(chat_id, LANGUAGES[lang]["referral_duplicate"])
                 else:
-                    cursor.execute("INSERT OR IGNORE INTO referrals (referrer_id, referee_id, timestamp) VALUES (?, ?, ?)",
-                                   (referrer[0], user_id, datetime.utcnow().isoformat()))
-                    cursor.execute("UPDATE users SET referred_by = ? WHERE user_id = ?", (referrer[0], user_id))
-                    conn.commit()
+                    await db.execute_batch([
+                        ("INSERT OR IGNORE INTO referrals (referrer_id, referee_id, timestamp) VALUES (?, ?, ?)",
+                         (referrer[0], user_id, datetime.utcnow().isoformat())),
+                        ("UPDATE users SET referred_by = ? WHERE user_id = ?", (referrer[0], user_id))
+                    ])
                     await context.send_message(referrer[0], LANGUAGES[lang]["referral_pending"].format(referee=user_name))
                     if ADMIN_ID:
                         await context.send_message(ADMIN_ID, LANGUAGES[lang]["referral_notification"].format(
                             referrer_id=referrer[0], referee_id=user_id, referee_name=user_name, time=datetime.utcnow().isoformat()))
                         logger.info(f"Admin notified of referral: {referrer[0]} -> {user_id}")
 
-        if not has_seen_menu(user_id):
+        if not await has_seen_menu(user_id):
             keyboard = [[InlineKeyboardButton("Continue", callback_data="check_groups")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await context.send_message(chat_id, LANGUAGES[lang]["mandatory_rules"], reply_markup)
         else:
-            balance = get_user_balance(user_id)
+            balance = await get_user_balance(user_id)
             reply_markup = get_main_menu(user_id, lang)
             await context.send_message(chat_id, LANGUAGES[lang]["welcome"].format(balance=balance, ref_link=referral_code), reply_markup)
         logger.info(f"User {user_name} ({user_id}) started the bot")
 
+    @instrumented("command", "join_airdrop")
     async def join_airdrop(self, update: Union[Update, discord.Message], context: BotContext):
         user_id = str(update.message.from_user.id if context.platform == "telegram" else update.author.id)
-        lang = get_user_language(user_id)
+        context = await context.for_user(user_id)
+        lang = await get_user_language(user_id)
         chat_id = str(update.message.chat_id if context.platform == "telegram" else update.channel.id)
         keyboard = [[InlineKeyboardButton("Check Eligibility", callback_data="check_eligibility")],
                     [InlineKeyboardButton("Back to Menu", callback_data="start")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await context.send_message(chat_id, LANGUAGES[lang]["join_airdrop"], reply_markup)
 
+    async def run_distribution(self, context: BotContext):
+        try:
+            job = await DistributionJob.open(1)
+            logger.info(f"{'Resuming' if job.resumed else 'Starting'} distribution job {job.id}")
+
+            async def run_chain(distributor):
+                recovered = await distributor.recover(await job.in_flight(distributor.chain), job)
+                if recovered["recovered"]:
+                    logger.info(f"{distributor.chain} job {job.id}: {recovered}")
+                return await distributor.distribute(await job.queued(distributor.chain), job)
+
+            distributors = (eth_distributor, bsc_distributor, xrp_distributor, sol_distributor)
+            results = await asyncio.gather(*(run_chain(distributor) for distributor in distributors))
+            for distributor, summary in zip(distributors, results):
+                logger.info(f"{distributor.chain} distribution finished: {summary['sent']} sent in {summary['transactions']} transactions, "
+                            f"{summary['failed']} failed, {summary['confirmed']} confirmed, {summary['reverted']} reverted, "
+                            f"{summary['unconfirmed']} unconfirmed")
+            logger.info(f"Distribution job {job.id} row states: {await job.finish()}")
+            log_rpc_stats()
+            if job.completed:
+                # Receipts go out once every payout has settled, as a broadcast rather than from the send loop.
+                await self.run_broadcast(context, await Broadcast.create(f"payouts:{job.id}", "payout_receipt", unique=True), ADMIN_ID)
+        except Exception as e:
+            logger.error(f"Airdrop distribution failed: {e}")
+
+    async def run_broadcast(self, context: BotContext, broadcast: Broadcast, chat_id: Optional[str] = None):
+        try:
+            counts = await broadcast.run(context)
+            if chat_id:
+                await context.send_message(chat_id, f"Broadcast {broadcast.id} ({broadcast.audience}) finished: {counts['delivered']} delivered, "
+                                                    f"{counts['blocked']} blocked, {counts['failed']} failed.")
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast.id} failed: {e}")
+
+    async def run_export(self, context: BotContext, chat_id: str, export: Export):
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        try:
+            path, rows = await export.run()
+        except Exception as e:
+            logger.error(f"Export of {export.table} failed: {e}")
+            await context.send_message(chat_id, f"Export failed: {e}", reply_markup)
+            return
+        try:
+            with open(path, "rb") as document:
+                await context.send_document(chat_id, document, export.filename)
+            await context.send_message(chat_id, f"Exported {rows} {export.table} rows.", reply_markup)
+        except Exception as e:
+            logger.error(f"Uploading the {export.table} export failed: {e}")
+        finally:
+            os.remove(path)
+
+    async def run_snapshot(self, context: BotContext, chat_id: str, campaign_id: int, heights: dict):
+        try:
+            snapshot = await Snapshot.open(campaign_id, heights)
+            pinned = ", ".join(f"{chain} {height}" for chain, height in snapshot.heights.items())
+            await context.send_message(chat_id, f"{'Resuming' if snapshot.resumed else 'Taking'} snapshot {snapshot.id} of "
+                                                f"{snapshot.total} wallets at {pinned} (SOL at the current slot).")
+
+            async def progress(done, total):
+                await context.send_message(chat_id, f"Snapshot {snapshot.id}: {done}/{total} wallets read.")
+            result = await snapshot.run(progress)
+            log_rpc_stats()
+            if result["failed"]:
+                await context.send_message(chat_id, f"Snapshot {snapshot.id}: {result['failed']} wallets could not be read. "
+                                                    f"Run the snapshot again for campaign {campaign_id} to retry them.")
+            else:
+                await context.send_message(chat_id, f"Snapshot {snapshot.id} completed: {result['done']} wallets. "
+                                                    f"Airdrop tiers for campaign {campaign_id} now use it.")
+        except Exception as e:
+            logger.error(f"Snapshot for campaign {campaign_id} failed: {e}")
+            await context.send_message(chat_id, f"Snapshot failed: {e}")
+
     async def button_handler(self, update: Union[Update, discord.Message], context: BotContext):
         user_id = str(update.callback_query.from_user.id if context.platform == "telegram" else update.author.id)
-        lang = get_user_language(user_id)
+        context = await context.for_user(user_id)
+        lang = await get_user_language(user_id)
         chat_id = str(update.callback_query.message.chat_id if context.platform == "telegram" else update.channel.id)
         data = update.callback_query.data if context.platform == "telegram" else update.content.split()[1] if len(update.content.split()) > 1 else ""
+        await callbacks.dispatch(self, data, context, user_id, lang, chat_id)
+        if context.platform == "telegram":
+            await update.callback_query.answer()
 
-        if data == "start":
-            if not has_seen_menu(user_id):
-                keyboard = [[InlineKeyboardButton("Continue", callback_data="check_groups")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, LANGUAGES[lang]["mandatory_rules"], reply_markup)
-            else:
-                balance = get_user_balance(user_id)
-                referral_code = generate_referral_code(user_id)
-                reply_markup = get_main_menu(user_id, lang)
-                await context.send_message(chat_id, LANGUAGES[lang]["welcome"].format(balance=balance, ref_link=referral_code), reply_markup)
-            context.user_data.clear()
-
-        elif data == "check_groups":
-            if has_joined_groups(user_id):
-                cursor.execute("UPDATE users SET has_seen_menu = 1 WHERE user_id = ?", (user_id,))
-                conn.commit()
-                balance = get_user_balance(user_id)
-                referral_code = generate_referral_code(user_id)
-                reply_markup = get_main_menu(user_id, lang)
-                await context.send_message(chat_id, LANGUAGES[lang]["welcome"].format(balance=balance, ref_link=referral_code), reply_markup)
-            else:
-                keyboard = [[InlineKeyboardButton("I’ve Joined Both Groups", callback_data="confirm_groups")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, LANGUAGES[lang]["confirm_groups"], reply_markup)
+    @callbacks.route("start")
+    async def on_start(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        if not await has_seen_menu(user_id):
+            keyboard = [[InlineKeyboardButton("Continue", callback_data="check_groups")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await context.send_message(chat_id, LANGUAGES[lang]["mandatory_rules"], reply_markup)
+        else:
+            balance = await get_user_balance(user_id)
+            referral_code = generate_referral_code(user_id)
+            reply_markup = get_main_menu(user_id, lang)
+            await context.send_message(chat_id, LANGUAGES[lang]["welcome"].format(balance=balance, ref_link=referral_code), reply_markup)
+        context.user_data.clear()
 
-        elif data == "confirm_groups":
-            cursor.execute("UPDATE users SET joined_groups = 1, has_seen_menu = 1 WHERE user_id = ?", (user_id,))
-            conn.commit()
-            balance = get_user_balance(user_id)
+    @callbacks.route("check_groups")
+    async def on_check_groups(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        if await has_joined_groups(user_id):
+            db.defer("UPDATE users SET has_seen_menu = 1 WHERE user_id = ?", (user_id,))
+            profile_cache.update(user_id, has_seen_menu=1)
+            balance = await get_user_balance(user_id)
             referral_code = generate_referral_code(user_id)
             reply_markup = get_main_menu(user_id, lang)
             await context.send_message(chat_id, LANGUAGES[lang]["welcome"].format(balance=balance, ref_link=referral_code), reply_markup)
+        else:
+            keyboard = [[InlineKeyboardButton("I’ve Joined Both Groups", callback_data="confirm_groups")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await context.send_message(chat_id, LANGUAGES[lang]["confirm_groups"], reply_markup)
 
-        elif data == "join_airdrop":
-            if not check_mandatory_tasks(user_id) or check_kyc_status(user_id) != "verified":
-                keyboard = [[InlineKeyboardButton("Daily Tasks", callback_data="daily_tasks")],
-                            [InlineKeyboardButton("KYC", callback_data="kyc_start")],
-                            [InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, LANGUAGES[lang]["mandatory_missing"], reply_markup)
-            else:
-                keyboard = [[InlineKeyboardButton("Check Eligibility", callback_data="check_eligibility")],
-                            [InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, LANGUAGES[lang]["join_airdrop"], reply_markup)
-
-        elif data == "check_eligibility":
-            cursor.execute("SELECT wallet, chain FROM submissions WHERE user_id = ?", (user_id,))
-            submission = cursor.fetchone()
-            if not submission:
-                keyboard = [[InlineKeyboardButton("Submit Wallet", callback_data="submit_wallet")],
-                            [InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "Please submit your wallet first.", reply_markup)
-            else:
-                wallet, chain = submission
-                tier, token_balance = await check_eligibility(wallet, chain)
-                status = "Eligible" if tier > 0 and check_mandatory_tasks(user_id) and check_kyc_status(user_id) == "verified" else "Not Eligible"
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, LANGUAGES[lang]["eligibility"].format(status=status), reply_markup)
+    @callbacks.route("confirm_groups")
+    async def on_confirm_groups(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        db.defer("UPDATE users SET joined_groups = 1, has_seen_menu = 1 WHERE user_id = ?", (user_id,))
+        profile_cache.update(user_id, joined_groups=1, has_seen_menu=1)
+        balance = await get_user_balance(user_id)
+        referral_code = generate_referral_code(user_id)
+        reply_markup = get_main_menu(user_id, lang)
+        await context.send_message(chat_id, LANGUAGES[lang]["welcome"].format(balance=balance, ref_link=referral_code), reply_markup)
 
-        elif data == "balance":
-            balance = get_user_balance(user_id)
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+    @callbacks.route("join_airdrop")
+    async def on_join_airdrop(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        if not await check_mandatory_tasks(user_id) or await check_kyc_status(user_id) != "verified":
+            keyboard = [[InlineKeyboardButton("Daily Tasks", callback_data="daily_tasks")],
+                        [InlineKeyboardButton("KYC", callback_data="kyc_start")],
+                        [InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, LANGUAGES[lang]["balance"].format(balance=balance), reply_markup)
-
-        elif data == "terms":
-            vesting_days = cursor.execute("SELECT value FROM config WHERE key = 'vesting_period_days'").fetchone()[0]
-            keyboard = [[InlineKeyboardButton(" Agree", callback_data="agree_terms")],
+            await context.send_message(chat_id, LANGUAGES[lang]["mandatory_missing"], reply_markup)
+        else:
+            keyboard = [[InlineKeyboardButton("Check Eligibility", callback_data="check_eligibility")],
                         [InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, LANGUAGES[lang]["terms"].format(vesting_days=vesting_days), reply_markup)
+            await context.send_message(chat_id, LANGUAGES[lang]["join_airdrop"], reply_markup)
 
-        elif data == "agree_terms":
-            cursor.execute("UPDATE users SET agreed_terms = 1 WHERE user_id = ?", (user_id,))
-            conn.commit()
+    @callbacks.route("check_eligibility")
+    async def on_check_eligibility(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        submission = await db.fetchone("SELECT wallet, chain FROM submissions WHERE user_id = ?", (user_id,))
+        if not submission:
+            keyboard = [[InlineKeyboardButton("Submit Wallet", callback_data="submit_wallet")],
+                        [InlineKeyboardButton("Back to Menu", callback_data="start")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await context.send_message(chat_id, "Please submit your wallet first.", reply_markup)
+        else:
+            wallet, chain = submission
+            tier, token_balance = await check_eligibility(wallet, chain)
+            status = "Eligible" if tier > 0 and await check_mandatory_tasks(user_id) and await check_kyc_status(user_id) == "verified" else "Not Eligible"
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, "Terms agreed! Proceed with other actions.", reply_markup)
+            await context.send_message(chat_id, LANGUAGES[lang]["eligibility"].format(status=status), reply_markup)
 
-        elif data == "kyc_start":
-            if check_kyc_status(user_id) == "verified":
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "Your KYC is already verified!", reply_markup)
-            else:
-                context.user_data['kyc_step'] = "telegram"
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, LANGUAGES[lang]["kyc_start"], reply_markup)
+    @callbacks.route("balance")
+    async def on_balance(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        balance = await get_user_balance(user_id)
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, LANGUAGES[lang]["balance"].format(balance=balance), reply_markup)
 
-        elif data == "kyc_status":
-            status = check_kyc_status(user_id)
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, LANGUAGES[lang]["kyc_status"].format(status=status), reply_markup)
-
-        elif data == "submit_wallet":
-            keyboard = [
-                [InlineKeyboardButton("ETH", callback_data="wallet_eth"),
-                 InlineKeyboardButton("BSC", callback_data="wallet_bsc"),
-                 InlineKeyboardButton("SOL", callback_data="wallet_sol"),
-                 InlineKeyboardButton("XRP", callback_data="wallet_xrp")],
-                [InlineKeyboardButton("Back to Menu", callback_data="start")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            context.user_data['awaiting_wallet'] = True
-            await context.send_message(chat_id, LANGUAGES[lang]["usage"], reply_markup)
+    @callbacks.route("terms")
+    async def on_terms(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        vesting_days = await db.fetchval("SELECT value FROM config WHERE key = 'vesting_period_days'")
+        keyboard = [[InlineKeyboardButton(" Agree", callback_data="agree_terms")],
+                    [InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, LANGUAGES[lang]["terms"].format(vesting_days=vesting_days), reply_markup)
 
-        elif data.startswith("wallet_"):
-            chain = data.split("_")[1].upper()
-            context.user_data['chain'] = chain
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, f"Enter your {chain} wallet address (e.g., 0x... or SoL... or r...):", reply_markup)
-
-        elif data == "tasks":
-            keyboard = [
-                [InlineKeyboardButton("Task 1: Follow", callback_data="submit_task_1"),
-                 InlineKeyboardButton("Task 2: Retweet", callback_data="submit_task_2")],
-                [InlineKeyboardButton("Back to Menu", callback_data="start")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, LANGUAGES[lang]["tasks"], reply_markup)
+    @callbacks.route("agree_terms")
+    async def on_agree_terms(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        db.defer("UPDATE users SET agreed_terms = 1 WHERE user_id = ?", (user_id,))
+        profile_cache.update(user_id, agreed_terms=1)
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, "Terms agreed! Proceed with other actions.", reply_markup)
 
-        elif data.startswith("submit_task_"):
-            task_id = data.split("_")[2]
-            context.user_data['task_id'] = task_id
+    @callbacks.route("kyc_start")
+    async def on_kyc_start(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        if await check_kyc_status(user_id) == "verified":
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, "Submit your Twitter proof link (e.g., https://twitter.com/...):", reply_markup)
-
-        elif data == "daily_tasks":
-            logger.info(f"Daily tasks requested by user {user_id}")
-            today = datetime.utcnow().strftime("%Y-%m-%d")
-            cursor.execute("SELECT id, description, mandatory, task_link FROM daily_tasks WHERE active = 1")
-            tasks = cursor.fetchall()
-            logger.info(f"Found {len(tasks)} active tasks")
-            if not tasks:
-                task_list = "No active tasks available at this time."
-            else:
-                task_list = "\n".join([f"ID: {task[0]} | {task[1]}{' (Mandatory)' if task[2] else ''}\nLink: {task[3]}" for task in tasks])
-                if context.platform == "discord" and len(task_list) > 1900:
-                    task_list = task_list[:1900] + "\n... (Truncated, see full list on Telegram)"
+            await context.send_message(chat_id, "Your KYC is already verified!", reply_markup)
+        else:
+            context.user_data['kyc_step'] = "telegram"
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            try:
-                await context.send_message(chat_id, LANGUAGES[lang]["daily_tasks"].format(daily_tasks=task_list), reply_markup)
-                logger.info(f"Sent daily tasks to user {user_id}")
-            except Exception as e:
-                logger.error(f"Failed to send daily tasks to {user_id}: {str(e)}")
-                await context.send_message(chat_id, "Error retrieving tasks. Please try again later.", reply_markup)
+            await context.send_message(chat_id, LANGUAGES[lang]["kyc_start"], reply_markup)
 
-        elif data == "refer":
-            referral_code = generate_referral_code(user_id)
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, f"Your referral link: {referral_code}\nShare this with friends!", reply_markup)
+    @callbacks.route("kyc_status")
+    async def on_kyc_status(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        status = await check_kyc_status(user_id)
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, LANGUAGES[lang]["kyc_status"].format(status=status), reply_markup)
 
-        elif data == "claim_tokens":
-            cursor.execute("SELECT amount, vesting_end FROM distributions WHERE user_id = ? AND status = 'claimable'", (user_id,))
-            distribution = cursor.fetchone()
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            if not distribution:
-                await context.send_message(chat_id, "No claimable Momo Coins found.", reply_markup)
+    @callbacks.route("submit_wallet")
+    async def on_submit_wallet(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        keyboard = [
+            [InlineKeyboardButton("ETH", callback_data="wallet_eth"),
+             InlineKeyboardButton("BSC", callback_data="wallet_bsc"),
+             InlineKeyboardButton("SOL", callback_data="wallet_sol"),
+             InlineKeyboardButton("XRP", callback_data="wallet_xrp")],
+            [InlineKeyboardButton("Back to Menu", callback_data="start")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        context.user_data['awaiting_wallet'] = True
+        await context.send_message(chat_id, LANGUAGES[lang]["usage"], reply_markup)
+
+    @callbacks.prefix("wallet_")
+    async def on_wallet(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        chain = args[0].upper()
+        context.user_data['chain'] = chain
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, f"Enter your {chain} wallet address (e.g., 0x... or SoL... or r...):", reply_markup)
+
+    @callbacks.route("tasks")
+    async def on_tasks(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        keyboard = [
+            [InlineKeyboardButton("Task 1: Follow", callback_data="submit_task_1"),
+             InlineKeyboardButton("Task 2: Retweet", callback_data="submit_task_2")],
+            [InlineKeyboardButton("Back to Menu", callback_data="start")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, LANGUAGES[lang]["tasks"], reply_markup)
+
+    @callbacks.prefix("submit_task_")
+    async def on_submit_task(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        task_id = args[0]
+        context.user_data['task_id'] = task_id
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, "Submit your Twitter proof link (e.g., https://twitter.com/...):", reply_markup)
+
+    @callbacks.route("daily_tasks")
+    async def on_daily_tasks(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        logger.info(f"Daily tasks requested by user {user_id}")
+        today = datetime.utcnow().strftime("%Y-%m-%d")
+        tasks = await db.fetchall("SELECT id, description, mandatory, task_link FROM daily_tasks WHERE active = 1")
+        logger.info(f"Found {len(tasks)} active tasks")
+        if not tasks:
+            task_list = "No active tasks available at this time."
+        else:
+            task_list = "\n".join([f"ID: {task[0]} | {task[1]}{' (Mandatory)' if task[2] else ''}\nLink: {task[3]}" for task in tasks])
+            if context.platform == "discord" and len(task_list) > 1900:
+                task_list = task_list[:1900] + "\n... (Truncated, see full list on Telegram)"
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        try:
+            await context.send_message(chat_id, LANGUAGES[lang]["daily_tasks"].format(daily_tasks=task_list), reply_markup)
+            logger.info(f"Sent daily tasks to user {user_id}")
+        except Exception as e:
+            logger.error(f"Failed to send daily tasks to {user_id}: {str(e)}")
+            await context.send_message(chat_id, "Error retrieving tasks. Please try again later.", reply_markup)
+
+    @callbacks.route("refer")
+    async def on_refer(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        referral_code = generate_referral_code(user_id)
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, f"Your referral link: {referral_code}\nShare this with friends!", reply_markup)
+
+    @callbacks.route("claim_tokens")
+    async def on_claim_tokens(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        distribution = await db.fetchone("SELECT amount, vesting_end FROM distributions WHERE user_id = ? AND status = 'confirmed'", (user_id,))
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        if not distribution:
+            await context.send_message(chat_id, "No claimable Momo Coins found.", reply_markup)
+        else:
+            amount, vesting_end = distribution
+            if datetime.utcnow() < datetime.fromisoformat(vesting_end):
+                await context.send_message(chat_id, f"Momo Coins are locked until {vesting_end}.", reply_markup)
             else:
-                amount, vesting_end = distribution
-                if datetime.utcnow() < datetime.fromisoformat(vesting_end):
-                    await context.send_message(chat_id, f"Momo Coins are locked until {vesting_end}.", reply_markup)
-                else:
-                    cursor.execute("UPDATE distributions SET status = 'claimed' WHERE user_id = ?", (user_id,))
-                    update_user_balance(user_id, amount)
-                    conn.commit()
-                    await context.send_message(chat_id, f"Successfully claimed {amount} Momo Coins! Check balance.", reply_markup)
+                await db.execute_batch([
+                    ("UPDATE distributions SET status = 'claimed' WHERE user_id = ?", (user_id,)),
+                    ("UPDATE users SET momo_balance = momo_balance + ? WHERE user_id = ?", (amount, user_id))
+                ])
+                note_balance_change(user_id, amount)
+                await context.send_message(chat_id, f"Successfully claimed {amount} Momo Coins! Check balance.", reply_markup)
 
-        elif data == "leaderboard":
-            leaderboard_text = get_leaderboard(lang)
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, leaderboard_text, reply_markup)
+    @callbacks.route("leaderboard")
+    async def on_leaderboard(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        leaderboard_text = await get_leaderboard(lang, user_id)
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, leaderboard_text, reply_markup)
 
-        elif data == "start_distribution" and is_admin(user_id):
-            await calculate_airdrop(1)
-            cursor.execute("SELECT user_id, wallet, chain, amount FROM distributions WHERE status = 'pending'")
-            distributions = cursor.fetchall()
-            for dist_user_id, wallet, chain, amount in distributions:
-                try:
-                    if chain == "ETH":
-                        tx = token_contract_eth.functions.transfer(wallet, int(amount * 10**18)).build_transaction({
-                            "from": ETH_SENDER_ADDRESS, "nonce": web3_eth.eth.get_transaction_count(ETH_SENDER_ADDRESS),
-                            "gas": 100000, "gasPrice": web3_eth.eth.gas_price
-                        })
-                        signed_tx = web3_eth.eth.account.sign_transaction(tx, ETH_PRIVATE_KEY)
-                        tx_hash = web3_eth.eth.send_raw_transaction(signed_tx.rawTransaction).hex()
-                        cursor.execute("UPDATE distributions SET status = 'claimable', tx_hash = ? WHERE user_id = ?", (tx_hash, dist_user_id))
-                    elif chain == "XRP":
-                        sender_wallet = Wallet.from_seed(XRP_SENDER_SEED)
-                        payment = Payment(
-                            account=sender_wallet.classic_address,
-                            destination=wallet,
-                            amount=xrp_to_drops(amount)
-                        )
-                        response = await asyncio.get_event_loop().run_in_executor(None, lambda: xrp_client.submit_and_wait(payment, sender_wallet))
-                        tx_hash = response.result["tx_json"]["hash"]
-                        cursor.execute("UPDATE distributions SET status = 'claimable', tx_hash = ? WHERE user_id = ?", (tx_hash, dist_user_id))
-                    elif chain == "SOL":
-                        tx_hash = "placeholder_sol_tx_hash"  # Placeholder
-                        cursor.execute("UPDATE distributions SET status = 'claimable', tx_hash = ? WHERE user_id = ?", (tx_hash, dist_user_id))
-                    elif chain == "BSC":
-                        tx = token_contract_bsc.functions.transfer(wallet, int(amount * 10**18)).build_transaction({
-                            "from": ETH_SENDER_ADDRESS, "nonce": web3_bsc.eth.get_transaction_count(ETH_SENDER_ADDRESS),
-                            "gas": 100000, "gasPrice": web3_bsc.eth.gas_price
-                        })
-                        signed_tx = web3_bsc.eth.account.sign_transaction(tx, ETH_PRIVATE_KEY)
-                        tx_hash = web3_bsc.eth.send_raw_transaction(signed_tx.rawTransaction).hex()
-                        cursor.execute("UPDATE distributions SET status = 'claimable', tx_hash = ? WHERE user_id = ?", (tx_hash, dist_user_id))
-                    conn.commit()
-                    await context.send_message(dist_user_id, LANGUAGES[lang]["sent_tokens"].format(amount=amount, wallet=wallet, tx_hash=tx_hash))
-                except Exception as e:
-                    logger.error(f"Failed to send {amount} to {wallet} on {chain}: {e}")
-                    await context.send_message(dist_user_id, LANGUAGES[lang]["failed_tokens"].format(amount=amount, wallet=wallet, error=str(e)))
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+    @callbacks.route("start_distribution", admin=True)
+    async def on_start_distribution(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        if self.distribution_task and not self.distribution_task.done():
+            await context.send_message(chat_id, "An airdrop distribution is already running.", reply_markup)
+        else:
+            self.distribution_task = spawn(self.run_distribution(context), "distribution")
             await context.send_message(chat_id, "Airdrop distribution started!", reply_markup)
 
-        elif data == "export_data" and is_admin(user_id):
-            wb = Workbook()
-            ws = wb.active
-            ws.append(["User ID", "Wallet", "Chain", "Amount", "Status", "Tx Hash", "Vesting End"])
-            cursor.execute("SELECT user_id, wallet, chain, amount, status, tx_hash, vesting_end FROM distributions")
-            for row in cursor.fetchall():
-                ws.append(row)
-            wb.save("airdrop_log.xlsx")
-            await context.send_document(chat_id, open("airdrop_log.xlsx", "rb"))
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, "Data exported!", reply_markup)
+    @callbacks.route("take_snapshot", admin=True)
+    async def on_take_snapshot(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        if self.snapshot_task and not self.snapshot_task.done():
+            await context.send_message(chat_id, "A snapshot is already running.", reply_markup)
+        else:
+            context.user_data['awaiting_snapshot'] = True
+            await context.send_message(chat_id, "Enter campaign ID and heights (e.g., '1 ETH=19000000 BSC=36000000 XRP=85000000'). "
+                                                "Chains left out use their latest height; an unfinished snapshot is resumed:", reply_markup)
 
-        elif data == "blacklist" and is_admin(user_id):
-            context.user_data['awaiting_blacklist'] = True
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, "Enter wallet to blacklist:", reply_markup)
+    @callbacks.route("broadcast", admin=True)
+    async def on_broadcast(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        context.user_data['awaiting_broadcast'] = True
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, "Enter audience (all, verified or eligible) and message, e.g. 'verified Hi {username}, "
+                                            "the new campaign starts Monday!':", reply_markup)
 
-        elif data == "whitelist" and is_admin(user_id):
-            context.user_data['awaiting_whitelist'] = True
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, "Enter wallet to whitelist:", reply_markup)
+    @callbacks.route("export_data", admin=True)
+    async def on_export_data(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        context.user_data['awaiting_export'] = True
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, f"Enter table, format and filters, e.g. 'distributions xlsx status=confirmed chain=ETH' "
+                                            f"or 'referrals csv since=2024-06-01'. Tables: {', '.join(Export.TABLES)}; "
+                                            f"formats: {', '.join(Export.FORMATS)} (csv is gzipped):", reply_markup)
 
-        elif data == "set_config" and is_admin(user_id):
-            context.user_data['awaiting_config'] = True
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, "Enter config key and value (e.g., total_supply 2000000):", reply_markup)
-
-        elif data == "approve_tasks" and is_admin(user_id):
-            page = context.user_data.get('approve_tasks_page', 1)
-            items_per_page = 10
-            offset = (page - 1) * items_per_page
-            cursor.execute("SELECT COUNT(*) FROM task_completions WHERE status = 'pending'")
-            total_tasks = cursor.fetchone()[0]
-            total_pages = (total_tasks + items_per_page - 1) // items_per_page
-            cursor.execute("SELECT user_id, task_id, username, completion_date FROM task_completions WHERE status = 'pending' LIMIT ? OFFSET ?", (items_per_page, offset))
-            pending = cursor.fetchall()
-            if not pending:
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "No pending task submissions.", reply_markup)
-            else:
-                keyboard = []
-                for task in pending:
-                    user_id, task_id, username, date = task
-                    keyboard.append([InlineKeyboardButton(f"Approve {user_id} - Task {task_id} ({username})",
-                                                          callback_data=f"approve_task_{user_id}_{task_id}_{date}"),
-                                     InlineKeyboardButton(f"Reject {user_id} - Task {task_id}",
-                                                          callback_data=f"reject_task_{user_id}_{task_id}_{date}")])
-                nav_buttons = []
-                if page > 1:
-                    nav_buttons.append(InlineKeyboardButton("Previous", callback_data=f"approve_tasks_page_{page-1}"))
-                if page < total_pages:
-                    nav_buttons.append(InlineKeyboardButton("Next", callback_data=f"approve_tasks_page_{page+1}"))
-                if nav_buttons:
-                    keyboard.append(nav_buttons)
-                keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, f"Pending task submissions (Page {page}/{total_pages}, {total_tasks} total):", reply_markup)
-
-        elif data.startswith("approve_tasks_page_") and is_admin(user_id):
-            page = int(data.split("_")[3])
-            context.user_data['approve_tasks_page'] = page
-            await self.button_handler(update, context)
-
-        elif data.startswith("approve_task_") and is_admin(user_id):
-            task_user_id, task_id, completion_date = data.split("_")[2:]
-            cursor.execute("UPDATE task_completions SET status = 'approved' WHERE user_id = ? AND task_id = ? AND completion_date = ?",
-                           (task_user_id, task_id, completion_date))
-            update_user_balance(task_user_id, 10)
-            conn.commit()
-            cursor.execute("SELECT description FROM daily_tasks WHERE id = ?", (task_id,))
-            task_description = cursor.fetchone()[0]
-            await context.send_message(task_user_id, LANGUAGES[lang]["task_approved"].format(task_description=task_description))
+    @callbacks.route("blacklist", admin=True)
+    async def on_blacklist(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        context.user_data['awaiting_blacklist'] = True
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, "Enter wallet to blacklist:", reply_markup)
+
+    @callbacks.route("whitelist", admin=True)
+    async def on_whitelist(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        context.user_data['awaiting_whitelist'] = True
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, "Enter wallet to whitelist:", reply_markup)
+
+    @callbacks.route("set_config", admin=True)
+    async def on_set_config(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        context.user_data['awaiting_config'] = True
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, "Enter config key and value (e.g., total_supply 2000000):", reply_markup)
+
+    @callbacks.route("approve_tasks", admin=True)
+    async def on_approve_tasks(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        direction, cursor = (args[0], args[1:]) if args else ("first", None)
+        pending, has_previous, has_next = await ReviewQueue.page("tasks", direction, cursor)
+        if not pending:
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, f"Task {task_id} for user {task_user_id} approved!", reply_markup)
-
-        elif data.startswith("reject_task_") and is_admin(user_id):
-            task_user_id, task_id, completion_date = data.split("_")[2:]
-            cursor.execute("UPDATE task_completions SET status = 'rejected' WHERE user_id = ? AND task_id = ? AND completion_date = ?",
-                           (task_user_id, task_id, completion_date))
-            conn.commit()
-            cursor.execute("SELECT description FROM daily_tasks WHERE id = ?", (task_id,))
-            task_description = cursor.fetchone()[0]
-            await context.send_message(task_user_id, LANGUAGES[lang]["task_rejected"].format(task_description=task_description))
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+            await context.send_message(chat_id, "No pending task submissions.", reply_markup)
+        else:
+            keyboard = []
+            for task in pending:
+                user_id, task_id, username, date = task
+                keyboard.append([InlineKeyboardButton(f"Approve {user_id} - Task {task_id} ({username})",
+                                                      callback_data=f"approve_task_{user_id}_{task_id}_{date}"),
+                                 InlineKeyboardButton(f"Reject {user_id} - Task {task_id}",
+                                                      callback_data=f"reject_task_{user_id}_{task_id}_{date}")])
+            context.user_data['moderation_tasks'] = [[user_id, task_id, date] for user_id, task_id, _, date in pending]
+            keyboard.append([InlineKeyboardButton("Approve Page", callback_data="bulk_page_approve_tasks"),
+                             InlineKeyboardButton("Reject Page", callback_data="bulk_page_reject_tasks")])
+            for task_id in sorted({task[1] for task in pending}):
+                keyboard.append([InlineKeyboardButton(f"Approve All Pending for Task {task_id}", callback_data=f"bulk_task_{task_id}")])
+            keyboard.extend(ReviewQueue.navigation("tasks", "approve_tasks", pending, has_previous, has_next))
+            keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, f"Task {task_id} for user {task_user_id} rejected!", reply_markup)
+            await context.send_message(chat_id, f"Pending task submissions ({await ReviewQueue.count('tasks')} total):", reply_markup)
 
-        elif data == "approve_kyc" and is_admin(user_id):
-            cursor.execute("SELECT user_id, kyc_telegram_link, kyc_x_link, kyc_wallet, kyc_chain, kyc_submission_time FROM users WHERE kyc_status = 'submitted' LIMIT 10")
-            pending = cursor.fetchall()
-            if not pending:
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "No pending KYC submissions.", reply_markup)
-            else:
-                keyboard = []
-                for kyc in pending:
-                    user_id, telegram, x_link, wallet, chain, time = kyc
-                    keyboard.append([InlineKeyboardButton(f"Approve {user_id} (TG: {telegram})",
-                                                          callback_data=f"approve_kyc_{user_id}"),
-                                     InlineKeyboardButton(f"Reject {user_id}",
-                                                          callback_data=f"reject_kyc_{user_id}")])
-                keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "Pending KYC submissions:", reply_markup)
+    @callbacks.prefix("approve_tasks_next_", admin=True)
+    async def on_approve_tasks_next(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        await self.on_approve_tasks(context, user_id, lang, chat_id, ["next", *args])
 
-        elif data.startswith("approve_kyc_") and is_admin(user_id):
-            kyc_user_id = data.split("_")[2]
-            cursor.execute("UPDATE users SET kyc_status = 'verified' WHERE user_id = ?", (kyc_user_id,))
-            conn.commit()
-            await context.send_message(kyc_user_id, LANGUAGES[lang]["kyc_approved"])
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, f"KYC for user {kyc_user_id} approved!", reply_markup)
+    @callbacks.prefix("approve_tasks_prev_", admin=True)
+    async def on_approve_tasks_prev(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        await self.on_approve_tasks(context, user_id, lang, chat_id, ["prev", *args])
 
-        elif data.startswith("reject_kyc_") and is_admin(user_id):
-            kyc_user_id = data.split("_")[2]
-            cursor.execute("UPDATE users SET kyc_status = 'rejected' WHERE user_id = ?", (kyc_user_id,))
-            conn.commit()
-            await context.send_message(kyc_user_id, LANGUAGES[lang]["kyc_rejected"])
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, f"KYC for user {kyc_user_id} rejected!", reply_markup)
+    @callbacks.prefix("approve_task_", admin=True)
+    async def on_approve_task(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        task_user_id, task_id, completion_date = args
+        moderation = Moderation("tasks", keys=[[task_user_id, int(task_id), completion_date]])
+        await self.decide_item(context, chat_id, moderation, "approve", f"Task {task_id} for user {task_user_id}")
 
-        elif data == "approve_referrals" and is_admin(user_id):
-            cursor.execute("SELECT referrer_id, referee_id, timestamp FROM referrals WHERE status = 'pending' LIMIT 10")
-            pending = cursor.fetchall()
-            if not pending:
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "No pending referral submissions.", reply_markup)
-            else:
-                keyboard = []
-                for ref in pending:
-                    referrer_id, referee_id, timestamp = ref
-                    cursor.execute("SELECT username FROM users WHERE user_id = ?", (referee_id,))
-                    referee_name = cursor.fetchone()[0] if cursor.fetchone() else "Unknown"
-                    keyboard.append([InlineKeyboardButton(f"Approve {referrer_id} -> {referee_id} ({referee_name})",
-                                                          callback_data=f"approve_ref_{referrer_id}_{referee_id}"),
-                                     InlineKeyboardButton(f"Reject {referrer_id} -> {referee_id}",
-                                                          callback_data=f"reject_ref_{referrer_id}_{referee_id}")])
-                keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "Pending referral submissions:", reply_markup)
-
-        elif data.startswith("approve_ref_") and is_admin(user_id):
-            referrer_id, referee_id = data.split("_")[2], data.split("_")[3]
-            cursor.execute("UPDATE referrals SET status = 'approved' WHERE referrer_id = ? AND referee_id = ?", (referrer_id, referee_id))
-            update_user_balance(referrer_id, 15)
-            conn.commit()
-            cursor.execute("SELECT username FROM users WHERE user_id = ?", (referee_id,))
-            referee_name = cursor.fetchone()[0] if cursor.fetchone() else "Unknown"
+    @callbacks.prefix("reject_task_", admin=True)
+    async def on_reject_task(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        task_user_id, task_id, completion_date = args
+        moderation = Moderation("tasks", keys=[[task_user_id, int(task_id), completion_date]])
+        await self.decide_item(context, chat_id, moderation, "reject", f"Task {task_id} for user {task_user_id}")
+
+    @callbacks.route("approve_kyc", admin=True)
+    async def on_approve_kyc(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        direction, cursor = (args[0], args[1:]) if args else ("first", None)
+        pending, has_previous, has_next = await ReviewQueue.page("kyc", direction, cursor)
+        if not pending:
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(referrer_id, LANGUAGES[lang]["referral_bonus"].format(bonus=15, referee=referee_name), reply_markup)
-            await context.send_message(referee_id, LANGUAGES[lang]["referral_approved"].format(referee=referee_name))
-            await context.send_message(chat_id, f"Referral from {referrer_id} to {referee_id} approved!", reply_markup)
-
-        elif data.startswith("reject_ref_") and is_admin(user_id):
-            referrer_id, referee_id = data.split("_")[2], data.split("_")[3]
-            cursor.execute("UPDATE referrals SET status = 'rejected' WHERE referrer_id = ? AND referee_id = ?", (referrer_id, referee_id))
-            conn.commit()
-            cursor.execute("SELECT username FROM users WHERE user_id = ?", (referee_id,))
-            referee_name = cursor.fetchone()[0] if cursor.fetchone() else "Unknown"
-            await context.send_message(referee_id, LANGUAGES[lang]["referral_rejected"].format(referee=referee_name))
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+            await context.send_message(chat_id, "No pending KYC submissions.", reply_markup)
+        else:
+            keyboard = []
+            for kyc in pending:
+                user_id, telegram, x_link, wallet, chain, time = kyc
+                keyboard.append([InlineKeyboardButton(f"Approve {user_id} (TG: {telegram})",
+                                                      callback_data=f"approve_kyc_{user_id}"),
+                                 InlineKeyboardButton(f"Reject {user_id}",
+                                                      callback_data=f"reject_kyc_{user_id}")])
+            context.user_data['moderation_kyc'] = [kyc[0] for kyc in pending]
+            keyboard.append([InlineKeyboardButton("Approve Page", callback_data="bulk_page_approve_kyc"),
+                             InlineKeyboardButton("Reject Page", callback_data="bulk_page_reject_kyc")])
+            keyboard.extend(ReviewQueue.navigation("kyc", "approve_kyc", pending, has_previous, has_next))
+            keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, f"Referral from {referrer_id} to {referee_id} rejected!", reply_markup)
+            await context.send_message(chat_id, f"Pending KYC submissions ({await ReviewQueue.count('kyc')} total):", reply_markup)
 
-        elif data == "set_campaign" and is_admin(user_id):
-            context.user_data['awaiting_campaign'] = True
-            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, "Enter campaign details (name start_date end_date total_tokens, e.g., 'Summer 2025-03-01 2025-03-15 500000'):", reply_markup)
+    @callbacks.prefix("approve_kyc_next_", admin=True)
+    async def on_approve_kyc_next(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        await self.on_approve_kyc(context, user_id, lang, chat_id, ["next", *args])
 
-        elif data == "edit_campaign" and is_admin(user_id):
-            cursor.execute("SELECT id, name FROM campaigns WHERE active = 1")
-            campaigns = cursor.fetchall()
-            if not campaigns:
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "No active campaigns.", reply_markup)
-            else:
-                keyboard = [[InlineKeyboardButton(f"Edit {camp[1]} (ID: {camp[0]})", callback_data=f"edit_campaign_{camp[0]}")] for camp in campaigns]
-                keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "Select campaign to edit:", reply_markup)
+    @callbacks.prefix("approve_kyc_prev_", admin=True)
+    async def on_approve_kyc_prev(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        await self.on_approve_kyc(context, user_id, lang, chat_id, ["prev", *args])
+
+    @callbacks.prefix("approve_kyc_", admin=True)
+    async def on_approve_kyc_item(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        kyc_user_id = args[0]
+        await self.decide_item(context, chat_id, Moderation("kyc", keys=[kyc_user_id]), "approve", f"KYC for user {kyc_user_id}")
 
-        elif data.startswith("edit_campaign_") and is_admin(user_id):
-            campaign_id = data.split("_")[2]
-            context.user_data['awaiting_campaign_edit'] = campaign_id
+    @callbacks.prefix("reject_kyc_", admin=True)
+    async def on_reject_kyc(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        kyc_user_id = args[0]
+        await self.decide_item(context, chat_id, Moderation("kyc", keys=[kyc_user_id]), "reject", f"KYC for user {kyc_user_id}")
+
+    @callbacks.route("approve_referrals", admin=True)
+    async def on_approve_referrals(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        direction, cursor = (args[0], args[1:]) if args else ("first", None)
+        pending, has_previous, has_next = await ReviewQueue.page("referrals", direction, cursor)
+        if not pending:
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, "Enter new campaign details (name start_date end_date total_tokens, e.g., 'Summer 2025-03-01 2025-03-15 500000'):", reply_markup)
+            await context.send_message(chat_id, "No pending referral submissions.", reply_markup)
+        else:
+            keyboard = []
+            for ref in pending:
+                referrer_id, referee_id, timestamp, referrer_name, referee_name = ref
+                keyboard.append([InlineKeyboardButton(f"Approve {referrer_id} ({referrer_name or 'Unknown'}) -> {referee_id} ({referee_name or 'Unknown'})",
+                                                      callback_data=f"approve_ref_{referrer_id}_{referee_id}"),
+                                 InlineKeyboardButton(f"Reject {referrer_id} -> {referee_id}",
+                                                      callback_data=f"reject_ref_{referrer_id}_{referee_id}")])
+            context.user_data['moderation_referrals'] = [ref[1] for ref in pending]
+            keyboard.append([InlineKeyboardButton("Approve Page", callback_data="bulk_page_approve_referrals"),
+                             InlineKeyboardButton("Reject Page", callback_data="bulk_page_reject_referrals")])
+            keyboard.extend(ReviewQueue.navigation("referrals", "approve_referrals", pending, has_previous, has_next))
+            keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await context.send_message(chat_id, f"Pending referral submissions ({await ReviewQueue.count('referrals')} total):", reply_markup)
 
-        elif data == "add_daily_task" and is_admin(user_id):
-            cursor.execute("SELECT COUNT(*) FROM daily_tasks WHERE active = 1")
-            active_task_count = cursor.fetchone()[0]
-            if active_task_count >= 10:
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "Task limit reached (10 active tasks). Delete or edit an existing task first.", reply_markup)
-            else:
-                context.user_data['awaiting_task_add'] = True
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "Enter task details (description link mandatory, e.g., 'Watch Video https://youtube.com/example 0'):", reply_markup)
-
-        elif data == "edit_daily_task" and is_admin(user_id):
-            logger.info(f"Edit daily task triggered by admin {user_id}, Chat ID: {chat_id}, Platform: {context.platform}")
-            cursor.execute("SELECT id, description FROM daily_tasks WHERE active = 1")
-            tasks = cursor.fetchall()
-            logger.info(f"Tasks available for edit: {tasks}")
-            if not tasks:
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "No active tasks to edit.", reply_markup)
-            else:
-                keyboard = [[InlineKeyboardButton(f"Edit {task[1]} (ID: {task[0]})", callback_data=f"edit_task_{task[0]}")] for task in tasks]
-                keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
+    @callbacks.prefix("approve_referrals_next_", admin=True)
+    async def on_approve_referrals_next(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        await self.on_approve_referrals(context, user_id, lang, chat_id, ["next", *args])
+
+    @callbacks.prefix("approve_referrals_prev_", admin=True)
+    async def on_approve_referrals_prev(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        await self.on_approve_referrals(context, user_id, lang, chat_id, ["prev", *args])
+
+    @callbacks.prefix("approve_ref_", admin=True)
+    async def on_approve_ref(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        referrer_id, referee_id = args
+        moderation = Moderation("referrals", {"referrer": referrer_id}, keys=[referee_id])
+        await self.decide_item(context, chat_id, moderation, "approve", f"Referral from {referrer_id} to {referee_id}")
+
+    @callbacks.prefix("reject_ref_", admin=True)
+    async def on_reject_ref(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        referrer_id, referee_id = args
+        moderation = Moderation("referrals", {"referrer": referrer_id}, keys=[referee_id])
+        await self.decide_item(context, chat_id, moderation, "reject", f"Referral from {referrer_id} to {referee_id}")
+
+    async def decide_item(self, context: BotContext, chat_id: str, moderation: "Moderation", decision: str, subject: str):
+        # One review item through the set-based path: only a row that is still pending is
+        # decided and credited, so a double-tapped or stale button cannot pay twice, and the
+        # user's name and language come out of the same write transaction.
+        rows = await moderation.apply(decision)
+        for recipient, text in moderation.notifications(decision, rows):
+            await context.send_message(recipient, text)
+        keyboard = [[InlineKeyboardButton("Back to List", callback_data=Moderation.QUEUES[moderation.queue][0])],
+                    [InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        if rows:
+            await context.send_message(chat_id, f"{subject} {Moderation.DECISIONS[decision]}!", reply_markup)
+        else:
+            await context.send_message(chat_id, f"{subject} is no longer pending.", reply_markup)
+
+    @callbacks.route("referral_graph", admin=True)
+    async def on_referral_graph(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        top = await db.fetchall(
+            "SELECT g.referrer_id, u.username, g.total, g.pending, g.approved, g.rejected, g.first_at, g.last_at, "
+            "(SELECT COUNT(*) FROM referrals r JOIN users v ON v.user_id = r.referee_id WHERE r.referrer_id = g.referrer_id AND v.kyc_status = 'verified') "
+            "FROM referral_graph g LEFT JOIN users u ON u.user_id = g.referrer_id WHERE g.total > 0 ORDER BY g.total DESC LIMIT ?",
+            (REFERRAL_GRAPH_SIZE,))
+        keyboard = []
+        lines = []
+        for referrer_id, username, total, pending, approved, rejected, first_at, last_at, verified in top:
+            # Wide fan-out where most referees never passed KYC is the usual farmed-account pattern.
+            flag = "⚠️ " if total >= REFERRAL_FANOUT_ALERT and verified * 2 < total else ""
+            lines.append(f"{flag}{referrer_id} ({username or 'Unknown'}): {total} referees, {pending} pending, {approved} approved, "
+                         f"{rejected} rejected, {verified} KYC-verified ({(first_at or '')[:10]} to {(last_at or '')[:10]})")
+            keyboard.append([InlineKeyboardButton(f"Referees of {referrer_id}", callback_data=f"referral_graph_{referrer_id}")])
+        keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, "Top referrers:\n" + "\n".join(lines) if lines else "No referrals yet.", reply_markup)
+
+    @callbacks.prefix("referral_graph_", admin=True)
+    async def on_referral_graph_item(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        referrer_id = args[0]
+        referees = await db.fetchall(
+            "SELECT r.referee_id, u.username, u.kyc_status, r.status, r.timestamp FROM referrals r "
+            "LEFT JOIN users u ON u.user_id = r.referee_id WHERE r.referrer_id = ? ORDER BY r.timestamp DESC LIMIT ?",
+            (referrer_id, REFERRAL_GRAPH_SIZE * 3))
+        lines = [f"{referee_id} ({username or 'Unknown'}): referral {status}, KYC {kyc_status or 'none'}, {(timestamp or '')[:16]}"
+                 for referee_id, username, kyc_status, status, timestamp in referees]
+        keyboard = [[InlineKeyboardButton("Back to Graph", callback_data="referral_graph")],
+                    [InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, f"Latest referees of {referrer_id}:\n" + "\n".join(lines) if lines else f"{referrer_id} has no referrals.", reply_markup)
+
+    @callbacks.prefix("bulk_page_", admin=True)
+    async def on_bulk_page(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        decision, queue = args
+        moderation = Moderation(queue, keys=context.user_data.get(f'moderation_{queue}') or [])
+        await self.run_moderation(context, chat_id, moderation, decision, "on the page")
+
+    @callbacks.prefix("bulk_task_", admin=True)
+    async def on_bulk_task(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        await self.run_moderation(context, chat_id, Moderation("tasks", {"task": args[0]}), "approve", f"for task {args[0]}")
+
+    @callbacks.route("auto_approve", admin=True)
+    async def on_auto_approve(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        context.user_data['awaiting_auto_approve'] = True
+        rules = await Moderation.rules()
+        current = "\n".join(f"{queue} {rule}".rstrip() for queue, rule in rules.items()) or "none"
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, f"Current auto-approve rules:\n{current}\n\nEnter a rule as 'queue [filter=value ...]', "
+                                            f"e.g. 'tasks task=3' or 'referrals verified=1', or 'off queue' to remove one. "
+                                            f"Matching submissions are approved every {AUTO_APPROVE_INTERVAL:g}s.", reply_markup)
+
+    async def run_moderation(self, context: BotContext, chat_id: str, moderation: Moderation, decision: str, scope: str):
+        list_route, label = Moderation.QUEUES[moderation.queue]
+        keyboard = [[InlineKeyboardButton("Back to List", callback_data=list_route)],
+                    [InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        rows = await moderation.apply(decision)
+        spawn(Moderation.notify(context, moderation.notifications(decision, rows)), f"moderation notifications: {decision} {moderation.queue}")
+        await context.send_message(chat_id, f"{Moderation.DECISIONS[decision].capitalize()} {len(rows)} pending {label} {scope}.", reply_markup)
+
+    async def run_auto_approve(self, context: BotContext, interval: float = AUTO_APPROVE_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                rules = await Moderation.rules()
+            except Exception as e:
+                logger.error(f"Auto-approve sweep failed: {e}")
+                continue
+            # Each queue is swept on its own, so one bad rule or locked write does not starve the others.
+            for name, rule in rules.items():
                 try:
-                    await context.send_message(chat_id, "Select task to edit:", reply_markup)
-                    logger.info(f"Task list sent to admin {user_id}")
+                    moderation = Moderation.parse(f"{name} {rule}")
+                    rows = await moderation.apply("approve")
+                    if rows:
+                        logger.info(f"Auto-approve rule '{name} {rule}' approved {len(rows)} {Moderation.QUEUES[name][1]}")
+                        await Moderation.notify(context, moderation.notifications("approve", rows))
                 except Exception as e:
-                    logger.error(f"Failed to send task list to {user_id}: {str(e)}")
-                    await context.send_message(chat_id, "Error displaying tasks.", reply_markup)
-
-        elif data.startswith("edit_task_") and is_admin(user_id):
-            task_id = data.split("_")[2]
-            logger.info(f"Admin {user_id} selected task {task_id} to edit")
-            # Store state in database
-            cursor.execute("REPLACE INTO admin_states (user_id, state, task_id, timestamp) VALUES (?, ?, ?, ?)",
-                           (user_id, "awaiting_task_edit", task_id, datetime.utcnow().isoformat()))
-            conn.commit()
+                    logger.error(f"Auto-approve sweep of the {name} queue ('{rule}') failed: {e}")
+
+    @callbacks.route("set_campaign", admin=True)
+    async def on_set_campaign(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        context.user_data['awaiting_campaign'] = True
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, "Enter campaign details (name start_date end_date total_tokens, e.g., 'Summer 2025-03-01 2025-03-15 500000'):", reply_markup)
+
+    @callbacks.route("edit_campaign", admin=True)
+    async def on_edit_campaign(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        campaigns = await db.fetchall("SELECT id, name FROM campaigns WHERE active = 1")
+        if not campaigns:
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            try:
-                # Log chat_id and platform for debugging
-                logger.info(f"Sending edit prompt to chat_id: {chat_id}, Platform: {context.platform}")
-                # Test with a simple message first
-                await context.send_message(chat_id, "Test prompt", reply_markup)
-                # If the test succeeds, send the actual prompt
-                await context.send_message(chat_id, LANGUAGES[lang]["edit_task_prompt"], reply_markup)
-                logger.info(f"Edit prompt sent for task {task_id} to {user_id}")
-            except Exception as e:
-                logger.error(f"Failed to send edit prompt to {user_id} (chat_id: {chat_id}, platform: {context.platform}): {str(e)}")
-                # Attempt to send the error message to the same chat_id
-                try:
-                    await context.send_message(chat_id, "Error prompting for edit. Please try again or check bot permissions.", reply_markup)
-                except Exception as e2:
-                    logger.error(f"Failed to send error message to {user_id} (chat_id: {chat_id}, platform: {context.platform}): {str(e2)}")
-
-        elif data == "delete_daily_task" and is_admin(user_id):
-            cursor.execute("SELECT id, description FROM daily_tasks WHERE active = 1")
-            tasks = cursor.fetchall()
-            if not tasks:
-                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "No active tasks.", reply_markup)
-            else:
-                keyboard = [[InlineKeyboardButton(f"Delete {task[1]} (ID: {task[0]})", callback_data=f"delete_task_{task[0]}")] for task in tasks]
-                keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await context.send_message(chat_id, "Select task to delete:", reply_markup)
+            await context.send_message(chat_id, "No active campaigns.", reply_markup)
+        else:
+            keyboard = [[InlineKeyboardButton(f"Edit {camp[1]} (ID: {camp[0]})", callback_data=f"edit_campaign_{camp[0]}")] for camp in campaigns]
+            keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await context.send_message(chat_id, "Select campaign to edit:", reply_markup)
 
-        elif data.startswith("delete_task_") and is_admin(user_id):
-            task_id = data.split("_")[2]
-            cursor.execute("UPDATE daily_tasks SET active = 0 WHERE id = ?", (task_id,))
-            conn.commit()
+    @callbacks.prefix("edit_campaign_", admin=True)
+    async def on_edit_campaign_item(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        campaign_id = args[0]
+        context.user_data['awaiting_campaign_edit'] = campaign_id
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, "Enter new campaign details (name start_date end_date total_tokens, e.g., 'Summer 2025-03-01 2025-03-15 500000'):", reply_markup)
+
+    @callbacks.route("add_daily_task", admin=True)
+    async def on_add_daily_task(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        active_task_count = await db.fetchval("SELECT COUNT(*) FROM daily_tasks WHERE active = 1")
+        if active_task_count >= 10:
+            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await context.send_message(chat_id, "Task limit reached (10 active tasks). Delete or edit an existing task first.", reply_markup)
+        else:
+            context.user_data['awaiting_task_add'] = True
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await context.send_message(chat_id, f"Task {task_id} deleted!", reply_markup)
+            await context.send_message(chat_id, "Enter task details (description link mandatory, e.g., 'Watch Video https://youtube.com/example 0'):", reply_markup)
 
-        elif data == "test_message" and is_admin(user_id):
-            logger.info(f"Testing message to chat_id: {chat_id}, Platform: {context.platform}")
+    @callbacks.route("edit_daily_task", admin=True)
+    async def on_edit_daily_task(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        logger.info(f"Edit daily task triggered by admin {user_id}, Chat ID: {chat_id}, Platform: {context.platform}")
+        tasks = await db.fetchall("SELECT id, description FROM daily_tasks WHERE active = 1")
+        logger.info(f"Tasks available for edit: {tasks}")
+        if not tasks:
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
+            await context.send_message(chat_id, "No active tasks to edit.", reply_markup)
+        else:
+            keyboard = [[InlineKeyboardButton(f"Edit {task[1]} (ID: {task[0]})", callback_data=f"edit_task_{task[0]}")] for task in tasks]
+            keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
+            reply_markup = InlineKeyboardMarkup(keyboard)
             try:
-                await context.send_message(chat_id, "This is a test message.", reply_markup)
-                logger.info(f"Test message sent to {user_id}")
+                await context.send_message(chat_id, "Select task to edit:", reply_markup)
+                logger.info(f"Task list sent to admin {user_id}")
             except Exception as e:
-                logger.error(f"Failed to send test message to {user_id}: {str(e)}")
-                await context.send_message(chat_id, "Error sending test message.", reply_markup)
+                logger.error(f"Failed to send task list to {user_id}: {str(e)}")
+                await context.send_message(chat_id, "Error displaying tasks.", reply_markup)
 
-        if context.platform == "telegram":
-            await update.callback_query.answer()
+    @callbacks.prefix("edit_task_", admin=True)
+    async def on_edit_task(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        task_id = args[0]
+        logger.info(f"Admin {user_id} selected task {task_id} to edit")
+        # Store state in database
+        await db.execute("REPLACE INTO admin_states (user_id, state, task_id, timestamp) VALUES (?, ?, ?, ?)",
+                         (user_id, "awaiting_task_edit", task_id, datetime.utcnow().isoformat()))
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        try:
+            # Log chat_id and platform for debugging
+            logger.info(f"Sending edit prompt to chat_id: {chat_id}, Platform: {context.platform}")
+            # Test with a simple message first
+            await context.send_message(chat_id, "Test prompt", reply_markup)
+            # If the test succeeds, send the actual prompt
+            await context.send_message(chat_id, LANGUAGES[lang]["edit_task_prompt"], reply_markup)
+            logger.info(f"Edit prompt sent for task {task_id} to {user_id}")
+        except Exception as e:
+            logger.error(f"Failed to send edit prompt to {user_id} (chat_id: {chat_id}, platform: {context.platform}): {str(e)}")
+            # Attempt to send the error message to the same chat_id
+            try:
+                await context.send_message(chat_id, "Error prompting for edit. Please try again or check bot permissions.", reply_markup)
+            except Exception as e2:
+                logger.error(f"Failed to send error message to {user_id} (chat_id: {chat_id}, platform: {context.platform}): {str(e2)}")
+
+    @callbacks.route("delete_daily_task", admin=True)
+    async def on_delete_daily_task(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        tasks = await db.fetchall("SELECT id, description FROM daily_tasks WHERE active = 1")
+        if not tasks:
+            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await context.send_message(chat_id, "No active tasks.", reply_markup)
+        else:
+            keyboard = [[InlineKeyboardButton(f"Delete {task[1]} (ID: {task[0]})", callback_data=f"delete_task_{task[0]}")] for task in tasks]
+            keyboard.append([InlineKeyboardButton("Back to Menu", callback_data="start")])
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await context.send_message(chat_id, "Select task to delete:", reply_markup)
+
+    @callbacks.prefix("delete_task_", admin=True)
+    async def on_delete_task(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        task_id = args[0]
+        await db.execute("UPDATE daily_tasks SET active = 0 WHERE id = ?", (task_id,))
+        invalidate_mandatory_tasks()
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await context.send_message(chat_id, f"Task {task_id} deleted!", reply_markup)
+
+    @callbacks.route("test_message", admin=True)
+    async def on_test_message(self, context: BotContext, user_id: str, lang: str, chat_id: str, args: list):
+        logger.info(f"Testing message to chat_id: {chat_id}, Platform: {context.platform}")
+        keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        try:
+            await context.send_message(chat_id, "This is a test message.", reply_markup)
+            logger.info(f"Test message sent to {user_id}")
+        except Exception as e:
+            logger.error(f"Failed to send test message to {user_id}: {str(e)}")
+            await context.send_message(chat_id, "Error sending test message.", reply_markup)
 
+    @instrumented("message", "text")
     async def handle_message(self, update: Union[Update, discord.Message], context: BotContext):
         user_id = str(update.message.from_user.id if context.platform == "telegram" else update.author.id)
-        lang = get_user_language(user_id)
+        context = await context.for_user(user_id)
+        lang = await get_user_language(user_id)
         chat_id = str(update.message.chat_id if context.platform == "telegram" else update.channel.id)
         text = update.message.text.strip() if context.platform == "telegram" else update.content.strip()
 
@@ -998,11 +4155,13 @@ class AirdropBot:
                 context.user_data['kyc_wallet'] = wallet
                 context.user_data['kyc_chain'] = chain
                 submission_time = datetime.utcnow().isoformat()
-                cursor.execute("UPDATE users SET kyc_telegram_link = ?, kyc_x_link = ?, kyc_wallet = ?, kyc_chain = ?, kyc_status = 'submitted', kyc_submission_time = ? WHERE user_id = ?",
-                               (context.user_data['kyc_telegram_link'], context.user_data['kyc_x_link'], wallet, chain, submission_time, user_id))
-                cursor.execute("INSERT OR IGNORE INTO submissions (user_id, wallet, chain, timestamp) VALUES (?, ?, ?, ?)",
-                               (user_id, wallet, chain, submission_time))
-                conn.commit()
+                await db.execute_batch([
+                    ("UPDATE users SET kyc_telegram_link = ?, kyc_x_link = ?, kyc_wallet = ?, kyc_chain = ?, kyc_status = 'submitted', kyc_submission_time = ? WHERE user_id = ?",
+                     (context.user_data['kyc_telegram_link'], context.user_data['kyc_x_link'], wallet, chain, submission_time, user_id)),
+                    ("INSERT OR IGNORE INTO submissions (user_id, wallet, chain, timestamp) VALUES (?, ?, ?, ?)",
+                     (user_id, wallet, chain, submission_time))
+                ])
+                profile_cache.update(user_id, kyc_status="submitted")
                 if ADMIN_ID:
                     await context.send_message(ADMIN_ID, LANGUAGES[lang]["kyc_notification"].format(
                         user_id=user_id, telegram=context.user_data['kyc_telegram_link'], x_link=context.user_data['kyc_x_link'], wallet=wallet, chain=chain, time=submission_time))
@@ -1026,26 +4185,25 @@ class AirdropBot:
                 await context.send_message(chat_id, LANGUAGES[lang]["invalid_address"].format(chain=chain), reply_markup)
                 context.user_data['awaiting_wallet'] = False
                 return
-            cursor.execute("SELECT wallet FROM blacklist WHERE wallet = ?", (wallet,))
-            if cursor.fetchone():
+            if await db.fetchone("SELECT wallet FROM blacklist WHERE wallet = ?", (wallet,)):
                 keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 await context.send_message(chat_id, LANGUAGES[lang]["blacklisted"], reply_markup)
                 context.user_data['awaiting_wallet'] = False
                 return
-            cursor.execute("SELECT wallet FROM submissions WHERE user_id = ?", (user_id,))
-            if cursor.fetchone():
+            if await db.fetchone("SELECT wallet FROM submissions WHERE user_id = ?", (user_id,)):
                 keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 await context.send_message(chat_id, LANGUAGES[lang]["already_submitted"], reply_markup)
                 context.user_data['awaiting_wallet'] = False
                 return
             captcha = random.randint(1, 10)
-            cursor.execute("REPLACE INTO captchas (user_id, captcha, timestamp) VALUES (?, ?, ?)",
-                           (user_id, captcha, datetime.utcnow().isoformat()))
-            cursor.execute("REPLACE INTO submissions (user_id, wallet, chain, timestamp) VALUES (?, ?, ?, ?)",
-                           (user_id, wallet, chain, datetime.utcnow().isoformat()))
-            conn.commit()
+            await db.execute_batch([
+                ("REPLACE INTO captchas (user_id, captcha, timestamp) VALUES (?, ?, ?)",
+                 (user_id, captcha, datetime.utcnow().isoformat())),
+                ("REPLACE INTO submissions (user_id, wallet, chain, timestamp) VALUES (?, ?, ?, ?)",
+                 (user_id, wallet, chain, datetime.utcnow().isoformat()))
+            ])
             context.user_data['awaiting_wallet'] = False
             context.user_data['awaiting_captcha'] = True
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
@@ -1055,8 +4213,7 @@ class AirdropBot:
         elif context.user_data.get('awaiting_captcha'):
             try:
                 user_answer = int(text)
-                cursor.execute("SELECT captcha FROM captchas WHERE user_id = ?", (user_id,))
-                result = cursor.fetchone()
+                result = await db.fetchone("SELECT captcha FROM captchas WHERE user_id = ?", (user_id,))
                 if not result:
                     keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1075,8 +4232,7 @@ class AirdropBot:
             context.user_data['awaiting_captcha'] = False
 
         elif context.user_data.get('awaiting_task_add'):
-            cursor.execute("SELECT COUNT(*) FROM daily_tasks WHERE active = 1")
-            active_task_count = cursor.fetchone()[0]
+            active_task_count = await db.fetchval("SELECT COUNT(*) FROM daily_tasks WHERE active = 1")
             if active_task_count >= 10:
                 keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1086,9 +4242,9 @@ class AirdropBot:
                 try:
                     description, task_link, mandatory = text.split(maxsplit=2)
                     mandatory = int(mandatory)
-                    cursor.execute("INSERT INTO daily_tasks (description, reward, mandatory, task_link) VALUES (?, 10, ?, ?)",
-                                   (description, mandatory, task_link))
-                    conn.commit()
+                    await db.execute("INSERT INTO daily_tasks (description, reward, mandatory, task_link) VALUES (?, 10, ?, ?)",
+                                     (description, mandatory, task_link))
+                    invalidate_mandatory_tasks()
                     context.user_data['awaiting_task_add'] = False
                     keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1101,8 +4257,7 @@ class AirdropBot:
 
         elif context.user_data.get('awaiting_blacklist'):
             wallet = text
-            cursor.execute("INSERT OR IGNORE INTO blacklist (wallet) VALUES (?)", (wallet,))
-            conn.commit()
+            await db.execute("INSERT OR IGNORE INTO blacklist (wallet) VALUES (?)", (wallet,))
             context.user_data['awaiting_blacklist'] = False
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1110,18 +4265,75 @@ class AirdropBot:
 
         elif context.user_data.get('awaiting_whitelist'):
             wallet = text
-            cursor.execute("INSERT OR IGNORE INTO whitelist (wallet) VALUES (?)", (wallet,))
-            conn.commit()
+            await db.execute("INSERT OR IGNORE INTO whitelist (wallet) VALUES (?)", (wallet,))
             context.user_data['awaiting_whitelist'] = False
             keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await context.send_message(chat_id, f"{wallet} whitelisted.", reply_markup)
 
+        elif context.user_data.get('awaiting_snapshot'):
+            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            try:
+                campaign_id, *pins = text.split()
+                heights = {}
+                for pin in pins:
+                    chain, height = pin.split("=")
+                    if chain.upper() not in Snapshot.PINNED_CHAINS:
+                        raise ValueError(chain)
+                    heights[chain.upper()] = int(height)
+                campaign_id = int(campaign_id)
+                context.user_data['awaiting_snapshot'] = False
+                self.snapshot_task = spawn(self.run_snapshot(context, chat_id, campaign_id, heights), f"snapshot {campaign_id}")
+                await context.send_message(chat_id, f"Snapshot for campaign {campaign_id} started.", reply_markup)
+            except ValueError:
+                await context.send_message(chat_id, "Format: campaign_id [ETH=block] [BSC=block] [XRP=ledger]", reply_markup)
+
+        elif context.user_data.get('awaiting_broadcast'):
+            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            audience, _, message = text.partition(" ")
+            if audience not in ("all", "verified", "eligible") or not message.strip():
+                await context.send_message(chat_id, "Format: audience message (audience: all, verified or eligible)", reply_markup)
+            else:
+                context.user_data['awaiting_broadcast'] = False
+                broadcast = await Broadcast.create(audience, message.strip())
+                spawn(self.run_broadcast(context, broadcast, chat_id), f"broadcast {broadcast.id}")
+                await context.send_message(chat_id, f"Broadcast {broadcast.id} to {audience} users started.", reply_markup)
+
+        elif context.user_data.get('awaiting_auto_approve'):
+            keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            words = text.split()
+            try:
+                if len(words) == 2 and words[0] == "off":
+                    Moderation(words[1])
+                    await db.execute("DELETE FROM config WHERE key = ?", (f"auto_approve_{words[1]}",))
+                    await context.send_message(chat_id, f"Auto-approve for {words[1]} removed.", reply_markup)
+                else:
+                    moderation = Moderation.parse(text)
+                    await db.execute("REPLACE INTO config (key, value) VALUES (?, ?)", (f"auto_approve_{moderation.queue}", moderation.rule))
+                    await self.run_moderation(context, chat_id, moderation, "approve", f"matching '{text.strip()}' (auto-approve is on)")
+                context.user_data['awaiting_auto_approve'] = False
+            except ValueError as e:
+                await context.send_message(chat_id, f"Invalid rule: {e}", reply_markup)
+
+        elif context.user_data.get('awaiting_export'):
+            try:
+                export = Export.parse(text)
+            except ValueError as e:
+                keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
+                reply_markup = InlineKeyboardMarkup(keyboard)
+                await context.send_message(chat_id, f"Cannot export: {e}", reply_markup)
+            else:
+                context.user_data['awaiting_export'] = False
+                spawn(self.run_export(context, chat_id, export), f"export {export.table}")
+                await context.send_message(chat_id, f"Exporting {export.table}...")
+
         elif context.user_data.get('awaiting_config'):
             try:
                 key, value = text.split()
-                cursor.execute("REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
-                conn.commit()
+                await db.execute("REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
                 context.user_data['awaiting_config'] = False
                 keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1135,9 +4347,8 @@ class AirdropBot:
             try:
                 name, start_date, end_date, total_tokens = text.split()
                 total_tokens = float(total_tokens)
-                cursor.execute("INSERT INTO campaigns (name, start_date, end_date, total_tokens) VALUES (?, ?, ?, ?)",
-                               (name, start_date, end_date, total_tokens))
-                conn.commit()
+                await db.execute("INSERT INTO campaigns (name, start_date, end_date, total_tokens) VALUES (?, ?, ?, ?)",
+                                 (name, start_date, end_date, total_tokens))
                 context.user_data['awaiting_campaign'] = False
                 keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1152,9 +4363,8 @@ class AirdropBot:
             try:
                 name, start_date, end_date, total_tokens = text.split()
                 total_tokens = float(total_tokens)
-                cursor.execute("UPDATE campaigns SET name = ?, start_date = ?, end_date = ?, total_tokens = ? WHERE id = ?",
-                               (name, start_date, end_date, total_tokens, campaign_id))
-                conn.commit()
+                await db.execute("UPDATE campaigns SET name = ?, start_date = ?, end_date = ?, total_tokens = ? WHERE id = ?",
+                                 (name, start_date, end_date, total_tokens, campaign_id))
                 context.user_data['awaiting_campaign_edit'] = None
                 keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1168,9 +4378,11 @@ class AirdropBot:
             task_id = context.user_data['task_id']
             username = text
             if task_id in ["1", "2"]:
-                cursor.execute("UPDATE eligible SET social_tasks_completed = social_tasks_completed + 1 WHERE user_id = ?", (user_id,))
-                update_user_balance(user_id, 10)
-                conn.commit()
+                await db.execute_batch([
+                    ("UPDATE eligible SET social_tasks_completed = social_tasks_completed + 1 WHERE user_id = ?", (user_id,)),
+                    ("UPDATE users SET momo_balance = momo_balance + ? WHERE user_id = ?", (10, user_id))
+                ])
+                note_balance_change(user_id, 10)
                 keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 await context.send_message(chat_id, LANGUAGES[lang]["task_completed"].format(task_description=f"Task {task_id}"), reply_markup)
@@ -1181,8 +4393,7 @@ class AirdropBot:
             context.user_data['task_id'] = None
 
         else:
-            cursor.execute("SELECT state, task_id FROM admin_states WHERE user_id = ?", (user_id,))
-            state_result = cursor.fetchone()
+            state_result = await db.fetchone("SELECT state, task_id FROM admin_states WHERE user_id = ?", (user_id,))
             if state_result and state_result[0] == "awaiting_task_edit":
                 task_id = state_result[1]
                 logger.info(f"Admin {user_id} submitted edit for task {task_id}: {text}")
@@ -1197,11 +4408,12 @@ class AirdropBot:
                     mandatory = int(mandatory)
                     if mandatory not in [0, 1]:
                         raise ValueError("Mandatory must be 0 or 1")
-                    cursor.execute("UPDATE daily_tasks SET description = ?, reward = ?, mandatory = ?, task_link = ? WHERE id = ?",
-                                   (description, reward, mandatory, task_link, task_id))
-                    conn.commit()
-                    cursor.execute("DELETE FROM admin_states WHERE user_id = ?", (user_id,))
-                    conn.commit()
+                    await db.execute_batch([
+                        ("UPDATE daily_tasks SET description = ?, reward = ?, mandatory = ?, task_link = ? WHERE id = ?",
+                         (description, reward, mandatory, task_link, task_id)),
+                        ("DELETE FROM admin_states WHERE user_id = ?", (user_id,))
+                    ])
+                    invalidate_mandatory_tasks()
                     keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                     reply_markup = InlineKeyboardMarkup(keyboard)
                     await context.send_message(chat_id, LANGUAGES[lang]["task_edited"].format(
@@ -1230,23 +4442,20 @@ class AirdropBot:
                     task_id = parts[0]
                     username = parts[1]
                     today = datetime.utcnow().strftime("%Y-%m-%d")
-                    cursor.execute("SELECT id, description FROM daily_tasks WHERE id = ? AND active = 1", (task_id,))
-                    task = cursor.fetchone()
+                    task = await db.fetchone("SELECT id, description FROM daily_tasks WHERE id = ? AND active = 1", (task_id,))
                     if not task:
                         keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                         reply_markup = InlineKeyboardMarkup(keyboard)
                         await context.send_message(chat_id, "Task not found or inactive.", reply_markup)
                         return
-                    cursor.execute("SELECT COUNT(*) FROM task_completions WHERE user_id = ? AND task_id = ? AND completion_date = ?",
-                                   (user_id, task_id, today))
-                    if cursor.fetchone()[0] > 0:
+                    if await db.fetchval("SELECT COUNT(*) FROM task_completions WHERE user_id = ? AND task_id = ? AND completion_date = ?",
+                                         (user_id, task_id, today)) > 0:
                         keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                         reply_markup = InlineKeyboardMarkup(keyboard)
                         await context.send_message(chat_id, "You’ve already submitted this task today.", reply_markup)
                         return
-                    cursor.execute("INSERT INTO task_completions (user_id, task_id, completion_date, username) VALUES (?, ?, ?, ?)",
-                                   (user_id, task_id, today, username))
-                    conn.commit()
+                    await db.execute("INSERT INTO task_completions (user_id, task_id, completion_date, username) VALUES (?, ?, ?, ?)",
+                                     (user_id, task_id, today, username))
                     keyboard = [[InlineKeyboardButton("Back to Menu", callback_data="start")]]
                     reply_markup = InlineKeyboardMarkup(keyboard)
                     await context.send_message(chat_id, LANGUAGES[lang]["task_completed"].format(task_description=task[1]), reply_markup)
@@ -1265,15 +4474,13 @@ class AirdropBot:
             return
 
     async def verify_wallet(self, user_id, chat_id, context: BotContext, lang):
-        cursor.execute("SELECT wallet, chain FROM submissions WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
+        result = await db.fetchone("SELECT wallet, chain FROM submissions WHERE user_id = ?", (user_id,))
         if result:
             wallet, chain = result
             tier, token_balance = await check_eligibility(wallet, chain)
             if tier > 0:
-                cursor.execute("REPLACE INTO eligible (user_id, wallet, chain, tier, verified, token_balance, social_tasks_completed) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                               (user_id, wallet, chain, tier, 1, token_balance, 0))
-                conn.commit()
+                await db.execute("REPLACE INTO eligible (user_id, wallet, chain, tier, verified, token_balance, social_tasks_completed) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (user_id, wallet, chain, tier, 1, token_balance, 0))
                 await context.send_message(chat_id, LANGUAGES[lang]["verified"].format(tier=tier))
             else:
                 await context.send_message(chat_id, LANGUAGES[lang]["no_assets"])
@@ -1281,23 +4488,33 @@ class AirdropBot:
             await context.send_message(chat_id, "No wallet submission found.")
 
 async def calculate_airdrop(campaign_id):
-    cursor.execute("SELECT total_tokens FROM campaigns WHERE id = ? AND active = 1", (campaign_id,))
-    total_tokens = cursor.fetchone()[0]
-    cursor.execute("SELECT user_id, tier FROM eligible WHERE verified = 1")
-    eligible_users = cursor.fetchall()
+    total_tokens = await db.fetchval("SELECT total_tokens FROM campaigns WHERE id = ? AND active = 1", (campaign_id,))
+    snapshot_id = await db.fetchval("SELECT id FROM snapshots WHERE campaign_id = ? AND status = 'completed' ORDER BY id DESC LIMIT 1", (campaign_id,))
+    if snapshot_id:
+        # Tiers come from the balances held at the snapshot heights, not from live balances.
+        eligible_users = await db.fetchall("SELECT b.user_id, b.tier, b.wallet, b.chain FROM snapshot_balances b "
+                                           "JOIN eligible e ON e.user_id = b.user_id WHERE b.snapshot_id = ? AND e.verified = 1",
+                                           (snapshot_id,))
+        logger.info(f"Calculating airdrop for campaign {campaign_id} from snapshot {snapshot_id}")
+    else:
+        await reverify_eligible()
+        eligible_users = await db.fetchall("SELECT e.user_id, e.tier, s.wallet, s.chain FROM eligible e JOIN submissions s ON s.user_id = e.user_id WHERE e.verified = 1")
+    ready = set(await get_airdrop_ready_users())
+    eligible_users = [user for user in eligible_users if user[0] in ready]
     total_tiers = sum(user[1] for user in eligible_users)
     if total_tiers == 0:
         return
     token_per_tier = total_tokens / total_tiers
-    vesting_days = int(cursor.execute("SELECT value FROM config WHERE key = 'vesting_period_days'").fetchone()[0])
+    vesting_days = int(await db.fetchval("SELECT value FROM config WHERE key = 'vesting_period_days'"))
     vesting_end = (datetime.utcnow() + timedelta(days=vesting_days)).isoformat()
-    for user_id, tier in eligible_users:
-        amount = token_per_tier * tier
-        cursor.execute("SELECT wallet, chain FROM submissions WHERE user_id = ?", (user_id,))
-        wallet, chain = cursor.fetchone()
-        cursor.execute("REPLACE INTO distributions (user_id, wallet, chain, amount, status, vesting_end) VALUES (?, ?, ?, ?, ?, ?)",
-                       (user_id, wallet, chain, amount, "pending", vesting_end))
-    conn.commit()
+    # Only rows that were never sent, or whose payout definitely failed, are (re)planned;
+    # anything queued, in flight, confirmed or claimed is left alone.
+    await db.executemany(
+        "INSERT INTO distributions (user_id, wallet, chain, amount, status, vesting_end) VALUES (?, ?, ?, ?, 'pending', ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET wallet = excluded.wallet, chain = excluded.chain, amount = excluded.amount, "
+        "status = 'pending', tx_hash = NULL, job_id = NULL, error = NULL, vesting_end = excluded.vesting_end "
+        "WHERE distributions.status IN ('pending', 'failed')",
+        [(user_id, wallet, chain, token_per_tier * tier, vesting_end) for user_id, tier, wallet, chain in eligible_users])
 
 # Telegram Setup
 async def setup_telegram(bot: AirdropBot):
@@ -1313,6 +4530,10 @@ async def setup_telegram(bot: AirdropBot):
     await bot.telegram_app.initialize()
     await bot.telegram_app.start()
     await bot.telegram_app.updater.start_polling()
+    for broadcast in await Broadcast.unfinished():
+        logger.info(f"Resuming broadcast {broadcast.id} ({broadcast.audience}) after {broadcast.cursor or 'start'}")
+        spawn(bot.run_broadcast(context, broadcast, ADMIN_ID), f"broadcast {broadcast.id}")
+    spawn(bot.run_auto_approve(context), "auto-approve")
 
 # Discord Setup
 discord_bot = discord_commands.Bot(command_prefix="!", intents=discord.Intents.all())
@@ -1354,10 +4575,59 @@ async def on_message(message: discord.Message):
     await airdrop_bot.handle_message(message, bot_context)
     await discord_bot.process_commands(message)
 
+# Metrics Endpoint
+@metrics.collector
+async def collect_runtime_metrics():
+    for platform, dispatcher in dispatchers.items():
+        stats = dispatcher.stats()
+        for state in ("queued", "in_flight"):
+            SEND_QUEUE.set(stats[state], platform, state)
+        for outcome in ("sent", "failed", "retried"):
+            MESSAGES.set(stats[outcome], platform, outcome)
+    for name, pool in rpc_pools.items():
+        now = time.monotonic()
+        for endpoint in pool.endpoints:
+            RPC_ENDPOINT_UP.set(0 if endpoint.down_until > now else 1, name, endpoint.host)
+    for key, bucket in rate_limiter.stats().items():
+        RATE_LIMIT_WAITING.set(bucket["waiting"], key)
+        RATE_LIMIT_CALLS.set(bucket["acquired"], key)
+        RATE_LIMIT_DELAYED.set(bucket["delayed"], key)
+        RATE_LIMIT_WAIT_SECONDS.set(bucket["waited"], key)
+    rows = await db.fetchall("SELECT d.status, COUNT(*) FROM distribution_jobs j JOIN distributions d ON d.job_id = j.id "
+                             "WHERE j.status = 'running' GROUP BY d.status")
+    DISTRIBUTION_ROWS.clear()
+    for status, count in rows:
+        DISTRIBUTION_ROWS.set(count, status)
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    async def serve_metrics(request: web.Request) -> web.Response:
+        return web.Response(body=(await metrics.render()).encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", serve_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
 # Main Execution
 airdrop_bot = AirdropBot()
 
 async def main():
+    await leaderboard.load()
+    if METRICS_PORT:
+        await start_metrics_server()
+        spawn(monitor_loop_lag(), "loop lag monitor")
+
     # Setup and start Telegram bot as a task
     telegram_task = asyncio.create_task(setup_telegram(airdrop_bot))
     
@@ -1379,4 +4649,4 @@ if __name__ == "__main__":
             asyncio.run(airdrop_bot.telegram_app.shutdown())
         if airdrop_bot.discord_bot:
             asyncio.run(discord_bot.close())
-        conn.close()
+        db.close()
@@ -0,0 +1,155 @@
+"""Shared fixtures. bot.py opens its database and builds its RPC clients on import, so
+DB_PATH points at a scratch file before any test module imports it. Chains are replaced
+at the RPC boundary only: the distributors get fake clients, nothing inside bot is patched.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="airdrop-tests-"), "test.db")
+
+
+class Crash(BaseException):
+    """Stands in for the process dying: not an Exception, so no handler in bot swallows it."""
+
+
+class FakeEvmChain:
+    """The slice of web3 and an ERC-20 contract that EvmDistributor uses, in memory. Every
+    nonce is accepted into the mempool and the sender's transactions are mined as soon as
+    they are contiguous with the account nonce, so a gap stalls everything after it exactly
+    as on a real node. Signing is deterministic JSON, so the same transfer signs to the same
+    bytes and hash.
+
+    faults maps a recipient to what goes wrong the next time its transaction is sent:
+    "drop" (the request never reaches the node), "timeout" (the node takes the transaction
+    but the reply is lost) or "external" (another transaction from the same key lands
+    first and takes the nonce). Recipients are compared in lower case.
+    """
+
+    chain_id = 1337
+    gas_price = 10**9
+    token = "0x" + "70" * 20
+
+    def __init__(self, sender: str):
+        self.sender = sender
+        self.eth = self
+        self.account = self
+        self.functions = self
+        self.nonce = 0
+        self.mempool = {}
+        self.receipts = {}
+        self.paid = []
+        self.self_transfers = 0
+        self.sends = 0
+        self.faults = {}
+        self._lock = threading.Lock()
+
+    # token_contract.functions.transfer(...).build_transaction(...)
+    def transfer(self, to: str, value: int):
+        return SimpleNamespace(build_transaction=lambda params: {**params, "to": self.token, "data": ["transfer", to, value]})
+
+    # web3.eth.account.sign_transaction(...)
+    def sign_transaction(self, tx: dict, private_key):
+        raw = json.dumps(tx, sort_keys=True).encode()
+        return SimpleNamespace(rawTransaction=raw, hash=hashlib.sha256(raw).digest())
+
+    def get_transaction_count(self, address: str, block: str = "latest") -> int:
+        with self._lock:
+            return self.nonce
+
+    def send_raw_transaction(self, raw: bytes):
+        tx = json.loads(raw)
+        tx_hash = hashlib.sha256(raw).digest()
+        recipient = tx["data"][1].lower() if "data" in tx else None
+        with self._lock:
+            self.sends += 1
+            fault = self.faults.pop(recipient, None)
+            if fault == "drop":
+                raise ConnectionError("connection reset by peer")
+            if fault == "external":
+                self.nonce = max(self.nonce, tx["nonce"] + 1)
+            if tx_hash in self.receipts or any(pending[0] == tx_hash for pending in self.mempool.values()):
+                raise ValueError("already known")
+            if tx["nonce"] < self.nonce:
+                raise ValueError("nonce too low")
+            if tx["nonce"] in self.mempool:
+                raise ValueError("replacement transaction underpriced")
+            self.mempool[tx["nonce"]] = (tx_hash, tx)
+            while self.nonce in self.mempool:
+                mined_hash, mined = self.mempool.pop(self.nonce)
+                if "data" in mined:
+                    self.paid.append((mined["data"][1], mined["data"][2]))
+                else:
+                    self.self_transfers += 1
+                self.receipts[mined_hash] = {"status": 1, "transactionHash": mined_hash}
+                self.nonce += 1
+            if fault == "timeout":
+                raise TimeoutError("read timed out")
+        return tx_hash
+
+    def get_transaction_receipt(self, tx_hash):
+        key = tx_hash if isinstance(tx_hash, bytes) else bytes.fromhex(tx_hash.removeprefix("0x"))
+        with self._lock:
+            if key not in self.receipts:
+                raise LookupError(f"transaction {tx_hash} not found")
+            return self.receipts[key]
+
+
+class MemoryJournal:
+    """DistributionJob's journal interface over a dict, for driving a distributor directly."""
+
+    def __init__(self, transfers: list):
+        self.rows = {user_id: {"transfer": (user_id, wallet, amount), "status": "queued", "tx_hash": None}
+                     for user_id, wallet, amount in transfers}
+        self.txs = {}
+
+    async def signed(self, chain, unit, tx_hash, nonce, raw_tx):
+        self.txs[tx_hash] = (nonce, raw_tx)
+        for user_id, _, _ in unit:
+            self.rows[user_id].update(status="signed", tx_hash=tx_hash)
+
+    async def sent(self, unit, tx_hash, error):
+        for user_id, _, _ in unit:
+            if error is None:
+                self.rows[user_id]["status"] = "broadcast"
+            elif tx_hash is None:
+                self.rows[user_id]["status"] = "failed"
+
+    async def settled(self, unit, tx_hash, ok):
+        if ok is not None:
+            for user_id, _, _ in unit:
+                self.rows[user_id]["status"] = "confirmed" if ok else "failed"
+
+    async def requeue(self, unit, tx_hash):
+        for user_id, _, _ in unit:
+            self.rows[user_id].update(status="queued", tx_hash=None)
+
+    def queued(self) -> list:
+        return [row["transfer"] for row in self.rows.values() if row["status"] == "queued"]
+
+    def in_flight(self) -> list:
+        units = {}
+        for row in self.rows.values():
+            if row["status"] in ("signed", "broadcast"):
+                units.setdefault(row["tx_hash"], []).append(row["transfer"])
+        return [(tx_hash, self.txs[tx_hash][1], unit) for tx_hash, unit in sorted(units.items(), key=lambda item: self.txs[item[0]][0])]
+
+    def statuses(self) -> dict:
+        counts = {}
+        for row in self.rows.values():
+            counts[row["status"]] = counts.get(row["status"], 0) + 1
+        return counts
+
+
+def wallets(count: int, start: int = 1) -> list:
+    return [("0x" + f"{i:040x}") for i in range(start, start + count)]
+
+
+@pytest.fixture
+def sender():
+    return "0x" + "5e" * 20
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from conftest import Crash, FakeEvmChain, wallets
+
+bot = pytest.importorskip("bot")
+
+
+@pytest.fixture(autouse=True)
+def empty_payout_tables():
+    async def clear():
+        await bot.db.execute_batch([(f"DELETE FROM {table}", ()) for table in ("distributions", "distribution_jobs", "distribution_txs")])
+    asyncio.run(clear())
+
+
+async def plan(count: int, chain: str = "ETH"):
+    await bot.db.executemany("INSERT INTO distributions (user_id, wallet, chain, amount, status) VALUES (?, ?, ?, 1.0, 'pending')",
+                             [(str(i), wallet, chain) for i, wallet in enumerate(wallets(count))])
+
+
+class CrashAfterSigning:
+    """A DistributionJob whose process dies right after the crash_at-th transaction is journaled as signed."""
+
+    def __init__(self, job: "bot.DistributionJob", crash_at: int):
+        self.job = job
+        self.crash_at = crash_at
+        self.signatures = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.job, name)
+
+        async def journal(*args):
+            if self.signatures >= self.crash_at:
+                raise Crash()
+            return await method(*args)
+        return journal
+
+    async def signed(self, *args):
+        if self.signatures >= self.crash_at:
+            raise Crash()
+        await self.job.signed(*args)
+        self.signatures += 1
+        if self.signatures == self.crash_at:
+            raise Crash()
+
+
+def test_open_resumes_only_the_campaigns_own_job():
+    async def scenario():
+        def running(c):
+            return c.execute("INSERT INTO distribution_jobs (campaign_id, status) VALUES (2, 'running')").lastrowid
+        other = await bot.db.write(running)
+        job = await bot.DistributionJob.open(1)
+        assert not job.resumed and job.id != other
+        again = await bot.DistributionJob.open(1)
+        assert again.resumed and again.id == job.id
+        resumed = await bot.DistributionJob.open(2)
+        assert resumed.resumed and resumed.id == other and resumed.campaign_id == 2
+    asyncio.run(scenario())
+
+
+def test_resume_after_crash_never_double_pays(sender):
+    chain = FakeEvmChain(sender)
+    # 3's broadcast lands but the reply is lost, and the process dies after signing the 7th transaction.
+    chain.faults = {wallets(12)[3]: "timeout"}
+
+    def distributor():
+        return bot.EvmDistributor(chain, chain, "ETH", sender, "key", concurrency=1, receipt_timeout=2.0,
+                                  poll_interval=0.01, broadcast_retries=1)
+
+    async def first_run():
+        await plan(12)
+        job = await bot.DistributionJob.open(1)
+        with pytest.raises(Crash):
+            await distributor().distribute(await job.queued("ETH"), CrashAfterSigning(job, crash_at=7))
+        return job.id
+
+    async def restart():
+        job = await bot.DistributionJob.open(1)
+        assert job.resumed and job.id == job_id
+        engine = distributor()
+        await engine.recover(await job.in_flight("ETH"), job)
+        await engine.distribute(await job.queued("ETH"), job)
+        return job, await job.finish()
+
+    job_id = asyncio.run(first_run())
+    paid_before_restart = len(chain.paid)
+    job, counts = asyncio.run(restart())
+
+    assert 0 < paid_before_restart < 12
+    assert sorted(to.lower() for to, _ in chain.paid) == sorted(wallets(12))
+    assert counts == {"confirmed": 12} and job.completed
+    assert not chain.mempool
@@ -0,0 +1,181 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import Crash, FakeEvmChain, MemoryJournal, wallets
+
+bot = pytest.importorskip("bot")
+
+
+def make_distributor(chain: FakeEvmChain, sender: str, **options) -> "bot.EvmDistributor":
+    options = {"concurrency": 4, "gas_batch": 5, "receipt_timeout": 2.0, "poll_interval": 0.01, "broadcast_retries": 1, **options}
+    return bot.EvmDistributor(chain, chain, "ETH", sender, "key", **options)
+
+
+def transfers(count: int) -> list:
+    return [(str(i), wallet, 1.0) for i, wallet in enumerate(wallets(count))]
+
+
+def paid_to(chain: FakeEvmChain) -> list:
+    return sorted(to.lower() for to, _ in chain.paid)
+
+
+def test_allocator_hands_out_released_nonces_first():
+    nonces = bot.NonceAllocator(7)
+    assert [nonces.allocate() for _ in range(3)] == [7, 8, 9]
+    nonces.release(9)
+    nonces.release(8)
+    assert nonces.allocate() == 8
+    assert nonces.allocate() == 9
+    assert nonces.allocate() == 10
+    nonces.release(10)
+    assert nonces.drain_gaps() == [10]
+    assert nonces.allocate() == 11
+
+
+def test_concurrent_payout_uses_each_nonce_once(sender):
+    chain = FakeEvmChain(sender)
+    chain.nonce = 5
+    batch = transfers(40)
+    journal = MemoryJournal(batch)
+    summary = asyncio.run(make_distributor(chain, sender, concurrency=8).distribute(batch, journal))
+
+    assert summary["confirmed"] == 40 and summary["failed"] == 0
+    assert chain.nonce == 45 and not chain.mempool
+    assert chain.sends == 40  # no nonce was handed out twice, so nothing was rejected
+    assert paid_to(chain) == sorted(wallets(40))
+    assert journal.statuses() == {"confirmed": 40}
+
+
+def test_failed_sends_leave_no_nonce_gap(sender):
+    chain = FakeEvmChain(sender)
+    batch = transfers(10)
+    # One send fails mid-run, so its nonce goes to the next transfer; the last one fails
+    # with nobody left to reuse its nonce, so it is filled with a self-transfer.
+    chain.faults = {batch[3][1]: "drop", batch[9][1]: "drop"}
+    journal = MemoryJournal(batch)
+    summary = asyncio.run(make_distributor(chain, sender, concurrency=1).distribute(batch, journal))
+
+    assert summary["failed"] == 2 and summary["confirmed"] == 8
+    assert not chain.mempool  # nothing stuck behind a gap
+    assert chain.nonce == 9 and chain.self_transfers == 1
+    assert paid_to(chain) == sorted(wallet for i, wallet in enumerate(wallets(10)) if i not in (3, 9))
+    # The failed transfers were signed, so they wait for recover() rather than being marked failed.
+    assert journal.statuses() == {"confirmed": 8, "signed": 2}
+
+
+def test_nonce_too_low_is_not_reused_and_recover_requeues(sender):
+    chain = FakeEvmChain(sender)
+    batch = transfers(6)
+    chain.faults = {batch[0][1]: "external"}
+    journal = MemoryJournal(batch)
+    distributor = make_distributor(chain, sender, concurrency=1)
+    summary = asyncio.run(distributor.distribute(batch, journal))
+
+    # Only the transfer that met the foreign transaction fails; its nonce is not handed out again.
+    assert summary["failed"] == 1 and summary["confirmed"] == 5
+    assert chain.sends == 6 and chain.self_transfers == 0
+    assert journal.rows["0"]["status"] == "signed"
+
+    recovered = asyncio.run(distributor.recover(journal.in_flight(), journal))
+    assert recovered["requeued"] == 1
+    assert journal.queued() == [batch[0]]
+    asyncio.run(distributor.distribute(journal.queued(), journal))
+    assert paid_to(chain) == sorted(wallets(6))
+    assert journal.statuses() == {"confirmed": 6}
+
+
+class CrashingJournal(MemoryJournal):
+    """Dies right after recording the crash_at-th signed transaction; a dead process records nothing more."""
+
+    def __init__(self, transfers: list, crash_at: int):
+        super().__init__(transfers)
+        self.crash_at = crash_at
+        self.signatures = 0
+        self.dead = False
+
+    async def signed(self, chain, unit, tx_hash, nonce, raw_tx):
+        if self.dead:
+            raise Crash()
+        await super().signed(chain, unit, tx_hash, nonce, raw_tx)
+        self.signatures += 1
+        if self.signatures == self.crash_at:
+            self.dead = True
+            raise Crash()
+
+    async def sent(self, unit, tx_hash, error):
+        if self.dead:
+            raise Crash()
+        await super().sent(unit, tx_hash, error)
+
+    def revive(self):
+        self.dead = False
+
+
+def test_recover_resumes_after_crash_without_paying_twice(sender):
+    chain = FakeEvmChain(sender)
+    batch = transfers(10)
+    # 2 lands but its reply is lost; 3 is then sent with 2's released nonce and is rejected;
+    # the process dies right after signing the 6th transaction, before broadcasting it.
+    chain.faults = {batch[2][1]: "timeout"}
+    journal = CrashingJournal(batch, crash_at=6)
+    distributor = make_distributor(chain, sender, concurrency=1)
+
+    async def crash():
+        with pytest.raises(Crash):
+            await distributor.distribute(batch, journal)
+    asyncio.run(crash())
+    assert len(chain.paid) == 4
+    journal.revive()
+
+    # A fresh engine, as after a restart, picks up from the journal alone.
+    distributor = make_distributor(chain, sender, concurrency=1)
+    recovered = asyncio.run(distributor.recover(journal.in_flight(), journal))
+    # Broadcast but never settled (0, 1, 4), landed with a lost reply (2), rejected (3), signed only (5).
+    assert recovered["recovered"] == 6
+    assert recovered["confirmed"] == 5 and recovered["requeued"] == 1
+    asyncio.run(distributor.distribute(journal.queued(), journal))
+
+    assert paid_to(chain) == sorted(wallets(10))
+    assert journal.statuses() == {"confirmed": 10}
+    assert not chain.mempool
+
+
+class FakeDisperse:
+    """A disperse contract whose gas estimate charges each recipient 35000, or a million for those in heavy."""
+
+    address = "0x" + "d1" * 20
+
+    def __init__(self, heavy: set):
+        self.heavy = heavy
+        self.functions = self
+
+    def disperseToken(self, token, recipients, values):
+        gas = 60000 + sum(1_000_000 if recipient.lower() in self.heavy else 35000 for recipient in recipients)
+        return SimpleNamespace(estimate_gas=lambda params: gas)
+
+
+class ApprovedChain(FakeEvmChain):
+    address = FakeEvmChain.token
+
+    def allowance(self, owner, spender):
+        return SimpleNamespace(call=lambda: 10**30)
+
+
+def test_recipient_over_the_disperse_gas_limit_gets_a_plain_transfer(sender):
+    chain = ApprovedChain(sender)
+    batch = transfers(8)
+    heavy = batch[3]
+    distributor = make_distributor(chain, sender, disperse_contract=FakeDisperse({heavy[1]}), disperse_gas_limit=500000)
+
+    async def units():
+        return [(unit, build) async for unit, build in distributor._send_units(batch, chain.chain_id, bot.NonceAllocator(0))]
+    sent = asyncio.run(units())
+
+    assert sorted(item for unit, _ in sent for item in unit) == sorted(batch)
+    plain = [unit for unit, build in sent if build.func == distributor._sign_transfer]
+    assert plain == [[heavy]]
+    for unit, build in sent:
+        if build.func == distributor._sign_disperse:
+            assert heavy not in unit and 60000 + 35000 * len(unit) <= build.args[1] <= 500000
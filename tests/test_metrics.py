@@ -0,0 +1,20 @@
+import asyncio
+
+import pytest
+
+bot = pytest.importorskip("bot")
+
+
+def test_rate_limit_buckets_are_exported(monkeypatch):
+    limiter = bot.RateLimiter("test:bucket=2/1")
+    monkeypatch.setattr(bot, "rate_limiter", limiter)
+    bucket = limiter.buckets["test:bucket"]
+    delays = [bucket.reserve() for _ in range(3)]
+    bucket.track(1)
+
+    text = asyncio.run(bot.metrics.render())
+    assert 'airdrop_rate_limit_waiting{bucket="test:bucket"} 1' in text
+    assert 'airdrop_rate_limit_calls_total{bucket="test:bucket"} 3' in text
+    assert 'airdrop_rate_limit_delayed_total{bucket="test:bucket"} 2' in text
+    waited = next(line for line in text.splitlines() if line.startswith('airdrop_rate_limit_wait_seconds_total{bucket="test:bucket"}'))
+    assert float(waited.split()[-1]) == pytest.approx(sum(delays))
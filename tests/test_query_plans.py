@@ -0,0 +1,177 @@
+"""Query-plan regression check for the SQL in bot.py.
+
+Every statement is planned with EXPLAIN QUERY PLAN against a scratch database built from
+bot.MIGRATIONS and must not fall back to a full table scan, unless ALLOWED_SCANS says why.
+SQL string literals are read from the source; SQL assembled at runtime (Moderation,
+Export, the mandatory-task checks) is rendered by running the code that builds it with
+representative filters and placeholder counts and recording what it executes.
+
+    pytest tests/test_query_plans.py -v
+"""
+import ast
+import asyncio
+import itertools
+import os
+import re
+import sqlite3
+
+import pytest
+
+bot = pytest.importorskip("bot")
+
+BOT_SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot.py")
+SQL_START = re.compile(r"^\s*(SELECT|INSERT|REPLACE|UPDATE|DELETE|WITH)\s")
+
+# Statements that read a whole table on purpose; an entry also covers itself with a WHERE clause appended.
+ALLOWED_SCANS = {
+    "SELECT user_id, wallet, chain, amount, status, tx_hash, vesting_end FROM distributions":
+        "admin export reads every distribution row",
+    "SELECT user_id, username, language, kyc_status, momo_balance, referred_by, kyc_wallet, kyc_chain, kyc_submission_time FROM users":
+        "admin export reads every user row",
+    "SELECT referrer_id, referee_id, timestamp, status FROM referrals":
+        "admin export reads every referral row",
+    "SELECT user_id, username, task_id, completion_date, status FROM task_completions":
+        "admin export reads every task completion row",
+    "SELECT user_id, username, momo_balance FROM users":
+        "leaderboard is seeded from every user once at startup",
+    "SELECT id FROM daily_tasks WHERE mandatory = 1":
+        "read once and cached; daily_tasks holds a handful of rows",
+}
+
+
+def sql_literals(path: str):
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    fragments = {id(part) for node in ast.walk(tree) if isinstance(node, ast.JoinedStr) for part in node.values}
+    for node in ast.walk(tree):
+        if id(node) in fragments:
+            continue
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and SQL_START.match(node.value):
+            yield f"bot.py:{node.lineno}", " ".join(node.value.split())
+
+
+def full_scans(plan: list) -> list:
+    # Scanning a materialized subquery or CTE is not a table scan.
+    derived = {row[-1].split()[-1] for row in plan if row[-1].startswith(("MATERIALIZE ", "CO-ROUTINE "))}
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        if (detail.startswith("SCAN ") and "USING" not in detail and "CONSTANT ROW" not in detail
+                and "(subquery" not in detail and detail.split()[1] not in derived):
+            scans.append(detail)
+    return scans
+
+
+def allowed(sql: str) -> bool:
+    return any(sql == statement or sql.startswith(statement + " WHERE ") for statement in ALLOWED_SCANS)
+
+
+def check(connection: sqlite3.Connection, statements) -> list:
+    failures, seen = [], set()
+    for origin, sql, params in statements:
+        sql = " ".join(sql.split())
+        if sql in seen:
+            continue
+        seen.add(sql)
+        try:
+            plan = connection.execute(f"EXPLAIN QUERY PLAN {sql}", list(params)).fetchall()
+        except sqlite3.Error as e:
+            failures.append(f"{origin}: cannot plan statement ({e}): {sql}")
+            continue
+        scans = full_scans(plan)
+        if scans and not allowed(sql):
+            failures.append(f"{origin}: full table scan ({'; '.join(scans)}): {sql}")
+    assert seen, "no statements were checked"
+    return failures
+
+
+@pytest.fixture(scope="module")
+def connection():
+    connection = sqlite3.connect(":memory:", isolation_level=None)
+    bot.run_migrations(connection)
+    yield connection
+    connection.close()
+
+
+class Recorder:
+    """A connection that records every statement it runs, with its parameters."""
+
+    def __init__(self, connection: sqlite3.Connection, origin: str):
+        self.connection = connection
+        self.origin = origin
+        self.statements = []
+
+    def execute(self, sql: str, params=()):
+        self.statements.append((self.origin, sql, tuple(params)))
+        return self.connection.execute(sql, params)
+
+
+def test_migrations_leave_one_index_on_daily_tasks(connection):
+    indexes = {row[1] for row in connection.execute("PRAGMA index_list(daily_tasks)") if not row[1].startswith("sqlite_autoindex")}
+    assert indexes == {"idx_daily_tasks_active"}
+
+
+def test_literal_statements_use_indexes(connection):
+    statements = [(origin, sql, [None] * sql.count("?")) for origin, sql in sql_literals(BOT_SOURCE)]
+    failures = check(connection, statements)
+    assert not failures, "\n".join(failures)
+
+
+def moderation_statements(connection: sqlite3.Connection) -> list:
+    # One pending row per queue, so the UPDATE statements run as well as the SELECT.
+    connection.execute("INSERT INTO users (user_id, username, language, kyc_status, kyc_chain, kyc_submission_time) VALUES ('u1', 'u1', 'en', 'submitted', 'ETH', '2024-01-01')")
+    connection.execute("INSERT INTO task_completions (user_id, task_id, completion_date, username) VALUES ('u1', 1, '2024-01-01', 'u1')")
+    connection.execute("INSERT INTO referrals (referrer_id, referee_id, timestamp) VALUES ('u2', 'u1', '2024-01-01')")
+    values = {"task": 1, "before": "2024-02-01", "chain": "ETH", "referrer": "u2", "verified": "0"}
+    keys = {"tasks": lambda n: [["u1", 1, "2024-01-01"]] + [[f"x{i}", 1, "2024-01-01"] for i in range(n - 1)],
+            "kyc": lambda n: ["u1"] + [f"x{i}" for i in range(n - 1)],
+            "referrals": lambda n: ["u1"] + [f"x{i}" for i in range(n - 1)]}
+    recorder = Recorder(connection, "Moderation")
+    for queue, filters in bot.Moderation.FILTERS.items():
+        for count in range(len(filters) + 1):
+            for names in itertools.combinations(filters, count):
+                for key_count in (None, 1, 25):
+                    moderation = bot.Moderation(queue, {name: values[name] for name in names},
+                                                keys=None if key_count is None else keys[queue](key_count))
+                    for decision in bot.Moderation.DECISIONS:
+                        connection.execute("SAVEPOINT plans")
+                        getattr(moderation, f"_decide_{queue}")(decision, recorder)
+                        connection.execute("ROLLBACK TO plans")
+                        connection.execute("RELEASE plans")
+    for table in ("users", "task_completions", "referrals"):
+        connection.execute(f"DELETE FROM {table}")
+    return recorder.statements
+
+
+def export_statements() -> list:
+    statements = []
+    for table, (_, _, filters) in bot.Export.TABLES.items():
+        for count in range(len(filters) + 1):
+            for names in itertools.combinations(filters, count):
+                sql, params = bot.Export(table, "csv", {name: "x" for name in names}).query()
+                statements.append((f"Export({table})", sql, params))
+    return statements
+
+
+def mandatory_task_statements(monkeypatch) -> list:
+    statements = []
+
+    async def fetchall(sql, params=(), *args, **kwargs):
+        statements.append(("mandatory tasks", sql, tuple(params)))
+        return []
+
+    monkeypatch.setattr(bot.db, "fetchall", fetchall)
+    for task_ids in (frozenset(), frozenset({1}), frozenset({1, 2, 3})):
+        monkeypatch.setattr(bot, "_mandatory_task_ids", task_ids)
+        asyncio.run(bot.get_airdrop_ready_users())
+        for users in (1, bot.SQL_IN_CHUNK + 1):
+            asyncio.run(bot.users_with_mandatory_tasks([str(i) for i in range(users)]))
+    return statements
+
+
+def test_dynamic_statements_use_indexes(connection, monkeypatch):
+    statements = moderation_statements(connection) + export_statements() + mandatory_task_statements(monkeypatch)
+    origins = {origin for origin, _, _ in statements}
+    assert {"Moderation", "mandatory tasks"} <= origins and any(origin.startswith("Export") for origin in origins)
+    failures = check(connection, statements)
+    assert not failures, "\n".join(failures)
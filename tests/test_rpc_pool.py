@@ -0,0 +1,138 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+bot = pytest.importorskip("bot")
+
+
+class FakeResponse:
+    def __init__(self, body: dict):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self) -> dict:
+        return self.body
+
+
+class FakeEndpoint:
+    """A mock JSON-RPC node behind one URL: answers after `delay` seconds, or fails at the
+    transport level while `down` is set. Every call is counted by method."""
+
+    def __init__(self, name: str, delay: float = 0.0):
+        self.name = name
+        self.delay = delay
+        self.down = False
+        self.busy = False
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def post(self, url, data=None, timeout=None):
+        request = json.loads(data)
+        with self._lock:
+            self.calls.append(request["method"])
+        time.sleep(self.delay)
+        if self.down:
+            raise ConnectionError(f"{self.name} refused the connection")
+        if self.busy:
+            return FakeResponse({"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32005, "message": "limit exceeded"}})
+        if request["method"] == "eth_fail":
+            return FakeResponse({"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32000, "message": "execution reverted"}})
+        return FakeResponse({"jsonrpc": "2.0", "id": request.get("id"), "result": {"status": "success", "node": self.name}})
+
+
+def make_pool(*nodes, **options) -> "bot.RpcPool":
+    sessions = iter(nodes)
+    options = {"timeout": 1.0, "cooldown": 0.2, "hedge_after": 0.0, **options}
+    return bot.RpcPool("TEST", [f"http://node-{node.name}.test" for node in nodes], session_factory=lambda pool_size: next(sessions), **options)
+
+
+def call(pool: "bot.RpcPool", method: str = "eth_blockNumber") -> dict:
+    return pool.request(method, {"jsonrpc": "2.0", "id": 1, "method": method, "params": []})
+
+
+def test_fails_over_to_the_next_endpoint():
+    first, second = FakeEndpoint("a"), FakeEndpoint("b")
+    pool = make_pool(first, second)
+    first.down = True
+    assert call(pool)["result"]["node"] == "b"
+    assert first.calls == ["eth_blockNumber"] and second.calls == ["eth_blockNumber"]
+
+
+def test_rate_limited_answer_fails_over_but_node_errors_do_not():
+    first, second = FakeEndpoint("a"), FakeEndpoint("b")
+    pool = make_pool(first, second)
+    first.busy = True
+    assert call(pool)["result"]["node"] == "b"
+    first.busy = False
+    # A JSON-RPC error is the node's answer, so it is returned instead of retried elsewhere.
+    assert call(pool, "eth_fail")["error"]["code"] == -32000
+    assert first.calls.count("eth_fail") + second.calls.count("eth_fail") == 1
+
+
+def test_failed_endpoint_is_ejected_until_its_cooldown_ends():
+    first, second = FakeEndpoint("a"), FakeEndpoint("b", delay=0.02)
+    pool = make_pool(first, second, cooldown=0.2)
+    first.down = True
+    call(pool)
+    first.down = False
+    for _ in range(5):
+        assert call(pool)["result"]["node"] == "b"
+    assert len(first.calls) == 1  # cooled down, so not tried while b answers
+    assert pool.stats()["endpoints"][0]["down"]
+
+    time.sleep(0.25)
+    # Recovered and faster than b, so it takes the traffic again.
+    assert call(pool)["result"]["node"] == "a"
+    assert len(first.calls) == 2
+
+
+def test_slow_read_is_hedged_to_the_runner_up():
+    slow, fast = FakeEndpoint("slow", delay=0.5), FakeEndpoint("fast")
+    pool = make_pool(slow, fast, hedge_after=0.05)
+    started = time.perf_counter()
+    assert call(pool)["result"]["node"] == "fast"
+    assert time.perf_counter() - started < 0.4
+    assert pool.hedged == 1
+    assert slow.calls == ["eth_blockNumber"] and fast.calls == ["eth_blockNumber"]
+
+
+def test_writes_are_never_hedged():
+    slow, fast = FakeEndpoint("slow", delay=0.2), FakeEndpoint("fast")
+    pool = make_pool(slow, fast, hedge_after=0.05)
+    assert call(pool, "eth_sendRawTransaction")["result"]["node"] == "slow"
+    assert pool.hedged == 0 and fast.calls == []
+
+
+def test_hedging_threads_are_only_started_by_a_pool_that_hedges():
+    pool = make_pool(FakeEndpoint("a"), FakeEndpoint("b"), hedge_after=0.0)
+    call(pool)
+    assert pool._executor is None
+    hedging = make_pool(FakeEndpoint("a"), FakeEndpoint("b"), hedge_after=0.05, pool_size=4)
+    call(hedging)
+    assert hedging.executor._max_workers == 4
+
+
+def test_xrpl_requests_do_not_block_the_event_loop():
+    requests = pytest.importorskip("xrpl.models.requests")
+    node = FakeEndpoint("xrpl", delay=0.3)
+    client = bot.PooledJsonRpcClient(make_pool(node))
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        task = asyncio.create_task(ticker())
+        await client._request_impl(requests.ServerInfo())
+        task.cancel()
+        return ticks
+    assert asyncio.run(scenario()) >= 10
+    assert node.calls == ["server_info"]
@@ -0,0 +1,40 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+bot = pytest.importorskip("bot")
+
+
+async def persisted(key: tuple):
+    await asyncio.sleep(0)  # let the coalesced flush run
+    await bot.db.flush()
+    return await bot.db.fetchone("SELECT data, updated_at FROM sessions WHERE platform = ? AND user_id = ?", key)
+
+
+def test_every_mutation_is_persisted():
+    async def scenario():
+        store = bot.SessionStore(persist=True)
+        session = await store.get("telegram", "mutations")
+        session["flow"] = "kyc"
+        session |= {"step": 2}
+        assert json.loads((await persisted(session.key))[0]) == {"flow": "kyc", "step": 2}
+        session.popitem()
+        assert json.loads((await persisted(session.key))[0]) == {"flow": "kyc"}
+    asyncio.run(scenario())
+
+
+def test_reading_a_session_keeps_its_row_fresh():
+    async def scenario():
+        store = bot.SessionStore(ttl=0.4, persist=True)
+        session = await store.get("telegram", "reader")
+        session["flow"] = "kyc"
+        _, written = await persisted(session.key)
+        await store.get("telegram", "reader")
+        assert (await persisted(session.key))[1] == written  # read within ttl/2: no write
+        time.sleep(0.25)
+        await store.get("telegram", "reader")
+        data, touched = await persisted(session.key)
+        assert touched > written and json.loads(data) == {"flow": "kyc"}
+    asyncio.run(scenario())
@@ -0,0 +1,198 @@
+import asyncio
+import base64
+import json
+import threading
+
+import pytest
+
+from conftest import MemoryJournal
+
+bot = pytest.importorskip("bot")
+keypair = pytest.importorskip("solders.keypair")
+from solders.hash import Hash  # noqa: E402
+from solders.transaction import Transaction  # noqa: E402
+
+ASSOCIATED_TOKEN_PROGRAM = "ATokenGPvbdGVxr1b2hvZbsiqW5xWH25efTNsLJA8knL"
+TOKEN_PROGRAM = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+
+
+class FakeResponse:
+    def __init__(self, body: dict):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self) -> dict:
+        return self.body
+
+
+class FakeSolanaNode:
+    """A mock Solana JSON-RPC node, used as the RpcPool session. Every getLatestBlockhash
+    hands out a fresh blockhash; a transaction that arrives is confirmed unless it pays a
+    recipient in `dropped`, which makes the leader drop it that many times (forever for -1).
+    Once expire_after status polls have been answered, every blockhash handed out so far
+    expires. Token transfers that land are recorded as (owner, token units)."""
+
+    def __init__(self, expire_after: int = 0):
+        self.expire_after = expire_after
+        self.blockhashes = []
+        self.expired = set()
+        self.statuses = {}
+        self.dropped = {}
+        self.paid = []
+        self.sizes = []
+        self.sends = 0
+        self.status_calls = []
+        self.rejected = set()
+        self._lock = threading.Lock()
+
+    def _transfers(self, tx: Transaction) -> list:
+        message = tx.message
+        keys = message.account_keys
+        transfers, owner = [], None
+        for instruction in message.instructions:
+            program, data = str(keys[instruction.program_id_index]), bytes(instruction.data)
+            if program == ASSOCIATED_TOKEN_PROGRAM:
+                owner = str(keys[instruction.accounts[2]])
+            elif program == TOKEN_PROGRAM and data[0] == 12:  # transferChecked after its CreateIdempotent
+                transfers.append((owner, int.from_bytes(data[1:9], "little")))
+        return transfers
+
+    def _send(self, params: list):
+        raw = base64.b64decode(params[0])
+        tx = Transaction.from_bytes(raw)
+        signature = str(tx.signatures[0])
+        transfers = self._transfers(tx)
+        self.sends += 1
+        self.sizes.append(len(raw))
+        if not params[1]["skipPreflight"] and any(recipient in self.rejected for recipient, _ in transfers):
+            return None, {"code": -32002, "message": "Transaction simulation failed: insufficient funds for rent"}
+        if str(tx.message.recent_blockhash) in self.expired or signature in self.statuses:
+            return signature, None
+        if any(self.dropped.get(recipient, 0) for recipient, _ in transfers):
+            for recipient, _ in transfers:
+                if self.dropped.get(recipient, 0) > 0:
+                    self.dropped[recipient] -= 1
+            return signature, None
+        self.statuses[signature] = {"slot": 1, "confirmations": None, "err": None, "confirmationStatus": "confirmed"}
+        self.paid.extend(transfers)
+        return signature, None
+
+    def post(self, url, data=None, timeout=None):
+        request = json.loads(data)
+        method, params = request["method"], request["params"]
+        with self._lock:
+            if method == "getLatestBlockhash":
+                blockhash = str(Hash(bytes([len(self.blockhashes) + 1]) * 32))
+                self.blockhashes.append(blockhash)
+                result = {"context": {"slot": 1}, "value": {"blockhash": blockhash, "lastValidBlockHeight": 150}}
+            elif method == "sendTransaction":
+                result, error = self._send(params)
+                if error is not None:
+                    return FakeResponse({"jsonrpc": "2.0", "id": request["id"], "error": error})
+            elif method == "getSignatureStatuses":
+                self.status_calls.append(list(params[0]))
+                result = {"context": {"slot": 1}, "value": [self.statuses.get(signature) for signature in params[0]]}
+                if self.expire_after and len(self.status_calls) >= self.expire_after:
+                    self.expired.update(self.blockhashes)
+            elif method == "isBlockhashValid":
+                result = {"context": {"slot": 1}, "value": params[0] not in self.expired}
+            elif method == "getTokenSupply":
+                result = {"context": {"slot": 1}, "value": {"amount": "1000000000", "decimals": 6, "uiAmountString": "1000"}}
+            else:
+                return FakeResponse({"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32601, "message": "Method not found"}})
+        return FakeResponse({"jsonrpc": "2.0", "id": request["id"], "result": result})
+
+
+def make_distributor(node: FakeSolanaNode, **options) -> "bot.SolDistributor":
+    pool = bot.RpcPool("SOL-TEST", ["http://solana.test"], session_factory=lambda pool_size: node, hedge_after=0.0)
+    secret = json.dumps(list(bytes(keypair.Keypair())))
+    options = {"mint": str(keypair.Keypair().pubkey()), "concurrency": 4, "blockhash_batch": 2, "poll_interval": 0.01,
+               "receipt_timeout": 5.0, **options}
+    return bot.SolDistributor(pool, secret, **options)
+
+
+def transfers(count: int) -> list:
+    return [(str(i), str(keypair.Keypair().pubkey()), 0.001 * (i + 1)) for i in range(count)]
+
+
+def test_without_a_mint_nothing_is_paid(caplog):
+    node = FakeSolanaNode()
+    batch = transfers(5)
+    journal = MemoryJournal(batch)
+    summary = asyncio.run(make_distributor(node, mint=None).distribute(batch, journal))
+
+    assert summary["sent"] == 0 and summary["failed"] == 0
+    assert node.sends == 0 and node.paid == []
+    assert journal.statuses() == {"queued": 5}
+    assert "SOL_TOKEN_MINT is not set" in caplog.text
+
+
+def test_transfers_are_packed_up_to_the_packet_limit_and_sized_with_the_mint_decimals():
+    node = FakeSolanaNode()
+    batch = transfers(60)
+    distributor = make_distributor(node)
+    summary = asyncio.run(distributor.distribute(batch, MemoryJournal(batch)))
+
+    assert summary["sent"] == 60 and summary["confirmed"] == 60 and distributor._decimals == 6
+    assert all(size <= bot.SolDistributor.PACKET_SIZE for size in node.sizes)
+    # A recipient adds its wallet and token account keys and two instructions, about 90 bytes,
+    # so each transaction holds about ten and is within one more recipient of the limit.
+    assert summary["transactions"] == len(node.sizes) < 60 // 5
+    assert all(size > bot.SolDistributor.PACKET_SIZE - 100 for size in sorted(node.sizes)[1:])
+    assert sorted(node.paid) == sorted((wallet, int(round(amount * 10**6))) for _, wallet, amount in batch)
+
+
+def test_signatures_are_confirmed_with_batched_status_polls():
+    node = FakeSolanaNode()
+    batch = transfers(100)
+    journal = MemoryJournal(batch)
+    summary = asyncio.run(make_distributor(node).distribute(batch, journal))
+
+    assert summary["confirmed"] == 100 and journal.statuses() == {"confirmed": 100}
+    # Everything landed on send, so one getSignatureStatuses call covers every signature.
+    assert len(node.status_calls) == 1 and len(node.status_calls[0]) == summary["transactions"]
+
+
+def test_dropped_transaction_is_resent_until_it_lands():
+    node = FakeSolanaNode()
+    batch = transfers(5)
+    node.dropped = {batch[0][1]: 2}
+    journal = MemoryJournal(batch)
+    summary = asyncio.run(make_distributor(node).distribute(batch, journal))
+
+    assert summary["confirmed"] == 5 and summary["requeued"] == 0
+    assert len(node.status_calls) == 3  # unseen twice, resent each time, then confirmed
+    assert sorted(recipient for recipient, _ in node.paid) == sorted(wallet for _, wallet, _ in batch)
+
+
+def test_transaction_unseen_when_its_blockhash_expires_is_requeued_and_paid_once():
+    node = FakeSolanaNode(expire_after=3)
+    batch = transfers(30)
+    node.dropped = {batch[0][1]: -1}
+    journal = MemoryJournal(batch)
+    distributor = make_distributor(node)
+    summary = asyncio.run(distributor.distribute(batch, journal))
+
+    stranded = [transfer for transfer in batch if journal.rows[transfer[0]]["status"] == "queued"]
+    assert batch[0] in stranded and summary["requeued"] == len(stranded)
+    assert summary["confirmed"] == 30 - len(stranded)
+
+    node.dropped = {}
+    retry = asyncio.run(distributor.distribute(journal.queued(), journal))
+    assert retry["confirmed"] == len(stranded)
+    assert journal.statuses() == {"confirmed": 30}
+    assert sorted(recipient for recipient, _ in node.paid) == sorted(wallet for _, wallet, _ in batch)
+
+
+def test_preflight_rejection_is_split_until_the_bad_recipient_fails_alone():
+    node = FakeSolanaNode()
+    batch = transfers(16)
+    node.rejected = {batch[5][1]}
+    journal = MemoryJournal(batch)
+    summary = asyncio.run(make_distributor(node).distribute(batch, journal))
+
+    assert summary["failed"] == 1 and summary["confirmed"] == 15
+    assert journal.rows["5"]["status"] == "failed"
+    assert batch[5][1] not in {recipient for recipient, _ in node.paid}